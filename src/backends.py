@@ -0,0 +1,454 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Literal, Optional, Tuple
+
+import openai
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage
+
+from instrumentation import RequestMetrics
+from response_cache import openai_endpoint
+
+BACKEND_NAMES = Literal['openai', 'transformers', 'stub']
+
+BACKEND = os.environ.get("BACKEND", "openai")
+TRANSFORMERS_MODEL_PATH = os.environ.get("TRANSFORMERS_MODEL_PATH", "~/projects/def-zhu2048/cambish/llama3_1_8b_instruct")
+TRANSFORMERS_BATCH_SIZE = int(os.environ.get("TRANSFORMERS_BATCH_SIZE", 8))
+STUB_LATENCY = float(os.environ.get("STUB_LATENCY", 0.0))
+# the prompts end with the target language label, so most responses start with the bare translation: a streamed
+# response is cut off once its first line of content is complete. Many responses open with a preamble instead, e.g.
+# "Here is the translation:\n\n\"...\"" or "The given text translates to:\n\n...", so blank lines, lines ending
+# in ':' (also in bold) and the "Romanization: ..." line of two-step prompts are skipped, and never stopped on
+FIRST_LINE_STOP_PATTERN = (
+    r"^(?:[ \t]*\n|[^\n]*:\**[ \t]*\n|[ \t]*\**Romaniz(?:ation|ed)\b[^\n]*\n)*"
+    r"(?![ \t]*\**Romaniz(?:ation|ed)\b)[^\n]*[^\s:*]\**[ \t]*\n"
+)
+# alternative for prompts the model answers by repeating a label first, e.g. "[English]: ...\n", recognized the
+# same ways as `postprocess.TRANSLATION_PATTERNS`
+LABELED_LINE_STOP_PATTERN = r"(?:\[English\]:|Translation:|translates to:|translation:)[^\n]*\S[^\n]*\n"
+EARLY_STOP_PATTERN = os.environ.get("EARLY_STOP_PATTERN", FIRST_LINE_STOP_PATTERN)
+
+
+def make_chat_completion(
+    model: str,
+    contents: List[str],
+    prompt_tokens: Optional[int] = 0,
+    completion_tokens: int = 0,
+    completion_id: Optional[str] = None,
+    finish_reasons: Optional[List[str]] = None,
+) -> ChatCompletion:
+    """Wraps generated texts in the ChatCompletion returned by OpenAI-compatible endpoints, so responses from
+    every backend can be cached, checkpointed and read the same way
+
+    Args:
+        model (str): Name of the model that generated the texts
+        contents (List[str]): One generated text per choice
+        prompt_tokens (int, optional): Number of prompt tokens, or None if the usage is unknown. Defaults to 0.
+        completion_tokens (int, optional): Number of generated tokens over all choices. Defaults to 0.
+        completion_id (str, optional): Identifier of the completion. Defaults to one derived from the time.
+        finish_reasons (List[str], optional): Why each choice ended. Defaults to "stop" for every choice.
+
+    Returns:
+        ChatCompletion: The completion
+    """
+    created = int(time.time())
+    finish_reasons = finish_reasons if finish_reasons is not None else ["stop"] * len(contents)
+    usage = None
+    if prompt_tokens is not None:
+        usage = CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+    return ChatCompletion(
+        id=completion_id or f"chatcmpl-local-{time.time_ns()}",
+        object="chat.completion",
+        created=created,
+        model=model,
+        choices=[
+            Choice(index=i, finish_reason=finish_reason, message=ChatCompletionMessage(role="assistant", content=content))
+            for i, (content, finish_reason) in enumerate(zip(contents, finish_reasons))
+        ],
+        usage=usage,
+    )
+
+
+def early_stop_index(text: str, stop_pattern: re.Pattern) -> Optional[int]:
+    """Finds where a response can be cut off because the translation is complete
+
+    Args:
+        text (str): Response generated so far
+        stop_pattern (re.Pattern): Pattern that matches once the translation is complete
+
+    Returns:
+        Optional[int]: Length of the response to keep, without trailing whitespace, or None if the pattern does
+        not match yet
+    """
+    match = stop_pattern.search(text)
+    if match is None:
+        return None
+    return len(text[:match.end()].rstrip())
+
+
+def truncate_completion(output: ChatCompletion, stop_pattern: re.Pattern) -> ChatCompletion:
+    """Cuts every choice of a completion off at the early stop pattern. The usage is left as reported.
+
+    Args:
+        output (ChatCompletion): Completion to truncate
+        stop_pattern (re.Pattern): Pattern that matches once the translation is complete
+
+    Returns:
+        ChatCompletion: A copy of the completion with truncated choices
+    """
+    choices = []
+    for choice in output.choices:
+        content = choice.message.content or ""
+        end = early_stop_index(content, stop_pattern)
+        if end is not None:
+            choice = choice.model_copy(update={
+                "finish_reason": "stop",
+                "message": choice.message.model_copy(update={"content": content[:end]}),
+            })
+        choices.append(choice)
+    return output.model_copy(update={"choices": choices})
+
+
+def stub_completion(json_data: dict) -> ChatCompletion:
+    """Deterministic stand-in for a chat completion: echoes the sentence of the last user message, e.g.
+    "[Plains Cree]: tânisi \\n [English]:" gives "[English]: tânisi". The same request always gives the same
+    response, and token counts are whitespace-separated words.
+
+    Args:
+        json_data (dict): Keyword arguments for `client.chat.completions.create`
+
+    Returns:
+        ChatCompletion: The stub completion
+    """
+    messages = json_data["messages"]
+    lines = [line.strip() for line in messages[-1]["content"].split("\n")]
+    target_label = lines[-1] if len(lines) > 1 else ""
+    # the sentence is on the last labelled line before the target label, after any instruction
+    labelled = [line for line in lines[:-1] if "]: " in line]
+    source_text = labelled[-1].split("]: ", 1)[1] if labelled else lines[0]
+    content = f"{target_label} {source_text}".strip()
+    if json_data.get("max_tokens") is not None:
+        content = " ".join(content.split()[:json_data["max_tokens"]])
+
+    n = json_data.get("n") or 1
+    digest = hashlib.sha256(json.dumps(json_data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return make_chat_completion(
+        json_data["model"],
+        [content] * n,
+        prompt_tokens=sum(len(message["content"].split()) for message in messages),
+        completion_tokens=len(content.split()) * n,
+        completion_id=f"chatcmpl-stub-{digest[:24]}",
+    )
+
+
+class BackendError(openai.OpenAIError):
+    """A request that failed inside a backend rather than at the API, e.g. a local generation error. It is an
+    `openai.OpenAIError`, so the request layer and the engine treat it like any other failed request: it is not
+    retried, and only its row is left without a response.
+    """
+
+
+def normalize_errors(complete: Callable[[dict], Awaitable[ChatCompletion]]) -> Callable[[dict], Awaitable[ChatCompletion]]:
+    """Wraps a backend's `complete` so that every error it raises is an `openai.OpenAIError`
+
+    Args:
+        complete (Callable[[dict], Awaitable[ChatCompletion]]): Sends a request, e.g. `backend.complete`
+
+    Returns:
+        Callable[[dict], Awaitable[ChatCompletion]]: The same call, raising `BackendError` for errors that are not
+        already an `openai.OpenAIError`
+    """
+    async def complete_normalized(json_data: dict) -> ChatCompletion:
+        try:
+            return await complete(json_data)
+        except openai.OpenAIError:
+            raise
+        except Exception as e:
+            raise BackendError(f"{type(e).__name__}: {e}") from e
+
+    return complete_normalized
+
+
+class TranslationBackend:
+    """Interface of everything that can answer chat completion requests for the experiments. `complete` takes the
+    keyword arguments built by `build_completion_request` and returns a ChatCompletion.
+    """
+
+    name: str = "base"
+    # responses of different backends are cached apart, even for the same model name
+    cache_namespace: Optional[str] = None
+
+    async def complete(self, json_data: dict) -> ChatCompletion:
+        raise NotImplementedError
+
+    async def complete_streaming(
+        self,
+        json_data: dict,
+        stop_pattern: Optional[re.Pattern],
+        metrics: RequestMetrics,
+    ) -> ChatCompletion:
+        """Generates a response that is cut off once `stop_pattern` matches, recording the time to first token and
+        the completion tokens saved in `metrics`. Backends that cannot stream generate the whole response and
+        truncate it afterwards, which saves nothing.
+
+        Args:
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+            stop_pattern (re.Pattern, optional): Pattern that matches once the translation is complete, or None to
+                generate the whole response
+            metrics (RequestMetrics): Receives the time to first token and tokens saved
+
+        Returns:
+            ChatCompletion: The completion, truncated after the stop pattern
+        """
+        output = await self.complete(json_data)
+        metrics.tokens_saved = 0
+        return truncate_completion(output, stop_pattern) if stop_pattern is not None else output
+
+    async def close(self):
+        """Releases resources bound to the event loop; the backend can be used again in a new loop afterwards"""
+
+    def results_subdir(self, model: str) -> str:
+        """Returns the directory under src/results that results of `model` on this backend are saved to"""
+        return model
+
+
+class OpenAIBackend(TranslationBackend):
+    """Any OpenAI-compatible HTTP endpoint, such as the OpenAI API or a vLLM server. The endpoint and key are
+    read from OPENAI_BASE_URL and OPENAI_API_KEY unless given.
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.client: Optional[AsyncOpenAI] = None
+
+    @property
+    def cache_namespace(self) -> str:
+        # servers behind different endpoints can serve different weights under the same model name
+        return openai_endpoint(self.base_url)
+
+    def _client(self) -> AsyncOpenAI:
+        if self.client is None:
+            # retries are handled by the request layer, so the client must not retry on its own as well
+            self.client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+        return self.client
+
+    async def complete(self, json_data: dict) -> ChatCompletion:
+        return await self._client().chat.completions.create(**json_data)
+
+    async def complete_streaming(
+        self,
+        json_data: dict,
+        stop_pattern: Optional[re.Pattern],
+        metrics: RequestMetrics,
+    ) -> ChatCompletion:
+        start_time = time.perf_counter()
+        first_token = True
+        n = json_data.get("n") or 1
+        contents = [""] * n
+        finish_reasons = ["stop"] * n
+        stopped = [False] * n
+        # without usage from the server, each content chunk is counted as one token, as the server sends them
+        chunk_counts = [0] * n
+        usage = None
+        completion_id = None
+
+        stream = await self._client().chat.completions.create(
+            **json_data, stream=True, stream_options={"include_usage": True}
+        )
+        try:
+            async for chunk in stream:
+                completion_id = chunk.id
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    if choice.finish_reason is not None:
+                        finish_reasons[choice.index] = choice.finish_reason
+                    if not choice.delta.content or stopped[choice.index]:
+                        continue
+                    if first_token:
+                        metrics.ttft_seconds = time.perf_counter() - start_time
+                        first_token = False
+                    contents[choice.index] += choice.delta.content
+                    chunk_counts[choice.index] += 1
+                    if stop_pattern is not None and early_stop_index(contents[choice.index], stop_pattern) is not None:
+                        stopped[choice.index] = True
+                if all(stopped):
+                    break
+        finally:
+            # closing the connection mid-stream makes the server abort the generation
+            await stream.close()
+
+        if stop_pattern is not None:
+            for i, content in enumerate(contents):
+                end = early_stop_index(content, stop_pattern)
+                if end is not None:
+                    contents[i], finish_reasons[i] = content[:end], "stop"
+
+        max_tokens = json_data.get("max_tokens")
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            # the stream was cancelled before the server reported the usage
+            prompt_tokens, completion_tokens = None, sum(chunk_counts)
+            metrics.completion_tokens = completion_tokens
+        metrics.tokens_saved = 0
+        if all(stopped) and max_tokens is not None:
+            metrics.tokens_saved = max(0, max_tokens * n - completion_tokens)
+
+        return make_chat_completion(
+            json_data["model"],
+            contents,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            completion_id=completion_id,
+            finish_reasons=finish_reasons,
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+
+class TransformersBackend(TranslationBackend):
+    """In-process generation with `llama3_inference.TransformersWrapper`. Requests that arrive while the model is
+    busy are queued and generated together in batches of up to `batch_size` with the same sampling parameters,
+    so run it with a concurrency of at least `batch_size`. Stop sequences are not supported, but early stop
+    patterns are: each sequence of a batch stops decoding once its pattern matches.
+    """
+
+    name = "transformers"
+    cache_namespace = "transformers"
+
+    def __init__(self, wrapper, batch_size: int = TRANSFORMERS_BATCH_SIZE):
+        """
+        Args:
+            wrapper (llama3_inference.TransformersWrapper): Loaded model
+            batch_size (int, optional): Maximum number of prompts generated together. Defaults to
+                TRANSFORMERS_BATCH_SIZE.
+        """
+        self.wrapper = wrapper
+        self.batch_size = batch_size
+        self.pending: List[Tuple[dict, Optional[re.Pattern], asyncio.Future]] = []
+        self.worker: Optional[asyncio.Task] = None
+
+    async def _generate(self, json_data: dict, stop_pattern: Optional[re.Pattern] = None) -> ChatCompletion:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((json_data, stop_pattern, future))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run_batches())
+        return await future
+
+    async def complete(self, json_data: dict) -> ChatCompletion:
+        return await self._generate(json_data)
+
+    async def complete_streaming(
+        self,
+        json_data: dict,
+        stop_pattern: Optional[re.Pattern],
+        metrics: RequestMetrics,
+    ) -> ChatCompletion:
+        # tokens are not streamed out of a batch, so the time to first token stays unknown
+        output = await self._generate(json_data, stop_pattern)
+        metrics.tokens_saved = 0
+        if stop_pattern is None:
+            return output
+        # a sequence whose text matches the pattern was stopped there instead of running to its token limit
+        if all(early_stop_index(choice.message.content, stop_pattern) is not None for choice in output.choices):
+            max_tokens = json_data.get("max_tokens") or 256
+            metrics.tokens_saved = max(0, max_tokens * len(output.choices) - output.usage.completion_tokens)
+        return truncate_completion(output, stop_pattern)
+
+    async def _run_batches(self):
+        while self.pending:
+            # give the other rows of this round a chance to queue before the batch is cut
+            await asyncio.sleep(0)
+            requests, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+
+            groups: Dict[tuple, List[Tuple[dict, asyncio.Future]]] = defaultdict(list)
+            for json_data, stop_pattern, future in requests:
+                sampling = (json_data.get("temperature", 0), json_data.get("max_tokens") or 256, json_data.get("n") or 1)
+                groups[(*sampling, stop_pattern)].append((json_data, future))
+
+            for (temperature, max_tokens, n, stop_pattern), group in groups.items():
+                prompts = [json_data["messages"] for json_data, _ in group]
+                try:
+                    # generation runs in a thread so the event loop keeps queueing requests meanwhile
+                    outputs = await asyncio.to_thread(
+                        self.wrapper.generate_batch, prompts, temperature, max_tokens, n, len(prompts), stop_pattern
+                    )
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (json_data, future), output in zip(group, outputs):
+                    contents = output if n > 1 else [output]
+                    try:
+                        future.set_result(make_chat_completion(
+                            json_data["model"],
+                            contents,
+                            prompt_tokens=self.wrapper.prompt_length(json_data["messages"]),
+                            completion_tokens=sum(self.wrapper.completion_length(content) for content in contents),
+                        ))
+                    except Exception as e:
+                        # an unresolved future would leave its row waiting forever
+                        future.set_exception(e)
+
+    def results_subdir(self, model: str) -> str:
+        return os.path.join("transformers", model)
+
+
+class StubBackend(TranslationBackend):
+    """Deterministic in-process stand-in for a model server, answering every request with `stub_completion`
+    after `latency` seconds. Exercises the whole pipeline on a CPU-only machine without a model or network.
+    """
+
+    name = "stub"
+    cache_namespace = "stub"
+
+    def __init__(self, latency: float = STUB_LATENCY):
+        self.latency = latency
+
+    async def complete(self, json_data: dict) -> ChatCompletion:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return stub_completion(json_data)
+
+    def results_subdir(self, model: str) -> str:
+        return os.path.join("stub", model)
+
+
+def get_backend(name: BACKEND_NAMES = BACKEND) -> TranslationBackend:
+    """Creates the translation backend selected by name, by default from the BACKEND environment variable
+
+    Args:
+        name (BACKEND_NAMES, optional): 'openai', 'transformers' or 'stub'. Defaults to BACKEND.
+
+    Returns:
+        TranslationBackend: The backend
+    """
+    if name == 'openai':
+        return OpenAIBackend()
+    if name == 'transformers':
+        # torch and transformers are only needed, and only imported, when generating locally
+        from llama3_inference import TransformersWrapper
+        return TransformersBackend(TransformersWrapper(model_path=os.path.expanduser(TRANSFORMERS_MODEL_PATH)))
+    if name == 'stub':
+        return StubBackend()
+    raise ValueError(f"Unknown backend '{name}', expected one of {BACKEND_NAMES.__args__}")
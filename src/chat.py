@@ -1,12 +1,12 @@
 import os
 
-from time import sleep
-
 import openai
 
 from dotenv import load_dotenv
 
 from utils import get_project_root
+from response_cache import ResponseCache
+from translation_engine import build_completion_request, create_chat_completion
 
 project_dir = get_project_root(os.path.abspath(os.path.dirname(__file__)))
 dotenv_path = os.path.join(project_dir, ".env")
@@ -20,6 +20,7 @@ def openai_chat_completion(
     stop=None,
     n=None,
     model=None,
+    cache=None,
 ):
     """
     Wrapper function for creating chat completion request through OpenAI.
@@ -33,29 +34,14 @@ def openai_chat_completion(
         stop (str, optional): A string representing the stopping condition for generating text. Defaults to None.
         n (int, optional): An integer representing the number of completions to generate. Defaults to None.
         model (str, optional): A string representing the model to be used. Defaults to "MODEL".
+        cache (ResponseCache, optional): Persistent response cache to serve repeated requests from. Defaults to None.
 
     Returns:
         ChatCompletion: An instance of the ChatCompletion class.
     """
     model = os.environ.get("MODEL", "Meta-Llama-3.1-8B-Instruct")
-    json_data = {"model": model,  "messages": messages}
-    
-    if temperature is not None:
-        json_data["temperature"] = temperature
-    if max_tokens is not None:
-        json_data["max_tokens"] = max_tokens
-    if stop is not None:
-        json_data["stop"] = stop
-    if n is not None:
-        json_data["n"] = n
-
-    output = None
-    while output is None:
-        try:
-            output = client.chat.completions.create(**json_data)
-        except openai.OpenAIError as e:
-            print(e)
-            sleep(10)
+    json_data = build_completion_request(messages, model, temperature, max_tokens, stop, n)
+    output = create_chat_completion(client, json_data, cache=cache)
 
     return output
 
@@ -63,10 +49,12 @@ def openai_chat_completion(
 if __name__ == "__main__":
     
     client = openai.OpenAI()
-    
+    response_cache = ResponseCache()
+
     messages = [
         {"role": "system", "content": "You are a helpful assistant. Please answer the following question."},
         {"role": "user", "content": "what is the capital of Canada?"}
     ]
-    output = openai_chat_completion(messages=messages)
-    print(output.choices[0].message.content)
\ No newline at end of file
+    output = openai_chat_completion(messages=messages, cache=response_cache)
+    print(output.choices[0].message.content)
+    response_cache.report()
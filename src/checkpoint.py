@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+
+from typing import Dict, Optional
+
+
+def checkpoint_path_for(out_path: str) -> str:
+    """Returns the checkpoint file used while producing a given results file
+
+    Args:
+        out_path (str): Path of the results parquet the run will produce
+
+    Returns:
+        str: Path of the SQLite checkpoint next to the results file
+    """
+    return f"{os.path.splitext(out_path)[0]}.checkpoint.sqlite"
+
+
+def clear_checkpoint(path: str):
+    """Deletes a checkpoint file once the final results have been written, so the next run starts fresh
+
+    Args:
+        path (str): Path of the SQLite checkpoint
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class CheckpointStore:
+    """Append-only store of completed responses keyed by DataFrame row index, backed by a local SQLite file.
+    Every row is committed as soon as it is recorded, so an interrupted run loses at most the requests in flight.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        out_dir = os.path.dirname(path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        # rows are recorded from the engine's worker thread when it runs inside a notebook's event loop
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (row_index INTEGER PRIMARY KEY, response TEXT NOT NULL, metrics TEXT)"
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(responses)")]
+        if "metrics" not in columns:
+            # checkpoints written before request metrics were recorded
+            self.connection.execute("ALTER TABLE responses ADD COLUMN metrics TEXT")
+        self.connection.commit()
+
+    def completed(self) -> Dict[int, str]:
+        """Returns all responses recorded so far
+
+        Returns:
+            Dict[int, str]: Mapping of row index to response
+        """
+        rows = self.connection.execute("SELECT row_index, response FROM responses")
+        return {row_index: response for row_index, response in rows}
+
+    def metrics(self) -> Dict[int, dict]:
+        """Returns the request metrics, and any other columns such as sampled candidates, recorded with the
+        responses so far
+
+        Returns:
+            Dict[int, dict]: Mapping of row index to metrics, for rows recorded with metrics
+        """
+        rows = self.connection.execute("SELECT row_index, metrics FROM responses WHERE metrics IS NOT NULL")
+        return {row_index: json.loads(metrics) for row_index, metrics in rows}
+
+    def record(self, row_index: int, response: str, metrics: Optional[dict] = None):
+        """Durably records the response for a row. Rows that are already recorded are left untouched.
+
+        Args:
+            row_index (int): Index of the row in the experiment DataFrame
+            response (str): Model response for the row
+            metrics (dict, optional): Request metrics and other JSON-serializable columns of the row. Defaults to None.
+        """
+        self.connection.execute(
+            "INSERT OR IGNORE INTO responses (row_index, response, metrics) VALUES (?, ?, ?)",
+            (int(row_index), response, json.dumps(metrics) if metrics is not None else None),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
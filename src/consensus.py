@@ -0,0 +1,80 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from sklearn.feature_extraction.text import CountVectorizer
+
+from postprocess import clean_results
+
+# sacrebleu's default chrF: character n-grams up to 6, no word n-grams, recall weighted by beta = 2
+CHAR_ORDER = 6
+BETA = 2
+
+
+def pairwise_chrf(texts: List[str]) -> np.ndarray:
+    """Computes sentence-level chrF between every pair of texts in one vectorized pass. Each text's character
+    n-gram counts are extracted once, and the matches of all pairs and n-gram orders come from a single
+    element-wise minimum, giving the same scores as `CHRF().sentence_score(texts[i], [texts[j]])`.
+
+    Args:
+        texts (List[str]): Texts to compare
+
+    Returns:
+        np.ndarray: (len(texts), len(texts)) matrix of chrF scores between 0 and 100, with texts[i] as the
+        hypothesis and texts[j] as the reference
+    """
+    # like sacrebleu, character n-grams are taken over the text with its whitespace removed
+    stripped = ["".join(text.split()) for text in texts]
+    n_texts = len(texts)
+    if not any(stripped):
+        return np.zeros((n_texts, n_texts))
+
+    vectorizer = CountVectorizer(analyzer="char", ngram_range=(1, CHAR_ORDER), lowercase=False)
+    counts = vectorizer.fit_transform(stripped).toarray()
+    orders = np.array([len(ngram) for ngram in vectorizer.get_feature_names_out()])
+    # (n-grams, orders) indicator that sums counts per n-gram order
+    order_indicator = (orders[:, None] == np.arange(1, CHAR_ORDER + 1)).astype(counts.dtype)
+
+    totals = counts @ order_indicator
+    matches = np.minimum(counts[:, None, :], counts[None, :, :]) @ order_indicator
+    hyp_totals = np.broadcast_to(totals[:, None, :], matches.shape)
+    ref_totals = np.broadcast_to(totals[None, :, :], matches.shape)
+
+    # average precision and recall over the orders both texts are long enough for
+    effective = (hyp_totals > 0) & (ref_totals > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(effective, matches / hyp_totals, 0.0)
+        recall = np.where(effective, matches / ref_totals, 0.0)
+    effective_order = effective.sum(axis=-1)
+    avg_precision = np.divide(precision.sum(axis=-1), effective_order, out=np.zeros(effective_order.shape), where=effective_order > 0)
+    avg_recall = np.divide(recall.sum(axis=-1), effective_order, out=np.zeros(effective_order.shape), where=effective_order > 0)
+
+    factor = BETA ** 2
+    denominator = factor * avg_precision + avg_recall
+    return np.divide(
+        100 * (1 + factor) * avg_precision * avg_recall,
+        denominator,
+        out=np.zeros(denominator.shape),
+        where=denominator > 0,
+    )
+
+
+def mbr_select(candidates: List[str]) -> Tuple[int, np.ndarray]:
+    """Picks the consensus of several sampled responses by minimum Bayes risk decoding: the candidate with the
+    highest average chrF against all the other candidates, each used in turn as a pseudo-reference. Candidates
+    are compared after the prefixes models echo before the translation are removed.
+
+    Args:
+        candidates (List[str]): Responses sampled for the same prompt
+
+    Returns:
+        Tuple[int, np.ndarray]: Index of the consensus candidate, the first one on ties, and the expected chrF
+        of every candidate
+    """
+    if len(candidates) == 1:
+        return 0, np.array([100.0])
+    scores = pairwise_chrf([clean_results(candidate or "") for candidate in candidates])
+    # a candidate is not its own evidence
+    np.fill_diagonal(scores, 0.0)
+    expected_chrf = scores.sum(axis=1) / (len(candidates) - 1)
+    return int(np.argmax(expected_chrf)), expected_chrf
@@ -0,0 +1,33 @@
+import argparse
+import os
+import time
+
+from postprocess import evaluate_results_tree
+from utils import get_project_root
+
+project_dir = get_project_root(os.path.abspath(os.path.dirname(__file__)))
+
+RESULTS_PATH = os.path.join(project_dir, "src", "results")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every results parquet file and write a consolidated metrics table")
+    parser.add_argument("--results_dir", type=str, default=RESULTS_PATH, help="root of the results tree")
+    parser.add_argument("--output", type=str, default=os.path.join(RESULTS_PATH, "metrics"), help="output path without extension, written as .parquet and .csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of files scored in parallel")
+    parser.add_argument("--extract_translations", action="store_true", help="score the translation extracted from each response, e.g. after '[English]:', instead of the whole response")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    metrics_df = evaluate_results_tree(
+        args.results_dir,
+        n_workers=args.workers,
+        exclude=[f"{args.output}.parquet"],
+        extract=args.extract_translations,
+    )
+    print(f"Scored {len(metrics_df.index)} results files in {time.perf_counter() - start_time:.1f}s")
+
+    metrics_df.to_parquet(f"{args.output}.parquet")
+    metrics_df.to_csv(f"{args.output}.csv", index=False)
+    print(metrics_df[["model", "experiment", "n_shots", "bleu", "chrf"]].to_string(index=False))
+    print(f"Saved metrics to {args.output}.parquet and {args.output}.csv")
@@ -0,0 +1,564 @@
+import argparse
+import itertools
+import json
+import os
+import time
+
+from typing import Callable, Dict, List, Literal, NamedTuple, Optional
+
+import openai
+import pandas as pd
+
+from dotenv import load_dotenv
+
+from utils import get_project_root
+
+project_dir = get_project_root(os.path.abspath(os.path.dirname(__file__)))
+dotenv_path = os.path.join(project_dir, ".env")
+# the modules below read their configuration from the environment when imported, so .env has to be loaded first
+load_dotenv(dotenv_path)
+
+from backends import BACKEND, EARLY_STOP_PATTERN, TranslationBackend, get_backend
+from checkpoint import checkpoint_path_for, clear_checkpoint
+from few_shot_bank import DEFAULT_SEED, FewShotExampleBank
+from instrumentation import report_request_metrics, summarize_request_metrics
+from packing import build_packed_messages, pack_checkpoint_path, translate_packed
+from postprocess import TranslationScorer, get_hypotheses
+from prompt_budget import PROMPT_TOKEN_BUDGET, TOKENIZER_PATH, BudgetedPromptBuilder, PromptTokenCounter
+from request_layer import RequestLayer
+from response_cache import ResponseCache
+from translation_engine import DEFAULT_CONCURRENCY, translate_with_metrics
+from translation_memory import TranslationMemory
+
+SERIALIZED_DIR = os.path.join(project_dir, "data", "serialized")
+SERIALIZED_GOLD_STANDARD_PATH = os.path.join(SERIALIZED_DIR, "gold_standard.parquet")
+RESULTS_PATH = os.path.join(project_dir, "src", "results")
+
+STRATEGIES = Literal['zero-shot', 'dsp', 'few-shot']
+# 'user' puts the instruction in the user turn (Mistral/Gemma), 'system' in a system message (Llama 3)
+PROMPT_FORMATS = Literal['user', 'system']
+FEW_SHOT_SELECTIONS = Literal['static', 'tfidf', 'bm25']
+
+TARGET_LANGUAGE = "English"
+DOMAIN = "Legislative Proceedings"
+MAX_TOKENS = {"zero-shot": 350, "dsp": 350, "few-shot": 200}
+ZERO_SHOT_INSTRUCTION = "You are a machine translation system."
+DSP_INSTRUCTION = "You are a machine translation system that translates sentences in the {domain} domain."
+# temperature of multi-sample cells; the candidates of a greedy decode would all be the same
+SAMPLE_TEMPERATURE = 0.7
+
+
+class Dataset(NamedTuple):
+    """A test set and the language label used in its prompts"""
+    path: str
+    source_language: str
+    # few-shot examples are drawn from this gold standard; languages without one only run zero-shot and DSP
+    gold_standard_path: Optional[str] = None
+
+
+DATASETS: Dict[str, Dataset] = {
+    "syllabic": Dataset(
+        os.path.join(SERIALIZED_DIR, "test-dedup_syllabic_parallel_corpus.parquet"),
+        "Inuktitut (Syllabic)",
+        SERIALIZED_GOLD_STANDARD_PATH,
+    ),
+    "romanized": Dataset(
+        os.path.join(SERIALIZED_DIR, "test-dedup_roman_parallel_corpus.parquet"),
+        "Inuktitut (Romanized)",
+    ),
+    "cree": Dataset(
+        os.path.join(SERIALIZED_DIR, "cree_corpus.parquet"),
+        "Plains Cree",
+    ),
+}
+
+
+class ExperimentCell(NamedTuple):
+    """One run of the experiment matrix: a model translating a test set with one prompting strategy"""
+    model: str
+    language: str
+    strategy: STRATEGIES
+    n_shots: int = 0
+    # zero-shot and DSP cells can translate several sentences per request
+    pack_size: int = 1
+    # candidates sampled per request, whose consensus becomes the translation
+    n_samples: int = 1
+
+    def output_name(self, few_shot_selection: FEW_SHOT_SELECTIONS = 'static') -> str:
+        """Returns the path of the results file relative to the model's results directory, following the names
+        of the existing results tree
+        """
+        sampled = f"-mbr{self.n_samples}" if self.n_samples > 1 else ""
+        packed = f"-packed{self.pack_size}" if self.pack_size > 1 else ""
+        if self.strategy == 'zero-shot':
+            return f"{self.language}-zero-shot{packed}{sampled}.parquet"
+        if self.strategy == 'dsp':
+            name = "dsp" if self.language == "syllabic" else f"{self.language}-dsp"
+            return f"{name}{packed}{sampled}.parquet"
+        name = f"{self.n_shots}-few-shot"
+        if self.language != "syllabic":
+            name += f"-{self.language}"
+        if few_shot_selection != 'static':
+            name += f"-{few_shot_selection}"
+        return os.path.join("few-shot-results", f"{name}{sampled}.parquet")
+
+
+def build_zero_shot_messages(
+    source_text: str,
+    source_language: str,
+    target_language: str = TARGET_LANGUAGE,
+    prompt_format: PROMPT_FORMATS = 'user',
+) -> List[Dict[str, str]]:
+    """Builds the zero-shot translation prompt of a sentence
+
+    Args:
+        source_text (str): Sentence to translate
+        source_language (str): Label of the source language in the prompt
+        target_language (str, optional): Label of the target language in the prompt. Defaults to TARGET_LANGUAGE.
+        prompt_format (PROMPT_FORMATS, optional): Where the instruction goes. Defaults to 'user'.
+
+    Returns:
+        List[Dict[str, str]]: Messages to send to the model
+    """
+    if prompt_format == 'system':
+        return [
+            {"role": "system", "content": ZERO_SHOT_INSTRUCTION},
+            {"role": "user", "content": f"[{source_language}]: {source_text}\n[{target_language}]:"},
+        ]
+    return [
+        {
+            "role": "user",
+            "content": f"{ZERO_SHOT_INSTRUCTION} \n[{source_language}]: {source_text}\n[{target_language}]:",
+        },
+    ]
+
+
+def build_domain_specific_messages(
+    source_text: str,
+    source_language: str,
+    target_language: str = TARGET_LANGUAGE,
+    prompt_format: PROMPT_FORMATS = 'user',
+    domain: str = DOMAIN,
+) -> List[Dict[str, str]]:
+    """Builds the domain-specific prompt (DSP) of a sentence, which names the domain of the test set
+
+    Args:
+        source_text (str): Sentence to translate
+        source_language (str): Label of the source language in the prompt
+        target_language (str, optional): Label of the target language in the prompt. Defaults to TARGET_LANGUAGE.
+        prompt_format (PROMPT_FORMATS, optional): Where the instruction goes. Defaults to 'user'.
+        domain (str, optional): Domain of the sentences. Defaults to DOMAIN.
+
+    Returns:
+        List[Dict[str, str]]: Messages to send to the model
+    """
+    instruction = DSP_INSTRUCTION.format(domain=domain)
+    if prompt_format == 'system':
+        return [
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": f"[{source_language}]: {source_text}\n[{target_language}]:"},
+        ]
+    return [
+        {
+            "role": "user",
+            "content": f"{instruction} \n [{source_language}]: {source_text}\n[{target_language}]:",
+        }
+    ]
+
+
+def build_matrix(
+    models: List[str],
+    languages: List[str],
+    strategies: List[STRATEGIES],
+    n_shots: List[int],
+    pack_sizes: List[int] = (1,),
+    n_samples: List[int] = (1,),
+) -> List[ExperimentCell]:
+    """Expands the experiment matrix into cells. Number of shots only varies few-shot cells, pack size only
+    varies zero-shot and DSP cells, number of samples varies every cell, and few-shot cells are left out for
+    languages without a gold standard.
+
+    Args:
+        models (List[str]): Model names served by the backend
+        languages (List[str]): Keys of DATASETS
+        strategies (List[STRATEGIES]): Prompting strategies
+        n_shots (List[int]): Numbers of examples for the few-shot strategy
+        pack_sizes (List[int], optional): Numbers of sentences per request for the zero-shot and DSP strategies,
+            1 for one sentence per request. Defaults to (1,).
+        n_samples (List[int], optional): Numbers of candidates sampled per request, 1 for a single greedy
+            translation. Defaults to (1,).
+
+    Returns:
+        List[ExperimentCell]: Cells ordered by model, language and strategy
+    """
+    for language in languages:
+        if language not in DATASETS:
+            raise ValueError(f"Unknown language '{language}', expected one of {list(DATASETS)}")
+    for strategy in strategies:
+        if strategy not in STRATEGIES.__args__:
+            raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES.__args__}")
+
+    cells = []
+    for model, language, strategy, samples in itertools.product(models, languages, strategies, n_samples):
+        if strategy != 'few-shot':
+            cells.extend(ExperimentCell(model, language, strategy, pack_size=k, n_samples=samples) for k in pack_sizes)
+        elif DATASETS[language].gold_standard_path is None:
+            print(f"Skipping few-shot for {language}: no gold standard to draw examples from")
+        else:
+            cells.extend(ExperimentCell(model, language, strategy, n, n_samples=samples) for n in n_shots)
+    return cells
+
+
+class ExperimentRunner:
+    """Runs experiment cells one after the other against one backend. Each test set and the gold standard are
+    read from disk once and shared by every cell that uses them, as are the few-shot example banks.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[TranslationBackend] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        prompt_format: PROMPT_FORMATS = 'user',
+        few_shot_selection: FEW_SHOT_SELECTIONS = 'static',
+        few_shot_seed: int = DEFAULT_SEED,
+        n_example_sets: int = 1,
+        results_dir: str = RESULTS_PATH,
+        force: bool = False,
+        early_stop: bool = False,
+        early_stop_pattern: str = EARLY_STOP_PATTERN,
+        deduplicate: bool = False,
+        sample_temperature: float = SAMPLE_TEMPERATURE,
+    ):
+        """
+        Args:
+            backend (TranslationBackend, optional): Backend answering the requests. Defaults to the one selected
+                by the BACKEND environment variable.
+            concurrency (int, optional): Maximum number of requests in flight. Defaults to DEFAULT_CONCURRENCY.
+            prompt_format (PROMPT_FORMATS, optional): Prompt format of zero-shot and DSP cells. Defaults to 'user'.
+            few_shot_selection (FEW_SHOT_SELECTIONS, optional): How few-shot examples are chosen. Defaults to 'static'.
+            few_shot_seed (int, optional): Seed of static example sets. Defaults to DEFAULT_SEED.
+            n_example_sets (int, optional): Number of static example sets. Defaults to 1.
+            results_dir (str, optional): Root of the results tree. Defaults to RESULTS_PATH.
+            force (bool, optional): Rerun cells whose results file already exists. Defaults to False.
+            early_stop (bool, optional): Stream responses and cancel them once the translation line is complete,
+                saving the truncated responses. Defaults to False.
+            early_stop_pattern (str, optional): Regular expression that matches once the translation is complete.
+                Defaults to EARLY_STOP_PATTERN.
+            deduplicate (bool, optional): Translate each distinct sentence of a test set once and keep every
+                translation in the persistent translation memory, so no segment is translated twice across runs.
+                Defaults to False.
+            sample_temperature (float, optional): Sampling temperature of cells with more than one sample.
+                Defaults to SAMPLE_TEMPERATURE.
+        """
+        self.backend = backend if backend is not None else get_backend(BACKEND)
+        self.response_cache = ResponseCache(namespace=self.backend.cache_namespace)
+        # one request layer for the whole sweep, so every cell shares the rate limits
+        self.request_layer = RequestLayer()
+        self.concurrency = concurrency
+        self.prompt_format = prompt_format
+        self.few_shot_selection = few_shot_selection
+        self.few_shot_seed = few_shot_seed
+        self.n_example_sets = n_example_sets
+        self.results_dir = results_dir
+        self.force = force
+        self.early_stop_pattern = early_stop_pattern if early_stop else None
+        self.deduplicate = deduplicate
+        self.sample_temperature = sample_temperature
+        self.translation_memory = TranslationMemory(namespace=self.backend.cache_namespace) if deduplicate else None
+        self.datasets: Dict[str, pd.DataFrame] = {}
+        self.example_banks: Dict[tuple, object] = {}
+        self.budgeted_builders: Dict[tuple, object] = {}
+        self.token_counter = None
+
+    def load_dataset(self, path: str) -> pd.DataFrame:
+        """Reads a parquet file the first time it is needed and returns the same DataFrame afterwards"""
+        if path not in self.datasets:
+            print(f"Loading {path}")
+            self.datasets[path] = pd.read_parquet(path)
+        return self.datasets[path]
+
+    def example_bank(self, cell: ExperimentCell):
+        """Returns the few-shot example bank of a cell, shared by every cell with the same language and shots"""
+        key = (cell.language, cell.n_shots)
+        if key in self.example_banks:
+            return self.example_banks[key]
+
+        dataset = DATASETS[cell.language]
+        gold_standard = self.load_dataset(dataset.gold_standard_path)
+        if self.few_shot_selection == 'static':
+            bank = FewShotExampleBank(
+                gold_standard,
+                cell.n_shots,
+                n_sets=self.n_example_sets,
+                seed=self.few_shot_seed,
+                source_language=dataset.source_language,
+                target_language=TARGET_LANGUAGE,
+            )
+        else:
+            from few_shot_retrieval import RetrievalExampleBank
+            # examples for the whole test set are retrieved up front in one batched query
+            bank = RetrievalExampleBank(
+                gold_standard,
+                cell.n_shots,
+                source_texts=self.load_dataset(dataset.path)["source_text"],
+                method=self.few_shot_selection,
+                source_language=dataset.source_language,
+                target_language=TARGET_LANGUAGE,
+            )
+        self.example_banks[key] = bank
+        return bank
+
+    def prompt_builder(self, cell: ExperimentCell) -> Callable[[str], List[Dict[str, str]]]:
+        """Returns the function building the prompt of each sentence of a cell"""
+        source_language = DATASETS[cell.language].source_language
+        if cell.strategy == 'zero-shot':
+            return lambda source_text: build_zero_shot_messages(
+                source_text, source_language, TARGET_LANGUAGE, self.prompt_format
+            )
+        if cell.strategy == 'dsp':
+            return lambda source_text: build_domain_specific_messages(
+                source_text, source_language, TARGET_LANGUAGE, self.prompt_format
+            )
+        return self.budgeted_builder(cell).build_messages if TOKENIZER_PATH is not None else self.example_bank(cell).build_messages
+
+    def packed_prompt_builder(self, cell: ExperimentCell) -> Callable[[str], List[Dict[str, str]]]:
+        """Returns the function building the prompt of a block of numbered sentences of a zero-shot or DSP cell"""
+        if cell.strategy == 'few-shot':
+            raise ValueError("Only zero-shot and DSP cells can pack several sentences per request")
+        source_language = DATASETS[cell.language].source_language
+        instruction = ZERO_SHOT_INSTRUCTION if cell.strategy == 'zero-shot' else DSP_INSTRUCTION.format(domain=DOMAIN)
+        return lambda numbered_sentences: build_packed_messages(
+            numbered_sentences, source_language, TARGET_LANGUAGE, instruction, self.prompt_format
+        )
+
+    def prompt_token_counter(self) -> PromptTokenCounter:
+        """Returns the token counter of TOKENIZER_PATH, loading the tokenizer the first time it is needed"""
+        if self.token_counter is None:
+            self.token_counter = PromptTokenCounter.from_pretrained(TOKENIZER_PATH)
+        return self.token_counter
+
+    def budgeted_builder(self, cell: ExperimentCell) -> BudgetedPromptBuilder:
+        """Returns the few-shot prompt builder of a cell that packs its examples into PROMPT_TOKEN_BUDGET"""
+        key = (cell.language, cell.n_shots)
+        if key not in self.budgeted_builders:
+            self.budgeted_builders[key] = BudgetedPromptBuilder(
+                self.example_bank(cell).build_messages,
+                self.prompt_token_counter(),
+                budget=PROMPT_TOKEN_BUDGET,
+                drop_examples_from="end" if self.few_shot_selection == 'static' else "start",
+            )
+        return self.budgeted_builders[key]
+
+    def prompt_tokens(self, cell: ExperimentCell, results_df: pd.DataFrame) -> pd.Series:
+        """Returns the number of prompt tokens of every row of a cell. With TOKENIZER_PATH set, single-sentence
+        prompts are counted with the model's tokenizer; otherwise, and for packed prompts, the count is the one
+        the backend reported for the row's request, missing for rows answered from the translation memory.
+        """
+        if TOKENIZER_PATH is None or cell.pack_size > 1:
+            return results_df["request_prompt_tokens"]
+        if cell.strategy == 'few-shot':
+            return results_df["source_text"].map(self.budgeted_builder(cell).prompt_tokens)
+        counter, build_messages = self.prompt_token_counter(), self.prompt_builder(cell)
+        return results_df["source_text"].map(lambda source_text: counter.count(build_messages(source_text)))
+
+    def output_path(self, cell: ExperimentCell) -> str:
+        return os.path.join(
+            self.results_dir,
+            self.backend.results_subdir(cell.model),
+            cell.output_name(self.few_shot_selection),
+        )
+
+    def run_cell(self, cell: ExperimentCell) -> dict:
+        """Translates the test set of a cell and saves the results
+
+        Args:
+            cell (ExperimentCell): Cell to run
+
+        Returns:
+            dict: Summary of the run, with status 'done', 'skipped' if its results already exist, or 'incomplete'
+            if some rows failed, in which case no results are saved and the checkpoints are kept for the next run
+        """
+        out_path = self.output_path(cell)
+        summary = {**cell._asdict(), "output": out_path}
+        if os.path.exists(out_path) and not self.force:
+            print(f"Skipping {cell}: {out_path} already exists")
+            return {**summary, "status": "skipped"}
+
+        out_dir = os.path.dirname(out_path)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        checkpoint_path = checkpoint_path_for(out_path)
+
+        print(f"Running {cell}")
+        results_df = self.load_dataset(DATASETS[cell.language].path).copy()
+        start_time = time.perf_counter()
+        engine_kwargs = dict(
+            concurrency=self.concurrency,
+            checkpoint_path=checkpoint_path,
+            cache=self.response_cache,
+            backend=self.backend,
+            request_layer=self.request_layer,
+            max_tokens=MAX_TOKENS[cell.strategy],
+            early_stop_pattern=self.early_stop_pattern,
+            deduplicate=self.deduplicate,
+            translation_memory=self.translation_memory,
+        )
+        if cell.n_samples > 1:
+            # all candidates come from one request, sharing its prompt
+            engine_kwargs.update(n=cell.n_samples, temperature=self.sample_temperature)
+        if cell.pack_size > 1:
+            translations_df, requests_df = translate_packed(
+                results_df["source_text"],
+                self.packed_prompt_builder(cell),
+                self.prompt_builder(cell),
+                cell.model,
+                cell.pack_size,
+                **engine_kwargs,
+            )
+        else:
+            translations_df = translate_with_metrics(
+                results_df["source_text"], self.prompt_builder(cell), cell.model, **engine_kwargs
+            )
+            requests_df = translations_df
+        # one column per request metric next to the response, for comparing serving configurations later
+        results_df[translations_df.columns] = translations_df
+        elapsed_time = time.perf_counter() - start_time
+        print("Total time elapsed:", elapsed_time)
+        print("Average processing time:", elapsed_time / len(results_df.index))
+        request_summary = summarize_request_metrics(requests_df, elapsed_time)
+        report_request_metrics(request_summary)
+        summary.update({"rows": len(results_df.index), "seconds": elapsed_time, **request_summary})
+        summary["sentences_per_second"] = len(results_df.index) / elapsed_time if elapsed_time > 0 else None
+
+        if "target_text" in results_df.columns:
+            # scored like postprocess.evaluate_results_file, so packed and single-sentence cells can be compared
+            scores = TranslationScorer().score(get_hypotheses(results_df).to_list(), results_df["target_text"].fillna("").to_list())
+            summary["bleu"] = scores["corpus_bleu"].score
+            summary["chrf"] = scores["corpus_chrf"].score
+            print(f"BLEU {summary['bleu']:.2f}, chrF {summary['chrf']:.2f}")
+
+        if cell.strategy == 'few-shot':
+            bank = self.example_bank(cell)
+            results_df["example_indices"] = results_df["source_text"].map(bank.example_indices)
+            if TOKENIZER_PATH is not None:
+                builder = self.budgeted_builder(cell)
+                results_df["n_examples"] = results_df["source_text"].map(builder.n_examples)
+                builder.report()
+        results_df["prompt_tokens"] = self.prompt_tokens(cell, results_df)
+        print("Prompt tokens:", results_df["prompt_tokens"].describe().to_dict())
+
+        n_failed = int(results_df["response"].isna().sum())
+        if n_failed:
+            # without a results file the cell is run again next time, resuming from the checkpoints kept here
+            print(f"{n_failed} rows failed; not saving {out_path} and keeping the checkpoint to retry them")
+            return {**summary, "failed": n_failed, "status": "incomplete"}
+
+        results_df.to_parquet(out_path)
+        clear_checkpoint(checkpoint_path)
+        clear_checkpoint(pack_checkpoint_path(checkpoint_path))
+        print(f"Saved results to {out_path}")
+        return {**summary, "failed": 0, "status": "done"}
+
+    def run(self, cells: List[ExperimentCell]) -> pd.DataFrame:
+        """Runs cells in order
+
+        Args:
+            cells (List[ExperimentCell]): Cells to run
+
+        Returns:
+            pd.DataFrame: One summary row per cell
+        """
+        summaries = [self.run_cell(cell) for cell in cells]
+        self.response_cache.report()
+        if self.translation_memory is not None:
+            self.translation_memory.report()
+        self.request_layer.report()
+        return pd.DataFrame(summaries)
+
+
+def check_api_key():
+    """Exits if the OpenAI API key is missing from the environment"""
+    openai.api_key = os.environ.get('OPENAI_API_KEY')
+    if openai.api_key is None:
+        print("Error reading OpenAI API key from environment variable")
+        exit(1)
+    print("API Key Obtained Successfully!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a matrix of translation experiments")
+    parser.add_argument("--config", type=str, default=None, help="JSON file with any of the options below, e.g. {\"models\": [...], \"strategies\": [\"zero-shot\", \"few-shot\"]}")
+    parser.add_argument("--models", nargs="+", default=None, help="model names served by the backend")
+    parser.add_argument("--languages", nargs="+", default=None, help=f"test sets, any of {list(DATASETS)}")
+    parser.add_argument("--strategies", nargs="+", default=None, help=f"prompting strategies, any of {list(STRATEGIES.__args__)}")
+    parser.add_argument("--n_shots", nargs="+", type=int, default=None, help="numbers of few-shot examples")
+    parser.add_argument("--pack_sizes", nargs="+", type=int, default=None, help="numbers of sentences per zero-shot and DSP request, 1 for no packing")
+    parser.add_argument("--n_samples", nargs="+", type=int, default=None, help="numbers of candidates sampled per request for consensus decoding, 1 for greedy decoding")
+    parser.add_argument("--backend", type=str, default=None, help="openai, transformers or stub")
+    parser.add_argument("--concurrency", type=int, default=None, help="maximum number of requests in flight")
+    parser.add_argument("--prompt_format", type=str, default=None, help="user or system")
+    parser.add_argument("--few_shot_selection", type=str, default=None, help="static, tfidf or bm25")
+    parser.add_argument("--few_shot_seed", type=int, default=None, help="seed of static few-shot examples")
+    parser.add_argument("--n_example_sets", type=int, default=None, help="number of static few-shot example sets")
+    parser.add_argument("--force", action="store_true", help="rerun cells whose results file already exists")
+    parser.add_argument("--early_stop", action="store_true", help="stream responses and cancel them once the translation line is complete")
+    parser.add_argument("--early_stop_pattern", type=str, default=None, help="regular expression that matches once the translation is complete, by default the end of the first line of content after any preamble; backends.LABELED_LINE_STOP_PATTERN waits for a labeled line instead")
+    parser.add_argument("--sample_temperature", type=float, default=None, help="sampling temperature of multi-sample cells")
+    parser.add_argument("--deduplicate", action="store_true", help="translate each distinct sentence once and remember translations across runs")
+    parser.add_argument("--results_dir", type=str, default=None, help="root of the results tree, e.g. a scratch directory for stub load tests")
+    args = parser.parse_args()
+
+    config = {
+        "models": [os.environ.get("MODEL", "Meta-Llama-3.1-8B-Instruct")],
+        "languages": ["syllabic"],
+        "strategies": ["zero-shot"],
+        "n_shots": [1, 5, 10, 20],
+        "pack_sizes": [1],
+        "n_samples": [1],
+        "sample_temperature": SAMPLE_TEMPERATURE,
+        "backend": BACKEND,
+        "concurrency": int(os.environ.get("CONCURRENCY", DEFAULT_CONCURRENCY)),
+        "prompt_format": "user",
+        "few_shot_selection": os.environ.get("FEW_SHOT_STRATEGY", "static"),
+        "few_shot_seed": int(os.environ.get("FEW_SHOT_SEED", DEFAULT_SEED)),
+        "n_example_sets": int(os.environ.get("N_EXAMPLE_SETS", 1)),
+        "force": False,
+        "early_stop": False,
+        "early_stop_pattern": EARLY_STOP_PATTERN,
+        "deduplicate": False,
+        "results_dir": RESULTS_PATH,
+    }
+    if args.config is not None:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    # options given on the command line override the config file
+    config.update({key: value for key, value in vars(args).items() if key != "config" and value not in (None, False)})
+
+    cells = build_matrix(
+        config["models"],
+        config["languages"],
+        config["strategies"],
+        config["n_shots"],
+        config["pack_sizes"],
+        config["n_samples"],
+    )
+    print(f"Running {len(cells)} experiments on the {config['backend']} backend")
+    if config["backend"] == "openai":
+        check_api_key()
+
+    runner = ExperimentRunner(
+        backend=get_backend(config["backend"]),
+        concurrency=config["concurrency"],
+        prompt_format=config["prompt_format"],
+        few_shot_selection=config["few_shot_selection"],
+        few_shot_seed=config["few_shot_seed"],
+        n_example_sets=config["n_example_sets"],
+        force=config["force"],
+        early_stop=config["early_stop"],
+        early_stop_pattern=config["early_stop_pattern"],
+        deduplicate=config["deduplicate"],
+        sample_temperature=config["sample_temperature"],
+        results_dir=config["results_dir"],
+    )
+    summary_df = runner.run(cells)
+    print(summary_df.to_string(index=False))
@@ -0,0 +1,129 @@
+import zlib
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import format_n_shot_examples
+
+DEFAULT_SEED = 12345
+DEFAULT_SYSTEM_PROMPT = "You are a machine translation system."
+
+
+def format_example_messages(
+    examples: pd.DataFrame,
+    source_language: str,
+    target_language: str,
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+) -> Tuple[Dict[str, str], ...]:
+    """Formats gold standard examples as the system message followed by alternating user/assistant turns
+
+    Args:
+        examples (pd.DataFrame): Gold standard rows with `source_text` and `target_text` columns
+        source_language (str): Label of the source language in the prompt
+        target_language (str): Label of the target language in the prompt
+        system_prompt (str, optional): System message opening the prompt. Defaults to DEFAULT_SYSTEM_PROMPT.
+
+    Returns:
+        Tuple[Dict[str, str], ...]: Prompt prefix shared by every sentence translated with these examples
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    for source, target in zip(examples["source_text"], examples["target_text"]):
+        messages.append({"role": "user", "content": f"[{source_language}]: {source}"})
+        messages.append({"role": "assistant", "content": f"[{target_language}]: {target}"})
+    return tuple(messages)
+
+
+def format_query_message(source_text: str, source_language: str, target_language: str) -> Dict[str, str]:
+    """Formats the final user turn asking for the translation of a sentence"""
+    return {
+        "role": "user",
+        "content": f"[{source_language}]: {source_text} \n [{target_language}]:"
+    }
+
+
+class FewShotExampleBank:
+    """Few-shot example sets drawn once from the gold standard and formatted into reusable prompt prefixes.
+    Every row translated with the same set sends an identical prefix, so a server with prefix caching only
+    prefills the examples once. Sets are drawn from a seeded generator, so the same seed gives the same prompts.
+    """
+
+    def __init__(
+        self,
+        gold_standard: pd.DataFrame,
+        n_shots: int,
+        n_sets: int = 1,
+        seed: int = DEFAULT_SEED,
+        source_language: str = "Inuktitut (Syllabic)",
+        target_language: str = "English",
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    ):
+        """
+        Args:
+            gold_standard (pd.DataFrame): Gold standard with `source_text` and `target_text` columns
+            n_shots (int): Number of examples in each set
+            n_sets (int, optional): Number of distinct example sets rows are spread over. Defaults to 1.
+            seed (int, optional): Seed of the example selection. Defaults to DEFAULT_SEED.
+            source_language (str, optional): Label of the source language in the prompt. Defaults to "Inuktitut (Syllabic)".
+            target_language (str, optional): Label of the target language in the prompt. Defaults to "English".
+            system_prompt (str, optional): System message opening every prompt. Defaults to DEFAULT_SYSTEM_PROMPT.
+        """
+        self.n_shots = n_shots
+        self.n_sets = n_sets
+        self.seed = seed
+        self.source_language = source_language
+        self.target_language = target_language
+
+        rng = np.random.default_rng(seed)
+        self.example_sets: List[pd.DataFrame] = [
+            gold_standard.sample(n=n_shots, replace=False, random_state=rng)[["source_text", "target_text"]]
+            for _ in range(n_sets)
+        ]
+        self.prefixes: List[Tuple[Dict[str, str], ...]] = [
+            format_example_messages(example_set, source_language, target_language, system_prompt)
+            for example_set in self.example_sets
+        ]
+        self.example_texts: List[str] = [format_n_shot_examples(example_set) for example_set in self.example_sets]
+
+    def select(self, source_text: str) -> int:
+        """Picks the example set for a source sentence. The choice depends only on the text, so it is stable
+        across runs and processes.
+
+        Args:
+            source_text (str): Sentence to translate
+
+        Returns:
+            int: Index of the example set
+        """
+        if self.n_sets == 1:
+            return 0
+        return zlib.crc32(source_text.encode("utf-8")) % self.n_sets
+
+    def build_messages(self, source_text: str) -> List[Dict[str, str]]:
+        """Builds the chat messages for a source sentence from its precomputed example prefix
+
+        Args:
+            source_text (str): Sentence to translate
+
+        Returns:
+            List[Dict[str, str]]: Messages to send to the model
+        """
+        messages = list(self.prefixes[self.select(source_text)])
+        messages.append(format_query_message(source_text, self.source_language, self.target_language))
+        return messages
+
+    def example_indices(self, source_text: str) -> List:
+        """Returns the gold standard index labels of the examples used for a source sentence"""
+        return self.example_sets[self.select(source_text)].index.to_list()
+
+    def examples_text(self, source_text: str) -> str:
+        """Returns the example set for a source sentence in the plain text format of `generate_n_shot_examples`
+
+        Args:
+            source_text (str): Sentence to translate
+
+        Returns:
+            str: A string containing the examples for few-shot learning
+        """
+        return self.example_texts[self.select(source_text)]
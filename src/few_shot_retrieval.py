@@ -0,0 +1,216 @@
+from typing import Dict, Iterable, List, Literal, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from few_shot_bank import DEFAULT_SYSTEM_PROMPT, format_example_messages, format_query_message
+from utils import format_n_shot_examples
+
+RETRIEVAL_METHODS = Literal['tfidf', 'bm25']
+
+# character n-grams inside word boundaries match shared morphemes of polysynthetic words without a segmenter
+DEFAULT_NGRAM_RANGE = (2, 4)
+# number of queries scored at once, bounds memory to query_batch_size x n_examples scores
+DEFAULT_QUERY_BATCH_SIZE = 1024
+
+
+def normalize_source_text(text: str) -> str:
+    """Collapses whitespace, so a sentence is recognized as the same however it was tokenized"""
+    return " ".join(text.split())
+
+
+class ExampleRetriever:
+    """Sparse character n-gram index over the gold standard source sentences. Scores a whole batch of queries
+    against every example with one sparse matrix product and returns the top-k examples of each query. Examples
+    whose source sentence is the query itself are never returned, since their target would be the reference
+    translation of a sentence the gold standard shares with the test set.
+    """
+
+    def __init__(
+        self,
+        gold_standard: pd.DataFrame,
+        method: RETRIEVAL_METHODS = 'tfidf',
+        ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        """
+        Args:
+            gold_standard (pd.DataFrame): Gold standard with a `source_text` column
+            method (RETRIEVAL_METHODS, optional): 'tfidf' for cosine similarity of TF-IDF vectors or 'bm25' for
+                Okapi BM25. Defaults to 'tfidf'.
+            ngram_range (Tuple[int, int], optional): Range of character n-gram lengths. Defaults to DEFAULT_NGRAM_RANGE.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.2.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+        """
+        if method not in ('tfidf', 'bm25'):
+            raise ValueError(f"Unknown retrieval method '{method}', expected 'tfidf' or 'bm25'")
+        self.method = method
+        source_texts = gold_standard["source_text"].fillna("")
+        # positions of the examples sharing each source sentence, to leave out of that sentence's results
+        self.positions_by_text: Dict[str, np.ndarray] = {
+            text: positions.to_numpy()
+            for text, positions in pd.Series(np.arange(len(source_texts.index))).groupby(
+                source_texts.map(normalize_source_text).to_numpy(), sort=False
+            )
+        }
+
+        if method == 'tfidf':
+            self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=ngram_range, sublinear_tf=True)
+            # rows are L2-normalized, so the dot product of two rows is their cosine similarity
+            self.example_matrix = self.vectorizer.fit_transform(source_texts).T.tocsr()
+            return
+
+        self.vectorizer = CountVectorizer(analyzer="char_wb", ngram_range=ngram_range)
+        counts = self.vectorizer.fit_transform(source_texts).tocsr().astype(np.float64)
+        n_examples = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log((n_examples - document_frequency + 0.5) / (document_frequency + 0.5) + 1)
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        length_norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1e-9))
+
+        # BM25 weight of every (example, n-gram) pair, computed on the non-zero entries only
+        row_of_entry = np.repeat(np.arange(n_examples), np.diff(counts.indptr))
+        tf = counts.data
+        counts.data = idf[counts.indices] * tf * (k1 + 1) / (tf + length_norm[row_of_entry])
+        self.example_matrix = counts.T.tocsr()
+
+    def _encode_queries(self, source_texts: List[str]) -> sp.csr_matrix:
+        queries = self.vectorizer.transform(source_texts)
+        if self.method == 'bm25':
+            # each distinct query n-gram contributes its example weight once
+            queries.data = np.ones_like(queries.data, dtype=np.float64)
+        return queries
+
+    def scores(self, source_texts: Iterable[str]) -> np.ndarray:
+        """Scores queries against every example
+
+        Args:
+            source_texts (Iterable[str]): Sentences to find examples for
+
+        Returns:
+            np.ndarray: Dense matrix of similarities, one row per query and one column per gold standard example
+        """
+        return (self._encode_queries(list(source_texts)) @ self.example_matrix).toarray()
+
+    def query(self, source_texts: Iterable[str], k: int, batch_size: int = DEFAULT_QUERY_BATCH_SIZE) -> np.ndarray:
+        """Finds the k most similar gold standard examples for each query, other than the examples of the query
+        sentence itself
+
+        Args:
+            source_texts (Iterable[str]): Sentences to find examples for
+            k (int): Number of examples per query
+            batch_size (int, optional): Number of queries scored at once. Defaults to DEFAULT_QUERY_BATCH_SIZE.
+
+        Returns:
+            np.ndarray: Positions of the examples in the gold standard, one row per query, most similar first
+        """
+        source_texts = ["" if text is None else text for text in source_texts]
+        n_examples = self.example_matrix.shape[1]
+        if k > n_examples:
+            raise ValueError(f"Cannot retrieve {k} examples from a gold standard of {n_examples}")
+
+        neighbours = np.empty((len(source_texts), k), dtype=np.int64)
+        for start in range(0, len(source_texts), batch_size):
+            batch = source_texts[start:start + batch_size]
+            scores = self.scores(batch)
+            for row, text in enumerate(batch):
+                identical = self.positions_by_text.get(normalize_source_text(text))
+                if identical is not None:
+                    scores[row, identical] = -np.inf
+            top_k = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            # argpartition leaves the top k unordered; sort them by score, breaking ties by position
+            top_scores = np.take_along_axis(scores, top_k, axis=1)
+            if np.isneginf(top_scores).any():
+                raise ValueError(f"Cannot retrieve {k} examples that differ from the sentence to translate")
+            order = np.lexsort((top_k, -top_scores), axis=1)
+            neighbours[start:start + len(scores)] = np.take_along_axis(top_k, order, axis=1)
+        return neighbours
+
+
+class RetrievalExampleBank:
+    """Few-shot examples retrieved per sentence from the gold standard. Exposes the same interface as
+    `FewShotExampleBank`, so either can build the prompts of a few-shot experiment.
+    """
+
+    def __init__(
+        self,
+        gold_standard: pd.DataFrame,
+        n_shots: int,
+        source_texts: Iterable[str] = (),
+        method: RETRIEVAL_METHODS = 'tfidf',
+        source_language: str = "Inuktitut (Syllabic)",
+        target_language: str = "English",
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    ):
+        """
+        Args:
+            gold_standard (pd.DataFrame): Gold standard with `source_text` and `target_text` columns
+            n_shots (int): Number of examples retrieved for each sentence
+            source_texts (Iterable[str], optional): Sentences to retrieve examples for up front in one batch.
+                Other sentences are looked up when first requested. Defaults to ().
+            method (RETRIEVAL_METHODS, optional): Scoring method of the index. Defaults to 'tfidf'.
+            source_language (str, optional): Label of the source language in the prompt. Defaults to "Inuktitut (Syllabic)".
+            target_language (str, optional): Label of the target language in the prompt. Defaults to "English".
+            system_prompt (str, optional): System message opening every prompt. Defaults to DEFAULT_SYSTEM_PROMPT.
+        """
+        self.gold_standard = gold_standard[["source_text", "target_text"]]
+        self.n_shots = n_shots
+        self.source_language = source_language
+        self.target_language = target_language
+        self.system_prompt = system_prompt
+        self.retriever = ExampleRetriever(gold_standard, method=method)
+        self.neighbours: Dict[str, np.ndarray] = {}
+        self.retrieve(source_texts)
+
+    def retrieve(self, source_texts: Iterable[str]):
+        """Retrieves and stores the examples of every sentence not looked up yet, in one vectorized query
+
+        Args:
+            source_texts (Iterable[str]): Sentences to translate
+        """
+        missing = list(dict.fromkeys(text for text in source_texts if text not in self.neighbours))
+        if not missing:
+            return
+        # most similar example last, right before the sentence to translate
+        for text, positions in zip(missing, self.retriever.query(missing, self.n_shots)[:, ::-1]):
+            self.neighbours[text] = positions
+
+    def examples(self, source_text: str) -> pd.DataFrame:
+        """Returns the gold standard rows retrieved for a source sentence"""
+        if source_text not in self.neighbours:
+            self.retrieve([source_text])
+        return self.gold_standard.iloc[self.neighbours[source_text]]
+
+    def build_messages(self, source_text: str) -> List[Dict[str, str]]:
+        """Builds the chat messages for a source sentence from its retrieved examples
+
+        Args:
+            source_text (str): Sentence to translate
+
+        Returns:
+            List[Dict[str, str]]: Messages to send to the model
+        """
+        messages = list(format_example_messages(
+            self.examples(source_text), self.source_language, self.target_language, self.system_prompt
+        ))
+        messages.append(format_query_message(source_text, self.source_language, self.target_language))
+        return messages
+
+    def example_indices(self, source_text: str) -> List:
+        """Returns the gold standard index labels of the examples used for a source sentence"""
+        return self.examples(source_text).index.to_list()
+
+    def examples_text(self, source_text: str) -> str:
+        """Returns the retrieved examples for a source sentence in the plain text format of `generate_n_shot_examples`
+
+        Args:
+            source_text (str): Sentence to translate
+
+        Returns:
+            str: A string containing the examples for few-shot learning
+        """
+        return format_n_shot_examples(self.examples(source_text))
@@ -0,0 +1,114 @@
+from typing import Optional
+
+import pandas as pd
+
+from openai.types.chat import ChatCompletion
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class RequestMetrics:
+    """Timings and token counts of one translation request. Times are in seconds:
+    queue time runs from when the row is scheduled until its first attempt is sent (concurrency slot and rate
+    limit waits), latency from the first attempt until the response is complete (including retries), and time to
+    first token is only known for streamed responses. Tokens saved counts the completion tokens a request that
+    stopped early was still allowed to generate, an upper bound on the decoding it avoided. Rows answered from the
+    translation memory or copied from an identical sentence earlier in the test set send no request. Rows restored
+    from a checkpoint keep the metrics recorded when they were sent and are marked as resumed.
+    """
+
+    __slots__ = (
+        "queue_seconds", "ttft_seconds", "latency_seconds", "prompt_tokens", "completion_tokens", "retries",
+        "tokens_saved", "cached", "memory", "duplicate", "resumed",
+    )
+
+    def __init__(self):
+        self.queue_seconds: float = 0.0
+        self.ttft_seconds: Optional[float] = None
+        self.latency_seconds: float = 0.0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.retries: int = 0
+        self.tokens_saved: Optional[int] = None
+        self.cached: bool = False
+        self.memory: bool = False
+        self.duplicate: bool = False
+        self.resumed: bool = False
+
+    def record_usage(self, output: ChatCompletion):
+        """Copies the token counts reported with a completion"""
+        if output.usage is not None:
+            self.prompt_tokens = output.usage.prompt_tokens
+            self.completion_tokens = output.usage.completion_tokens
+
+    def as_dict(self) -> dict:
+        """Returns the metrics as results columns, prefixed with `request_`"""
+        return {f"request_{field}": getattr(self, field) for field in self.__slots__}
+
+
+def summarize_request_metrics(metrics_df: pd.DataFrame, elapsed_seconds: float) -> dict:
+    """Summarizes the per-row request metrics of a run. Responses served from the response cache, the translation
+    memory, a checkpoint or a duplicate row are counted but left out of the latency percentiles.
+
+    Args:
+        metrics_df (pd.DataFrame): Results with the `request_` columns of `RequestMetrics.as_dict`
+        elapsed_seconds (float): Wall-clock time of the run
+
+    Returns:
+        dict: Request counts, p50/p95/p99 of queue time, time to first token and latency, token throughput and
+        the tokens saved by stopping early
+    """
+    # rows restored from an older checkpoint have no metrics and are neither sent nor cached
+    sent = metrics_df[
+        metrics_df["request_cached"].eq(False)
+        & metrics_df["request_memory"].ne(True)
+        & metrics_df["request_duplicate"].ne(True)
+    ]
+    summary = {
+        "requests": len(sent.index),
+        "cached": int(metrics_df["request_cached"].eq(True).sum()),
+        "memory": int(metrics_df["request_memory"].eq(True).sum()),
+        "duplicates": int(metrics_df["request_duplicate"].eq(True).sum()),
+        "retries": int(sent["request_retries"].sum()),
+    }
+    for column in ("queue_seconds", "ttft_seconds", "latency_seconds"):
+        values = sent[f"request_{column}"].dropna().astype(float)
+        for percentile in PERCENTILES:
+            name = f"{column.removesuffix('_seconds')}_p{int(percentile * 100)}"
+            summary[name] = values.quantile(percentile) if len(values.index) else None
+
+    # throughput only counts the requests sent during this run
+    sent_now = sent[sent["request_resumed"].eq(False)]
+    completion_tokens = sent_now["request_completion_tokens"].fillna(0).sum()
+    prompt_tokens = sent_now["request_prompt_tokens"].fillna(0).sum()
+    summary["prompt_tokens"] = int(prompt_tokens)
+    summary["completion_tokens"] = int(completion_tokens)
+    summary["tokens_saved"] = int(sent_now["request_tokens_saved"].fillna(0).sum())
+    summary["early_stops"] = int(sent_now["request_tokens_saved"].fillna(0).gt(0).sum())
+    summary["completion_tokens_per_second"] = completion_tokens / elapsed_seconds if elapsed_seconds > 0 else None
+    summary["total_tokens_per_second"] = (prompt_tokens + completion_tokens) / elapsed_seconds if elapsed_seconds > 0 else None
+    return summary
+
+
+def report_request_metrics(summary: dict):
+    """Prints the summary returned by `summarize_request_metrics`"""
+    def seconds(value):
+        return "n/a" if value is None or pd.isna(value) else f"{value:.3f}s"
+
+    print(
+        f"Requests: {summary['requests']} sent, {summary['cached']} cached, {summary['memory']} from translation "
+        f"memory, {summary['duplicates']} duplicates, {summary['retries']} retries"
+    )
+    for name in ("queue", "ttft", "latency"):
+        percentiles = ", ".join(
+            f"p{int(p * 100)} {seconds(summary[f'{name}_p{int(p * 100)}'])}" for p in PERCENTILES
+        )
+        print(f"  {name}: {percentiles}")
+    if summary["completion_tokens_per_second"] is not None:
+        print(
+            f"  tokens: {summary['prompt_tokens']} prompt, {summary['completion_tokens']} completion, "
+            f"{summary['completion_tokens_per_second']:.1f} completion tokens/s, "
+            f"{summary['total_tokens_per_second']:.1f} total tokens/s"
+        )
+    if summary["early_stops"]:
+        print(f"  early stop: {summary['early_stops']} responses cut off, up to {summary['tokens_saved']} completion tokens saved")
@@ -2,64 +2,170 @@ from transformers import AutoTokenizer
 import transformers
 import torch
 import argparse
+import os
+import time
+
+import pandas as pd
+
+class PatternStoppingCriteria(transformers.StoppingCriteria):
+    """Stops each sequence of a batch once its generated text matches a pattern, e.g. the end of the translation
+    line. Generation ends when every sequence has stopped or reached its token limit.
+    """
+
+    def __init__(self, tokenizer, stop_pattern):
+        self.tokenizer = tokenizer
+        self.stop_pattern = stop_pattern
+        self.prompt_length = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.prompt_length is None:
+            # the first call comes after one new token was appended to the padded prompts
+            self.prompt_length = input_ids.shape[1] - 1
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return torch.tensor([self.stop_pattern.search(text) is not None for text in texts], device=input_ids.device)
+
 
 class TransformersWrapper:
-    def __init__(self, model_path="~/projects/def-zhu2048/cambish/llama3_1_8b_instruct"):
+    def __init__(self, model_path="~/projects/def-zhu2048/cambish/llama3_1_8b_instruct", torch_dtype=torch.bfloat16):
         self.model = transformers.pipeline(
             task="text-generation",
             model=model_path,
-            model_kwargs={"torch_dtype": torch.bfloat16},
+            model_kwargs={"torch_dtype": torch_dtype},
             device_map="auto"
         )
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
 
+        # decoder-only models have to be left-padded when prompts are generated in batches
+        self.model.tokenizer.padding_side = "left"
+        if self.model.tokenizer.pad_token is None:
+            self.model.tokenizer.pad_token = self.model.tokenizer.eos_token
+
+    def _generation_kwargs(self, temperature, max_tokens, numSample):
+        """Sampling arguments shared by `generate` and `generate_batch`. Earlier versions sampled several responses
+        with top_k=1, which returned `numSample` copies of the greedy response, and passed a temperature of 0 on
+        to sampling, which transformers rejects. Now every sample draws from the top_p=0.95 nucleus, so samples
+        differ as consensus decoding needs, and a temperature of 0 decodes greedily like the API.
+        """
+        kwargs = {
+            "do_sample": True,
+            "num_return_sequences": numSample,
+            "max_new_tokens": max_tokens,
+            "return_full_text": False,
+            "temperature": temperature,
+            "top_p": 0.95,
+            "pad_token_id": self.tokenizer.eos_token_id,
+        }
+        if not temperature:
+            # sampling requires a positive temperature, so temperature 0 means greedy decoding as on the API
+            kwargs["do_sample"] = False
+            del kwargs["temperature"], kwargs["top_p"]
+        return kwargs
+
     def generate(self, input, temperature, max_tokens, numSample):
-        top_p = 0.95
+        """Generates the response to one prompt, sampling as described in `_generation_kwargs`
+
+        Args:
+            input (str | List[dict]): Prompt, as a string or a list of chat messages
+            temperature (float): Sampling temperature, 0 for greedy decoding
+            max_tokens (int): Maximum number of new tokens per response
+            numSample (int): Number of responses to sample
+
+        Returns:
+            str | List[str]: The response, or a list of `numSample` independently sampled responses when numSample > 1
+        """
+        sequences = self.model(input, **self._generation_kwargs(temperature, max_tokens, numSample))
+
         if numSample > 1:
             responses = []
-            sequences = self.model(
-                input,
-                do_sample=True,
-                top_k=1,
-                num_return_sequences=numSample,
-                max_new_tokens=max_tokens,
-                return_full_text=False,
-                temperature=temperature,
-                top_p=top_p,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
-
             for seq in sequences:
                 response = seq['generated_text']
                 responses.append(response)
             return responses
 
         else:
-            sequences = self.model(
-                input,
-                do_sample=True,
-                num_return_sequences=1,
-                max_new_tokens=max_tokens,
-                return_full_text=False,
-                temperature=temperature,
-                top_p=top_p,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
-
             seq = sequences[0]
             response = seq['generated_text']
 
             return response
 
+    def prompt_length(self, prompt):
+        """Counts the tokens in a prompt, which is either a plain string or a list of chat messages
+
+        Args:
+            prompt (str | List[dict]): Prompt to count
+
+        Returns:
+            int: Number of prompt tokens
+        """
+        if isinstance(prompt, str):
+            return len(self.tokenizer(prompt)["input_ids"])
+        return len(self.tokenizer.apply_chat_template(prompt, tokenize=True, add_generation_prompt=True))
+
+    def completion_length(self, text):
+        """Counts the tokens of a generated response, which has no BOS token unlike a tokenized prompt
+
+        Args:
+            text (str): Generated response
+
+        Returns:
+            int: Number of generated tokens
+        """
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def generate_batch(self, inputs, temperature, max_tokens, numSample=1, batch_size=8, stop_pattern=None):
+        """Generates responses for many prompts at once. Prompts are sorted by token length so each batch pads
+        as little as possible, and the responses are returned in the original order.
+
+        Args:
+            inputs (List | pd.Series): Prompts to generate for, as strings or lists of chat messages
+            temperature (float): Sampling temperature
+            max_tokens (int): Maximum number of new tokens per response
+            numSample (int, optional): Number of responses to sample per prompt. Defaults to 1.
+            batch_size (int, optional): Number of prompts run through the model together. Defaults to 8.
+            stop_pattern (re.Pattern, optional): Each response stops being generated once its text matches this
+                pattern. Defaults to None.
+
+        Returns:
+            List | pd.Series: One response per prompt (a list of responses when numSample > 1), as a Series with
+            the same index when `inputs` is a Series
+        """
+        prompts = list(inputs)
+        order = sorted(range(len(prompts)), key=lambda i: self.prompt_length(prompts[i]), reverse=True)
+        generation_kwargs = self._generation_kwargs(temperature, max_tokens, numSample)
+
+        outputs = [None] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            if stop_pattern is not None:
+                # the criteria remember the prompt length of their batch, so every batch gets its own
+                generation_kwargs["stopping_criteria"] = transformers.StoppingCriteriaList(
+                    [PatternStoppingCriteria(self.tokenizer, stop_pattern)]
+                )
+            sequences = self.model(
+                [prompts[i] for i in batch_indices],
+                batch_size=len(batch_indices),
+                **generation_kwargs
+            )
+            for i, seqs in zip(batch_indices, sequences):
+                responses = [seq['generated_text'] for seq in seqs]
+                outputs[i] = responses if numSample > 1 else responses[0]
+
+        if isinstance(inputs, pd.Series):
+            return pd.Series(outputs, index=inputs.index)
+        return outputs
+
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Define Parameters")
     parser.add_argument('-test_dataset', action='store_true') # test custom prompt by default, set flag to run predictions over a specific dataset
-    parser.add_argument("--temp", type=float, default=0.0, help = "temperature for sampling")
+    parser.add_argument("--temp", type=float, default=0.0, help = "temperature for sampling, 0 for greedy decoding")
     parser.add_argument("--max_len", type=int, default=200, help = "max number of tokens in answer")
     parser.add_argument("--num_sample", type=int, default=1, help = "number of answers to sample")
     parser.add_argument("--model_path", type=str, default="~/projects/def-zhu2048/cambish/llama3_1_8b_instruct", help = "path to llm")
+    parser.add_argument("--batch_size", type=int, default=8, help = "number of prompts generated together")
+    parser.add_argument("--dataset_path", type=str, default=None, help = "parquet file with a source_text column, used with -test_dataset")
+    parser.add_argument("--output_path", type=str, default=None, help = "parquet file to save responses to, used with -test_dataset")
     args = parser.parse_args()
 
     # Set up Model
@@ -79,4 +185,26 @@ if __name__ == "__main__":
 
         print("The question being asked is: " + prompt)
         print("The generated answer is: \n" )
-        print(output)
\ No newline at end of file
+        print(output)
+
+    else:
+        source_language = os.environ.get("SOURCE_LANGUAGE", "Inuktitut (Syllabic)")
+        target_language = os.environ.get("TARGET_LANGUAGE", "English")
+
+        df = pd.read_parquet(args.dataset_path)
+        prompts = df["source_text"].apply(
+            lambda source_text: [
+                {"role": "system", "content": "You are a machine translation system."},
+                {"role": "user", "content": f"[{source_language}]: {source_text}\n[{target_language}]:"},
+            ]
+        )
+
+        start_time = time.perf_counter()
+        df["response"] = model.generate_batch(prompts, args.temp, args.max_len, args.num_sample, batch_size=args.batch_size)
+        elapsed_time = time.perf_counter() - start_time
+        print("Total time elapsed:", elapsed_time)
+        print("Average processing time:", elapsed_time / len(df.index))
+
+        if args.output_path is not None:
+            df.to_parquet(args.output_path)
+            print("Saved results to disk")
@@ -0,0 +1,128 @@
+import hashlib
+import inspect
+import json
+import os
+
+from typing import Callable, Dict, List, Optional
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    """Computes the SHA-256 of a file's contents without reading it into memory at once
+
+    Args:
+        path (str): File to hash
+        block_size (int, optional): Number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_version(functions: List[Callable], extra: Optional[List[str]] = None) -> str:
+    """Fingerprints the source code of the functions that produce an output, so editing them invalidates it
+
+    Args:
+        functions (List[Callable]): Functions whose source determines the output
+        extra (List[str], optional): Other values the output depends on, such as regex patterns. Defaults to None.
+
+    Returns:
+        str: Short hex digest identifying this version of the code
+    """
+    digest = hashlib.sha256()
+    for function in functions:
+        digest.update(inspect.getsource(function).encode("utf-8"))
+    for value in extra or []:
+        digest.update(value.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class BuildManifest:
+    """Records the content hashes of the inputs and the code version each output was built from, stored as JSON.
+    Hashes are only recomputed for inputs whose size or modification time changed since they were recorded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def _fingerprint(self, path: str, previous: Optional[dict] = None) -> dict:
+        stat = os.stat(path)
+        if previous is not None and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            return previous
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_file(path)}
+
+    def is_up_to_date(self, output: str, inputs: List[str], version: str) -> bool:
+        """Checks whether an output exists and was built from the current inputs and code version
+
+        Args:
+            output (str): Path of the output file
+            inputs (List[str]): Paths of the files the output is built from
+            version (str): Version of the code producing the output
+
+        Returns:
+            bool: True if the output does not need to be rebuilt
+        """
+        entry = self.entries.get(output)
+        if entry is None or not os.path.exists(output) or entry["version"] != version:
+            return False
+        if sorted(entry["inputs"]) != sorted(inputs):
+            return False
+        for input_file in inputs:
+            if not os.path.exists(input_file):
+                return False
+            previous = entry["inputs"][input_file]
+            fingerprint = self._fingerprint(input_file, previous)
+            if fingerprint["sha256"] != previous["sha256"]:
+                return False
+            # keep the new mtime of a touched but unchanged input so it is not hashed again next run
+            entry["inputs"][input_file] = fingerprint
+        return True
+
+    def snapshot_inputs(self, output: str, inputs: List[str]) -> Dict[str, dict]:
+        """Fingerprints the inputs of an output as they are now. Taken before the output is built, so an input
+        edited while the build runs does not look up to date on the next run.
+
+        Args:
+            output (str): Path of the output file
+            inputs (List[str]): Paths of the files the output is built from
+
+        Returns:
+            Dict[str, dict]: Size, modification time and content hash of each input
+        """
+        previous_inputs = self.entries.get(output, {}).get("inputs", {})
+        return {
+            input_file: self._fingerprint(input_file, previous_inputs.get(input_file))
+            for input_file in inputs
+        }
+
+    def record(self, output: str, inputs: List[str], version: str, snapshot: Optional[Dict[str, dict]] = None):
+        """Records the inputs and code version an output was just built from
+
+        Args:
+            output (str): Path of the output file
+            inputs (List[str]): Paths of the files the output is built from
+            version (str): Version of the code producing the output
+            snapshot (Dict[str, dict], optional): Fingerprints of the inputs taken by `snapshot_inputs` before the
+                build started. Defaults to fingerprinting the inputs now.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot_inputs(output, inputs)
+        self.entries[output] = {"version": version, "inputs": {input_file: snapshot[input_file] for input_file in inputs}}
+
+    def save(self):
+        """Writes the manifest to disk, replacing the previous file atomically"""
+        manifest_dir = os.path.dirname(self.path)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,206 @@
+import os
+import re
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import RequestMetrics
+from translation_engine import translate_with_metrics
+from translation_memory import deduplicate_source_texts, report_duplicates
+
+# a numbered answer line, e.g. "3. The meeting is adjourned." or "3) [English]: The meeting is adjourned."
+NUMBERED_LINE_PATTERN = re.compile(r"^\s*(\d+)[.)](?:\s+(?:\[English\]:\s*)?(.*?))?\s*$")
+
+
+def number_sentences(source_texts: List[str]) -> str:
+    """Joins sentences into the numbered block of a packed prompt, one sentence per line starting at 1"""
+    return "\n".join(f"{i}. {' '.join(text.split())}" for i, text in enumerate(source_texts, start=1))
+
+
+def build_packed_messages(
+    numbered_sentences: str,
+    source_language: str,
+    target_language: str,
+    instruction: str,
+    prompt_format: str = 'user',
+) -> List[Dict[str, str]]:
+    """Builds a prompt asking for the translations of several numbered sentences at once
+
+    Args:
+        numbered_sentences (str): Sentences joined by `number_sentences`
+        source_language (str): Label of the source language in the prompt
+        target_language (str): Label of the target language in the prompt
+        instruction (str): Instruction of the single-sentence prompt, e.g. "You are a machine translation system."
+        prompt_format (str, optional): 'user' puts the instruction in the user turn, 'system' in a system
+            message. Defaults to 'user'.
+
+    Returns:
+        List[Dict[str, str]]: Messages to send to the model
+    """
+    instruction = (
+        f"{instruction} Translate each numbered {source_language} sentence into {target_language}. Answer with "
+        f"one line per sentence, numbered the same way, and nothing else."
+    )
+    content = f"[{source_language}]:\n{numbered_sentences}\n[{target_language}]:"
+    if prompt_format == 'system':
+        return [{"role": "system", "content": instruction}, {"role": "user", "content": content}]
+    return [{"role": "user", "content": f"{instruction} \n{content}"}]
+
+
+def demultiplex_numbered_lines(response: Optional[str], n_sentences: int) -> List[Optional[str]]:
+    """Splits the response to a packed prompt back into one translation per sentence. Parsing is strict: numbered
+    lines must count up from 1 to `n_sentences` without repeats, or none of the translations can be trusted to
+    line up with their sentences. A sentence whose line is missing, empty or followed by unnumbered text before
+    the next numbered line gets no translation.
+
+    Args:
+        response (str, optional): Model response, or None if the request failed
+        n_sentences (int): Number of sentences in the prompt
+
+    Returns:
+        List[Optional[str]]: Translation of each sentence, None where demultiplexing failed
+    """
+    translations: List[Optional[str]] = [None] * n_sentences
+    if response is None:
+        return translations
+
+    previous_number = 0
+    for line in response.splitlines():
+        if not line.strip():
+            continue
+        match = NUMBERED_LINE_PATTERN.match(line)
+        if match is None:
+            # text before the first line is a preamble and text after the last line a note, but text in
+            # between may be the rest of a translation that spans lines
+            if 0 < previous_number < n_sentences:
+                translations[previous_number - 1] = None
+            continue
+        number = int(match.group(1))
+        if number <= previous_number or number > n_sentences:
+            return [None] * n_sentences
+        translations[number - 1] = match.group(2) or None
+        previous_number = number
+    return translations
+
+
+def pack_checkpoint_path(checkpoint_path: str) -> str:
+    """Returns the checkpoint file of the packed requests, kept next to the checkpoint of single-sentence requests"""
+    return f"{os.path.splitext(checkpoint_path)[0]}-packs.sqlite"
+
+
+def translate_packed(
+    source_texts: pd.Series,
+    build_packed_messages: Callable[[str], List[Dict[str, str]]],
+    build_messages: Callable[[str], List[Dict[str, str]]],
+    model: str,
+    pack_size: int,
+    max_tokens: Optional[int] = None,
+    checkpoint_path: Optional[str] = None,
+    early_stop_pattern: Optional[str] = None,
+    deduplicate: bool = False,
+    **engine_kwargs,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Translates a column of source texts `pack_size` sentences per request. Each response is split back into
+    per-row translations with `demultiplex_numbered_lines`, and rows that cannot be demultiplexed are sent again
+    as single-sentence requests.
+
+    Args:
+        source_texts (pd.Series): Column of texts to translate
+        build_packed_messages (Callable[[str], List[Dict[str, str]]]): Function building the prompt of a block of
+            sentences numbered by `number_sentences`
+        build_messages (Callable[[str], List[Dict[str, str]]]): Function building the single-sentence prompt of
+            a source text, for the fallback requests
+        model (str): Name of the model served by the endpoint
+        pack_size (int): Number of sentences per packed request
+        max_tokens (int, optional): Maximum number of tokens to generate per sentence. Defaults to None.
+        checkpoint_path (str, optional): Checkpoint of the single-sentence requests; the packed requests are
+            checkpointed at `pack_checkpoint_path(checkpoint_path)`. Defaults to None.
+        early_stop_pattern (str, optional): Regular expression that matches once a single-sentence translation is
+            complete. Packed responses are then cut off once the line of their last sentence is complete.
+            Defaults to None.
+        deduplicate (bool, optional): Pack each distinct sentence once and copy its translation to its repeats.
+            Defaults to False.
+        **engine_kwargs: Further arguments of `translate_with_metrics`, such as the backend and cache
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: One row per source text, with the same index, holding the `response`,
+        the `pack_id` and `packed_response` it was split from (missing for fallback rows) and the `request_`
+        metrics of the request that produced it, plus the sampled `candidates` of that request when `n` is above 1;
+        and the `request_` metrics of every request sent, packed and fallback
+    """
+    if pack_size < 2:
+        raise ValueError(f"pack_size must be at least 2, got {pack_size}")
+
+    unique_texts, representatives = source_texts, None
+    if deduplicate:
+        unique_texts, representatives = deduplicate_source_texts(source_texts)
+        report_duplicates(source_texts, representatives)
+
+    pack_ids = pd.Series(np.arange(len(unique_texts.index)) // pack_size, index=unique_texts.index)
+    packs = pd.Series(
+        [number_sentences(texts.to_list()) for _, texts in unique_texts.groupby(pack_ids, sort=True)],
+    )
+    print(f"Packing {len(unique_texts.index)} sentences into {len(packs.index)} requests of up to {pack_size}")
+    # a pack is cut off at the line of its own last sentence, so the final pack, which may be shorter, is sent
+    # with its own stop pattern
+    pack_lengths = unique_texts.groupby(pack_ids, sort=True).size()
+    packs_df = pd.concat([
+        translate_with_metrics(
+            packs[pack_lengths == pack_length],
+            build_packed_messages,
+            model,
+            max_tokens=max_tokens * pack_size if max_tokens is not None else None,
+            checkpoint_path=pack_checkpoint_path(checkpoint_path) if checkpoint_path is not None else None,
+            early_stop_pattern=rf"(?m)^\s*{pack_length}[.)]\s+\S[^\n]*\n" if early_stop_pattern is not None else None,
+            **engine_kwargs,
+        )
+        for pack_length in pack_lengths.unique()
+    ]).sort_index()
+
+    translations = {}
+    for pack_id, texts in unique_texts.groupby(pack_ids, sort=True):
+        lines = demultiplex_numbered_lines(packs_df.at[pack_id, "response"], len(texts.index))
+        translations.update(zip(texts.index, lines))
+    failed = unique_texts[[translations[row_index] is None for row_index in unique_texts.index]]
+    print(f"Demultiplexed {len(unique_texts.index) - len(failed.index)} of {len(unique_texts.index)} sentences, "
+          f"{len(failed.index)} sent again one by one")
+
+    fallback_df = translate_with_metrics(
+        failed,
+        build_messages,
+        model,
+        max_tokens=max_tokens,
+        checkpoint_path=checkpoint_path,
+        early_stop_pattern=early_stop_pattern,
+        **engine_kwargs,
+    )
+
+    metric_columns = list(RequestMetrics().as_dict())
+    # with several samples, the consensus of each packed response is demultiplexed and its candidates are kept
+    candidate_columns = [column for column in ("candidates", "candidate_chrf") if column in packs_df.columns]
+    rows = {}
+    for row_index in unique_texts.index:
+        if row_index in fallback_df.index:
+            rows[row_index] = fallback_df.loc[row_index].to_dict()
+            continue
+        pack = packs_df.loc[pack_ids[row_index]]
+        rows[row_index] = {
+            "response": translations[row_index],
+            "pack_id": pack_ids[row_index],
+            "packed_response": pack["response"],
+            # the rows of a pack share the metrics and candidates of its request
+            **pack[metric_columns + candidate_columns].to_dict(),
+        }
+    if representatives is not None:
+        duplicate_metrics = RequestMetrics()
+        duplicate_metrics.duplicate = True
+        for row_index, representative in representatives.items():
+            if row_index not in rows:
+                rows[row_index] = {**rows[representative], **duplicate_metrics.as_dict()}
+
+    columns = ["response", "pack_id", "packed_response", *metric_columns, *candidate_columns]
+    results_df = pd.DataFrame([rows[row_index] for row_index in source_texts.index], index=source_texts.index, columns=columns)
+    requests_df = pd.concat([packs_df[metric_columns], fallback_df[metric_columns]], ignore_index=True)
+    return results_df, requests_df
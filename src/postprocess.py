@@ -1,10 +1,23 @@
 #%%
 import os
 import re
+import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import sacrebleu
 from sacrebleu.metrics import BLEU, CHRF
 
+# TranslationScorer reuses sacrebleu's private `_extract_corpus_statistics` and `_compute_score_from_stats`,
+# whose signatures are only stable within a major version, so the supported version is pinned here
+SACREBLEU_MAJOR_VERSION = 2
+if int(sacrebleu.__version__.split(".")[0]) != SACREBLEU_MAJOR_VERSION:
+    raise ImportError(
+        f"sacrebleu {SACREBLEU_MAJOR_VERSION}.x is required for TranslationScorer, found {sacrebleu.__version__}"
+    )
+
 def find_parquet_files(directory):
     """Finds a list of all nested parquet files in a given directory
 
@@ -44,30 +57,72 @@ def convert_parquet_to_excel(parquet_file):
     df.to_excel(output_file, index=False)
     print(f"Converted {parquet_file} to {output_file}")
 
-def extract_translation(text):
-    patterns = [
-        r"\[English\]:\s*(.*?)(?:\n|$)",            # Capture text after [English]:
-        r"Translation:\s*\"(.*?)\"",                # Capture text in quotes after Translation:
-        r"translates to:\s*(.*?)(?:\n|$)",          # Capture text after translates to: without quotes
-        r"translation:\s*(.*?)(?:\n|$)",            # Capture text after translation:
-    ]
+# All known ways models introduce their translation. Each format is scanned on its own, so a response where two
+# formats overlap, e.g. "[English]: The translation: hello", yields the translation of both.
+TRANSLATION_PATTERNS = [
+    re.compile(r"\[English\]:\s*(.*?)(?:\n|$)", re.DOTALL),     # Capture text after [English]:
+    re.compile(r"Translation:\s*\"(.*?)\"", re.DOTALL),          # Capture text in quotes after Translation:
+    re.compile(r"translates to:\s*(.*?)(?:\n|$)", re.DOTALL),   # Capture text after translates to: without quotes
+    re.compile(r"translation:\s*(.*?)(?:\n|$)", re.DOTALL),     # Capture text after translation:
+]
 
-    translations = []
+# Prefixes models echo in front of the predicted translation, removed in this order
+RESULT_PREFIX_PATTERN = re.compile(r"^(?:\(Inuktitut\): )?(?:\[Inuktitut\]: )?(?:\[English\]: )?")
 
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.DOTALL)
-        translations.extend(matches)  # Collect all matches
 
+def _unique_translations(matches: List[str]) -> List[str]:
     # Clean up the translations (e.g., strip extra whitespace and remove [English]: prefix)
-    translations = [t.strip(' "').removeprefix("[English]: ") for t in translations]
-    # remove duplicate strings
-    translations = [t for t in set(translations)]
+    translations = [t.strip(' "').removeprefix("[English]: ") for t in matches]
+    # remove duplicate strings, keeping the first occurrence
+    return list(dict.fromkeys(translations))
+
+
+def extract_translation(text):
+    """Extracts every translation a model response introduces with one of the known formats
+
+    Args:
+        text (str): model response
+
+    Returns:
+        List[str]: unique translations, in the order of TRANSLATION_PATTERNS and then of the response
+    """
+    return _unique_translations([match for pattern in TRANSLATION_PATTERNS for match in pattern.findall(text)])
+
+
+def extract_translation_series(texts: pd.Series) -> pd.Series:
+    """Vectorized equivalent of extract_translation for a whole column of model responses
+
+    Args:
+        texts (pd.Series): model responses
+
+    Returns:
+        pd.Series: list of extracted translations for each response
+    """
+    # object dtype, so that every pattern is applied with Python's re like extract_translation
+    texts = texts.fillna("").astype(object)
+    matches = [texts.str.findall(pattern) for pattern in TRANSLATION_PATTERNS]
+    return pd.Series(
+        [_unique_translations([match for found in row for match in found]) for row in zip(*matches)],
+        index=texts.index,
+        dtype=object,
+    )
 
-    return translations
 
 def clean_results(text:str):
     # remove common prefixes in predicted translation
-    return text.removeprefix("(Inuktitut): ").removeprefix("[Inuktitut]: ").removeprefix("[English]: ")
+    return RESULT_PREFIX_PATTERN.sub("", text, count=1)
+
+
+def clean_results_series(texts: pd.Series) -> pd.Series:
+    """Vectorized equivalent of clean_results for a whole column of model responses
+
+    Args:
+        texts (pd.Series): model responses
+
+    Returns:
+        pd.Series: responses without the prefixes models echo before the translation
+    """
+    return texts.str.replace(RESULT_PREFIX_PATTERN, "", n=1, regex=True)
 
 
 def calculate_sentence_bleu(hypothesis_text: str, target_text: str):
@@ -99,34 +154,208 @@ def calculate_sentence_chrf(hypothesis_text: str, target_text: str):
     return sentence_chrf.score
 
 
+class TranslationScorer:
+    """Scores translations at the sentence and corpus level from a single pass of n-gram statistics.
+    The sacrebleu metric objects are built once and reused, and every score is computed from the same
+    per-sentence sufficient statistics that sacrebleu itself sums for corpus scores, so results match
+    `BLEU.sentence_score`, `CHRF.sentence_score` and `corpus_score` exactly.
+    """
+
+    def __init__(self):
+        # sentence-level BLEU needs effective order, corpus-level BLEU keeps sacrebleu's default
+        self.sentence_bleu = BLEU(effective_order=True)
+        self.bleu = BLEU()
+        self.chrf = CHRF()
+
+    def sentence_statistics(self, hypotheses: List[str], references: List[str]):
+        """Extracts the BLEU and CHRF sufficient statistics of every hypothesis/reference pair
+
+        Args:
+            hypotheses (List[str]): translation hypotheses
+            references (List[str]): ground truth for each hypothesis
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: BLEU and CHRF statistics, one row per sentence
+        """
+        # sacrebleu expects a list of reference streams, each with one reference per hypothesis
+        bleu_stats = np.array(self.bleu._extract_corpus_statistics(hypotheses, [references]), dtype=np.int64)
+        chrf_stats = np.array(self.chrf._extract_corpus_statistics(hypotheses, [references]), dtype=np.int64)
+        return bleu_stats, chrf_stats
+
+    def score(self, hypotheses: List[str], references: List[str]) -> dict:
+        """Computes sentence-level and corpus-level BLEU and CHRF for a set of translations
+
+        Args:
+            hypotheses (List[str]): translation hypotheses
+            references (List[str]): ground truth for each hypothesis
+
+        Returns:
+            dict: 'sentence_bleu' and 'sentence_chrf' arrays, 'corpus_bleu' and 'corpus_chrf' score objects,
+            and the 'bleu_signature' and 'chrf_signature' of the corpus metrics
+        """
+        bleu_stats, chrf_stats = self.sentence_statistics(hypotheses, references)
+        return {
+            "sentence_bleu": np.array([self.sentence_bleu._compute_score_from_stats(row.tolist()).score for row in bleu_stats]),
+            "sentence_chrf": np.array([self.chrf._compute_score_from_stats(row.tolist()).score for row in chrf_stats]),
+            "corpus_bleu": self.bleu._compute_score_from_stats(bleu_stats.sum(axis=0).tolist()),
+            "corpus_chrf": self.chrf._compute_score_from_stats(chrf_stats.sum(axis=0).tolist()),
+            "bleu_signature": self.bleu.get_signature(),
+            "chrf_signature": self.chrf.get_signature(),
+        }
+
+    def score_dataframe(self, df: pd.DataFrame, hypothesis_column="hypothesis_text", reference_column="target_text") -> dict:
+        """Adds 'sentence_bleu' and 'sentence_chrf' columns to a results DataFrame and returns its corpus scores
+
+        Args:
+            df (pd.DataFrame): results DataFrame
+            hypothesis_column (str, optional): column with the translation hypotheses. Defaults to "hypothesis_text".
+            reference_column (str, optional): column with the ground truth. Defaults to "target_text".
+
+        Returns:
+            dict: the scores computed by `score`
+        """
+        scores = self.score(df[hypothesis_column].to_list(), df[reference_column].to_list())
+        df["sentence_bleu"] = scores["sentence_bleu"]
+        df["sentence_chrf"] = scores["sentence_chrf"]
+        return scores
+
+
+def get_hypotheses(df: pd.DataFrame, extract: bool = False) -> pd.Series:
+    """Gets the translation hypotheses of a results DataFrame, re-applying the current postprocessing to the raw model
+    responses when they are available
+
+    Args:
+        df (pd.DataFrame): results DataFrame
+        extract (bool, optional): Use the first translation `extract_translation_series` finds in each response,
+            instead of the whole response, when there is one. Defaults to False.
+
+    Returns:
+        pd.Series: translation hypotheses
+    """
+    if "response" in df.columns:
+        hypotheses = clean_results_series(df["response"].fillna(""))
+        if extract:
+            extracted = extract_translation_series(df["response"]).str[0]
+            hypotheses = extracted.where(extracted.notna(), hypotheses)
+        return hypotheses
+    if "translated_text" in df.columns:
+        return df["translated_text"].fillna("")
+    raise KeyError("results have neither a 'response' nor a 'translated_text' column")
+
+
+def describe_results_file(parquet_file: str, results_dir: str) -> dict:
+    """Works out the model, experiment and number of shots of a results file from its path, e.g.
+    <results_dir>/Meta-Llama-3.1-8B-Instruct/few-shot-results/10-few-shot.parquet
+
+    Args:
+        parquet_file (path-like object): path to results parquet file
+        results_dir (path-like object): root of the results tree
+
+    Returns:
+        dict: 'model', 'experiment' and 'n_shots' of the results file
+    """
+    parts = os.path.relpath(parquet_file, results_dir).split(os.sep)
+    directories = [part for part in parts[:-1] if part != "few-shot-results"]
+    experiment = os.path.splitext(parts[-1])[0]
+    few_shot_match = re.match(r"(\d+)-few-shot", experiment)
+    return {
+        "model": "/".join(directories),
+        "experiment": experiment,
+        "n_shots": int(few_shot_match.group(1)) if few_shot_match else 0,
+    }
+
+
+def evaluate_results_file(parquet_file: str, results_dir: str, extract: bool = False) -> dict:
+    """Computes corpus-level BLEU and CHRF for a single results file
+
+    Args:
+        parquet_file (path-like object): path to results parquet file
+        results_dir (path-like object): root of the results tree
+        extract (bool, optional): score the translations extracted from the responses, see `get_hypotheses`.
+            Defaults to False.
+
+    Returns:
+        dict: one row of the consolidated metrics table
+    """
+    df = pd.read_parquet(parquet_file)
+    scores = TranslationScorer().score(get_hypotheses(df, extract=extract).to_list(), df["target_text"].fillna("").to_list())
+    return {
+        **describe_results_file(parquet_file, results_dir),
+        "n_sentences": len(df.index),
+        "bleu": scores["corpus_bleu"].score,
+        "chrf": scores["corpus_chrf"].score,
+        "bleu_signature": str(scores["bleu_signature"]),
+        "chrf_signature": str(scores["chrf_signature"]),
+        "path": os.path.relpath(parquet_file, results_dir),
+    }
+
+
+def _try_evaluate_results_file(parquet_file: str, results_dir: str, extract: bool = False):
+    try:
+        return evaluate_results_file(parquet_file, results_dir, extract), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def evaluate_results_tree(
+    results_dir: str,
+    n_workers: int = 1,
+    exclude: Optional[List[str]] = None,
+    extract: bool = False,
+) -> pd.DataFrame:
+    """Scores every results parquet file under a directory across a pool of processes. Files that cannot be
+    scored are reported and left out.
+
+    Args:
+        results_dir (path-like object): root of the results tree
+        n_workers (int, optional): number of processes used to score files. Defaults to 1.
+        exclude (List[path], optional): parquet files to skip, such as a previous metrics table. Defaults to None.
+        extract (bool, optional): score the translations extracted from the responses, see `get_hypotheses`.
+            Defaults to False.
+
+    Returns:
+        pd.DataFrame: consolidated metrics table, one row per results file, sorted by model, experiment and shots
+    """
+    excluded = {os.path.abspath(path) for path in exclude or []}
+    parquet_files = sorted(
+        path for path in find_parquet_files(results_dir) if os.path.abspath(path) not in excluded
+    )
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(
+            _try_evaluate_results_file, parquet_files, [results_dir] * len(parquet_files), [extract] * len(parquet_files)
+        ))
+
+    rows = []
+    for parquet_file, (row, error) in zip(parquet_files, results):
+        if error is not None:
+            print(f"Could not evaluate {parquet_file}: {error}")
+            continue
+        rows.append(row)
+
+    metrics_df = pd.DataFrame(rows)
+    if not metrics_df.empty:
+        metrics_df = metrics_df.sort_values(["model", "experiment", "n_shots"], ignore_index=True)
+    return metrics_df
+
+
 #%%
 if __name__ == "__main__":
     dataframe_path = '/Users/cambish/code-base/indigenous-llm-mt/src/results/gemma-2-9b-it/dsp.parquet'
 
     df = pd.read_parquet(dataframe_path)
-    df["hypothesis_text"] = df["response"].apply(clean_results)
-
-    # calculate sentence-level BLEU
-    df["sentence_bleu"] = df.apply(lambda x: calculate_sentence_bleu(x["hypothesis_text"], x["target_text"]), axis=1)
-    # calculate sentence-level CHRF
-    df["sentence_chrf"] = df.apply(lambda x: calculate_sentence_chrf(x["hypothesis_text"], x["target_text"]), axis=1)
+    df["hypothesis_text"] = clean_results_series(df["response"])
 
-    # get target and hypothesis text as list for corpus-level evaluation
-    references = df["target_text"].to_list()
-    hypotheses = df["hypothesis_text"].to_list()
-
-    bleu = BLEU()
-    corpus_bleu = bleu.corpus_score(hypotheses, references)
-
-    chrf = CHRF()
-    corpus_chrf = chrf.corpus_score(hypotheses, references)
+    # calculate sentence-level and corpus-level BLEU and CHRF in one pass
+    scorer = TranslationScorer()
+    scores = scorer.score_dataframe(df)
 
     output_file = '/Users/cambish/code-base/indigenous-llm-mt/src/results/gemma-2-9b-it/dsp-eval.txt'
     with open(output_file, "w") as f:
-        f.write(f"BLEU Score: {corpus_bleu}\n")
-        f.write(f"BLEU Signature: {bleu.get_signature()}\n")
-        f.write(f"CHRF2 Score: {corpus_chrf}\n")
-        f.write(f"CHRF2 Signature: {chrf.get_signature()}")
+        f.write(f"BLEU Score: {scores['corpus_bleu']}\n")
+        f.write(f"BLEU Signature: {scores['bleu_signature']}\n")
+        f.write(f"CHRF2 Score: {scores['corpus_chrf']}\n")
+        f.write(f"CHRF2 Signature: {scores['chrf_signature']}")
     df.to_parquet(dataframe_path)
 
 
@@ -1,16 +1,23 @@
 #%%
-# import argparse
+import argparse
 import os
 import re
+import time
 
-from typing import Literal, get_args
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Literal, NamedTuple, Optional, get_args
 from html import unescape
 
 # from IPython.display import display
 import pandas as pd
 
-from utils import SPLITS
-from utils import serialize_gold_standards, load_inuktitut_parallel_corpus, load_cree_parallel_data, get_project_root
+from utils import SPLITS, DEFAULT_CHUNK_SIZE
+from utils import load_consensus_gold_standards, load_inuktitut_parallel_corpus, load_cree_parallel_data, get_project_root
+from utils import inuktitut_parallel_corpus_files, cree_parallel_corpus_files
+from utils import extract_and_align_gold_standard, index_sentences, load_gold_standard_files, link_gold_standard, load_parallel_text_data
+from utils import iter_parallel_lines, iter_parallel_text_chunks, write_parquet_chunks
+from utils import get_file_prefixes, _try_extract_and_align_gold_standard
+from manifest import BuildManifest, code_version
 
 DATA_MODES = Literal['parallel_corpus', 'gold_standard']
 
@@ -49,6 +56,10 @@ SERIALIZED_CREE_PATH = os.path.join(
     project_dir, "data", "serialized", "cree_corpus.parquet"
 )
 
+BUILD_MANIFEST_PATH = os.path.join(
+    project_dir, "data", "serialized", "manifest.json"
+)
+
 GOLD_STANDARD_PATH = os.path.join(
     project_dir,
     "data",
@@ -58,18 +69,52 @@ GOLD_STANDARD_PATH = os.path.join(
 )
 
 
+# Precompiled patterns shared by the per-string helpers and their vectorized Series counterparts
+SPACE_BEFORE_PUNCTUATION = re.compile(r'\s+([.,!?;:])')
+SPACE_AFTER_PUNCTUATION = re.compile(r'([.,!?;:])\s+')
+SPACE_BEFORE_POSSESSIVE = re.compile(r"\s+'s\b")
+SPACE_AFTER_APOSTROPHE = re.compile(r"\b'\s+")
+PUNCTUATION = re.compile(r'[^\w\s]')
+WORD = re.compile(r'\S+')
+
+
+def _python_strings(texts: pd.Series) -> pd.Series:
+    """Casts a column of text to object dtype, so that the `.str` methods apply the precompiled patterns with
+    Python's `re` like the per-string helpers. The regex engine behind the pyarrow `str` dtype disagrees with it
+    on what `\\s`, `\\w` and `\\b` match outside ASCII, e.g. on no-break spaces and syllabics.
+    """
+    return texts.astype(object)
+
+
 def fix_cree_punctuation(text:str):
     # Remove spaces before punctuation marks
-    text = re.sub(r'\s+([.,!?;:])', r'\1', text)
+    text = SPACE_BEFORE_PUNCTUATION.sub(r'\1', text)
     # Ensure exactly one space after punctuation marks (except at the end of the sentence)
-    text = re.sub(r'([.,!?;:])\s+', r'\1 ', text)
+    text = SPACE_AFTER_PUNCTUATION.sub(r'\1 ', text)
     # Fix improper apostrophe spacing
-    text = re.sub(r"\s+'s\b", r"'s", text)  # Attach 's to the preceding word
-    text = re.sub(r"\b'\s+", r"'", text)    # Remove spaces after leading apostrophes
+    text = SPACE_BEFORE_POSSESSIVE.sub(r"'s", text)  # Attach 's to the preceding word
+    text = SPACE_AFTER_APOSTROPHE.sub(r"'", text)    # Remove spaces after leading apostrophes
     # Strip any extra spaces from the start and end of the text
     return text.strip()
 
 
+def fix_cree_punctuation_series(texts: pd.Series) -> pd.Series:
+    """Vectorized equivalent of fix_cree_punctuation for a whole column of text
+
+    Args:
+        texts (pd.Series): Column of strings to be fixed
+
+    Returns:
+        pd.Series: fixed strings
+    """
+    texts = _python_strings(texts)
+    texts = texts.str.replace(SPACE_BEFORE_PUNCTUATION, r'\1', regex=True)
+    texts = texts.str.replace(SPACE_AFTER_PUNCTUATION, r'\1 ', regex=True)
+    texts = texts.str.replace(SPACE_BEFORE_POSSESSIVE, r"'s", regex=True)
+    texts = texts.str.replace(SPACE_AFTER_APOSTROPHE, r"'", regex=True)
+    return texts.str.strip()
+
+
 def clean_and_process_inuktitut_text(text:str):
     """Cleans Inuktitut text by fixing spacing between punctuation, replacing errant HTML entities, and removing other preprocessing artifacts
 
@@ -80,13 +125,35 @@ def clean_and_process_inuktitut_text(text:str):
         str: cleaned string
     """
     # Fix spaces around punctuation
-    text = re.sub(r'\s+([.,!?;:])', r'\1', text)  # Remove space before punctuation
-    text = re.sub(r'([.,!?;:])\s+', r'\1 ', text)  # Ensure single space after punctuation
+    text = SPACE_BEFORE_PUNCTUATION.sub(r'\1', text)  # Remove space before punctuation
+    text = SPACE_AFTER_PUNCTUATION.sub(r'\1 ', text)  # Ensure single space after punctuation
     # Replace HTML entities and special cases
     text = unescape(text).replace("@-@", "-")
     return text.strip()
 
 
+def clean_and_process_inuktitut_series(texts: pd.Series) -> pd.Series:
+    """Vectorized equivalent of clean_and_process_inuktitut_text for a whole column of text
+
+    Args:
+        texts (pd.Series): Column of strings to be cleaned
+
+    Returns:
+        pd.Series: cleaned strings
+    """
+    # Fix spaces around punctuation
+    texts = _python_strings(texts)
+    texts = texts.str.replace(SPACE_BEFORE_PUNCTUATION, r'\1', regex=True)
+    texts = texts.str.replace(SPACE_AFTER_PUNCTUATION, r'\1 ', regex=True)
+    # HTML entities always start with '&', so only those rows need unescaping
+    has_entity = texts.str.contains("&", regex=False)
+    if has_entity.any():
+        texts = texts.copy()
+        texts[has_entity] = texts[has_entity].map(unescape)
+    texts = texts.str.replace("@-@", "-", regex=False)
+    return texts.str.strip()
+
+
 def word_count_excluding_punctuation(text:str):
     """Helper function to get word count without including punctuation
 
@@ -97,10 +164,23 @@ def word_count_excluding_punctuation(text:str):
         int: length of input string without punctuation
     """
     # Remove punctuation before counting words
-    text_without_punctuation = re.sub(r'[^\w\s]', '', text)
+    text_without_punctuation = PUNCTUATION.sub('', text)
     return len(text_without_punctuation.split())
 
 
+def word_count_excluding_punctuation_series(texts: pd.Series) -> pd.Series:
+    """Vectorized equivalent of word_count_excluding_punctuation for a whole column of text
+
+    Args:
+        texts (pd.Series): Column of strings to get word counts of
+
+    Returns:
+        pd.Series: word counts without punctuation
+    """
+    # Each run of non-whitespace left after removing punctuation is one word of str.split()
+    return _python_strings(texts).str.replace(PUNCTUATION, '', regex=True).str.count(WORD)
+
+
 def inuktitut_process_and_filter(df: pd.DataFrame, column_to_filter="target_text", min_word_count=4):
     """Preprocess Inuktitut text data to fix punctuation spacing, remove HTML entities, and fix other noisy parts of text.
     Also filters out texts shorter than min_word_count.
@@ -114,40 +194,207 @@ def inuktitut_process_and_filter(df: pd.DataFrame, column_to_filter="target_text
         _type_: _description_
     """
     # Apply cleaning and processing to text columns
-    df["source_text"] = df["source_text"].apply(clean_and_process_inuktitut_text)
-    df["target_text"] = df["target_text"].apply(clean_and_process_inuktitut_text)
+    df["source_text"] = clean_and_process_inuktitut_series(df["source_text"])
+    df["target_text"] = clean_and_process_inuktitut_series(df["target_text"])
     # Filter rows based on word count in the specified column
-    return df[df[column_to_filter].apply(word_count_excluding_punctuation) > min_word_count]
+    return df[word_count_excluding_punctuation_series(df[column_to_filter]) > min_word_count]
 
 
-if __name__ == '__main__':
-    # Serialize all splits of Inuktitut data, for both Roman and Syllabic scripts
-    for split in get_args(SPLITS):
+def preprocess_inuktitut_split(input_path: str, output_path: str, split: SPLITS, chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE):
+    """Loads, cleans, filters and serializes one split of the Inuktitut parallel corpus. The split is streamed
+    `chunk_size` line pairs at a time, so it is never held in memory whole; with `chunk_size=None` it is loaded at
+    once. Both write the same rows, indexed by their line pair number in the split.
+    """
+    if chunk_size is None:
+        parallel_corpus = load_inuktitut_parallel_corpus(input_path, split=split)
+        parallel_corpus = inuktitut_process_and_filter(parallel_corpus)
+        parallel_corpus.to_parquet(output_path)
+        return
+    chunks = iter_parallel_text_chunks(inuktitut_parallel_corpus_files(input_path, split=split), chunk_size=chunk_size)
+    write_parquet_chunks((inuktitut_process_and_filter(chunk) for chunk in chunks), output_path, preserve_index=True)
+
+
+def preprocess_cree(input_path: str, output_path: str, chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE):
+    """Loads, fixes punctuation in and serializes the Plains Cree parallel corpus, streamed `chunk_size` line pairs
+    at a time like `preprocess_inuktitut_split`, or loaded at once with `chunk_size=None`
+    """
+    if chunk_size is None:
+        cree_parallel_corpus = load_cree_parallel_data(input_path)
+        cree_parallel_corpus = cree_parallel_corpus.apply(fix_cree_punctuation_series)
+        cree_parallel_corpus.to_parquet(output_path)
+        return
+    chunks = iter_parallel_text_chunks(cree_parallel_corpus_files(input_path), chunk_size=chunk_size)
+    write_parquet_chunks((chunk.apply(fix_cree_punctuation_series) for chunk in chunks), output_path, preserve_index=True)
+
+
+def preprocess_gold_standard(input_path: str, output_path: str, n_workers: int = 1):
+    """Aligns and serializes the consensus Inuktitut gold standard, parsing its files on `n_workers` processes.
+    Fails without writing anything if any file fails to load, so the job is not marked up to date and is rerun.
+    """
+    gold_standard_df = load_consensus_gold_standards(input_path, n_workers=n_workers, skip_failures=False)
+    gold_standard_df.to_parquet(output_path)
+
+
+class PreprocessingJob(NamedTuple):
+    name: str
+    function: Callable
+    kwargs: dict
+    inputs: List[str]
+    output: str
+    version: str
+    # the job runs a process pool of its own, so it is given workers instead of taking one from the shared pool
+    multiprocess: bool = False
+
+
+def list_files(directory: str) -> List[str]:
+    """Lists every file nested under a directory"""
+    return [os.path.join(root, file) for root, _, files in os.walk(directory) for file in files]
+
 
-        # Serialize and preprocess all splits for Syllabic Inuktitut
-        SERIALIZED_INUKTITUT_SYLLABIC_PATH = os.path.join(
-            project_dir, "data", "serialized", f"{split}_syllabic_parallel_corpus.parquet"
-        )
-        syllabic_parallel_corpus = load_inuktitut_parallel_corpus(INUKTITUT_SYLLABIC_PATH, split=split)
-        syllabic_parallel_corpus = inuktitut_process_and_filter(syllabic_parallel_corpus)
-        syllabic_parallel_corpus.to_parquet(SERIALIZED_INUKTITUT_SYLLABIC_PATH)
-
-        # Preprocess and serialize all splits Romanized Inuktitut
-        SERIALIZED_INUKTITUT_ROMAN_PATH = os.path.join(
-            project_dir, "data", "serialized", f"{split}_roman_parallel_corpus.parquet"
-        )
-        roman_parallel_corpus = load_inuktitut_parallel_corpus(INUKTITUT_ROMAN_PATH, split=split)
-        roman_parallel_corpus = inuktitut_process_and_filter(roman_parallel_corpus)
-        roman_parallel_corpus.to_parquet(SERIALIZED_INUKTITUT_ROMAN_PATH)
-
-    # Preprocess and serialize Plains Cree data
-    cree_parallel_corpus = load_cree_parallel_data(CREE_PATH)
-    cree_parallel_corpus = cree_parallel_corpus.map(fix_cree_punctuation)
-    print(cree_parallel_corpus)
-    cree_parallel_corpus.to_parquet(SERIALIZED_CREE_PATH)
-
-    # Serialize gold standards
-    serialize_gold_standards(
-        input_path=GOLD_STANDARD_PATH, output_path=SERIALIZED_GOLD_STANDARD_PATH
+def build_preprocessing_jobs(chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE) -> List[PreprocessingJob]:
+    """Lists every independent preprocessing job: each (split x script) of the Inuktitut corpus, Plains Cree and the gold standard.
+    The gold standard, made of many small files, parses them on processes of its own. The corpora are streamed
+    `chunk_size` line pairs at a time.
+    """
+    inuktitut_version = code_version(
+        [preprocess_inuktitut_split, iter_parallel_text_chunks, iter_parallel_lines, write_parquet_chunks,
+         load_inuktitut_parallel_corpus, load_parallel_text_data, inuktitut_process_and_filter,
+         clean_and_process_inuktitut_series, word_count_excluding_punctuation_series],
+        extra=[SPACE_BEFORE_PUNCTUATION.pattern, SPACE_AFTER_PUNCTUATION.pattern, PUNCTUATION.pattern, WORD.pattern],
+    )
+    cree_version = code_version(
+        [preprocess_cree, cree_parallel_corpus_files, iter_parallel_text_chunks, iter_parallel_lines,
+         write_parquet_chunks, load_cree_parallel_data, load_parallel_text_data, fix_cree_punctuation_series],
+        extra=[SPACE_BEFORE_PUNCTUATION.pattern, SPACE_AFTER_PUNCTUATION.pattern,
+               SPACE_BEFORE_POSSESSIVE.pattern, SPACE_AFTER_APOSTROPHE.pattern],
     )
-# %%
+    gold_standard_version = code_version(
+        [preprocess_gold_standard, load_consensus_gold_standards, get_file_prefixes, load_gold_standard_files,
+         _try_extract_and_align_gold_standard, extract_and_align_gold_standard, link_gold_standard, index_sentences]
+    )
+
+    jobs = []
+    for split in get_args(SPLITS):
+        for script, input_path in (("syllabic", INUKTITUT_SYLLABIC_PATH), ("roman", INUKTITUT_ROMAN_PATH)):
+            jobs.append(PreprocessingJob(
+                name=f"{split}-{script}",
+                function=preprocess_inuktitut_split,
+                kwargs={"input_path": input_path, "split": split, "chunk_size": chunk_size},
+                inputs=[file for pair in inuktitut_parallel_corpus_files(input_path, split=split) for file in pair],
+                output=os.path.join(project_dir, "data", "serialized", f"{split}_{script}_parallel_corpus.parquet"),
+                version=inuktitut_version,
+            ))
+
+    jobs.append(PreprocessingJob(
+        name="cree",
+        function=preprocess_cree,
+        kwargs={"input_path": CREE_PATH, "chunk_size": chunk_size},
+        inputs=[file for pair in cree_parallel_corpus_files(CREE_PATH) for file in pair],
+        output=SERIALIZED_CREE_PATH,
+        version=cree_version,
+    ))
+    jobs.append(PreprocessingJob(
+        name="gold-standard",
+        function=preprocess_gold_standard,
+        kwargs={"input_path": GOLD_STANDARD_PATH},
+        inputs=list_files(os.path.join(GOLD_STANDARD_PATH, "annotator1-consensus"))
+        + list_files(os.path.join(GOLD_STANDARD_PATH, "annotator2-consensus")),
+        output=SERIALIZED_GOLD_STANDARD_PATH,
+        version=gold_standard_version,
+        multiprocess=True,
+    ))
+    return jobs
+
+
+def run_job(job: PreprocessingJob, n_workers: int = 1) -> float:
+    """Runs a single preprocessing job and returns its wall-clock time. Multiprocess jobs run on `n_workers` processes."""
+    kwargs = {**job.kwargs, "n_workers": n_workers} if job.multiprocess else job.kwargs
+    start_time = time.perf_counter()
+    job.function(output_path=job.output, **kwargs)
+    return time.perf_counter() - start_time
+
+
+def run_preprocessing_jobs(
+    jobs: List[PreprocessingJob],
+    n_workers: int = 1,
+    force: bool = False,
+    manifest_path: str = BUILD_MANIFEST_PATH,
+) -> List[str]:
+    """Runs preprocessing jobs across a pool of processes, skipping jobs whose inputs and code are unchanged
+    since their output was last built. Failed jobs are reported without stopping the others.
+    Multiprocess jobs run in this process while the pool works, on the workers the pool leaves free, so about
+    `n_workers` processes are busy in total.
+
+    Args:
+        jobs (List[PreprocessingJob]): Jobs to run
+        n_workers (int, optional): Number of processes to run jobs on. Defaults to 1.
+        force (bool, optional): Rerun jobs even if their outputs are up to date. Defaults to False.
+        manifest_path (str, optional): Build manifest recording what each output was built from. Defaults to BUILD_MANIFEST_PATH.
+
+    Returns:
+        List[str]: Names of the jobs that failed
+    """
+    manifest = BuildManifest(manifest_path)
+    pending = []
+    for job in jobs:
+        if not force and manifest.is_up_to_date(job.output, job.inputs, job.version):
+            print(f"[{job.name}] up to date, skipping")
+        else:
+            pending.append(job)
+
+    for output_dir in {os.path.dirname(job.output) for job in pending}:
+        os.makedirs(output_dir, exist_ok=True)
+
+    failed = []
+    # inputs are fingerprinted before any job starts, so one edited during its build is rebuilt on the next run
+    snapshots = {}
+    for job in pending:
+        try:
+            snapshots[job.name] = manifest.snapshot_inputs(job.output, job.inputs)
+        except OSError as e:
+            print(f"[{job.name}] failed: {type(e).__name__}: {e}")
+            failed.append(job.name)
+
+    pooled_jobs = [job for job in pending if job.name in snapshots and not job.multiprocess]
+    multiprocess_jobs = [job for job in pending if job.name in snapshots and job.multiprocess]
+    # keep one worker for the multiprocess jobs and hand them whatever the pooled jobs cannot use
+    pool_workers = max(1, min(len(pooled_jobs), n_workers - (1 if multiprocess_jobs else 0)))
+    free_workers = max(1, n_workers - pool_workers) if pooled_jobs else n_workers
+
+    def finish(job: PreprocessingJob, run: Callable[[], float]):
+        try:
+            elapsed_time = run()
+            print(f"[{job.name}] finished in {elapsed_time:.1f}s -> {job.output}")
+            manifest.record(job.output, job.inputs, job.version, snapshot=snapshots[job.name])
+            manifest.save()
+        except Exception as e:
+            print(f"[{job.name}] failed: {type(e).__name__}: {e}")
+            failed.append(job.name)
+
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=pool_workers) as executor:
+        futures = {executor.submit(run_job, job): job for job in pooled_jobs}
+        for job in multiprocess_jobs:
+            print(f"[{job.name}] running on {free_workers} processes")
+            finish(job, lambda: run_job(job, n_workers=free_workers))
+        for future in as_completed(futures):
+            finish(futures[future], future.result)
+
+    manifest.save()
+    print(f"Ran {len(pending)} of {len(jobs)} preprocessing jobs in {time.perf_counter() - start_time:.1f}s")
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Preprocess and serialize the Inuktitut, Plains Cree and gold standard data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of preprocessing jobs run in parallel")
+    parser.add_argument("--force", action="store_true", help="rebuild outputs even if they are up to date")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE, help="line pairs of each corpus held in memory at once")
+    args = parser.parse_args()
+
+    jobs = build_preprocessing_jobs(chunk_size=args.chunk_size)
+    failed_jobs = run_preprocessing_jobs(jobs, n_workers=args.workers, force=args.force)
+    if failed_jobs:
+        print(f"Failed jobs: {', '.join(failed_jobs)}")
+        exit(1)
+# %%
\ No newline at end of file
@@ -0,0 +1,171 @@
+import os
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+TOKENIZER_PATH = os.environ.get("TOKENIZER_PATH")
+PROMPT_TOKEN_BUDGET = int(os.environ["PROMPT_TOKEN_BUDGET"]) if os.environ.get("PROMPT_TOKEN_BUDGET") else None
+
+
+class PromptTokenCounter:
+    """Counts the tokens of chat prompts with the target model's tokenizer. The content of every message is
+    tokenized once and its length cached, so counting a prompt built from known examples is a few dictionary
+    lookups. The tokens the chat template adds around each message are measured once per role from probe
+    conversations. Contents the template trims are counted untrimmed, which can only overcount them.
+    """
+
+    def __init__(self, tokenizer):
+        """
+        Args:
+            tokenizer (transformers.PreTrainedTokenizerBase): Tokenizer of the model the prompts are sent to
+        """
+        self.tokenizer = tokenizer
+        self.content_lengths: Dict[str, int] = {}
+        self.message_overheads, self.prompt_overhead = self._measure_template_overhead()
+
+    @classmethod
+    def from_pretrained(cls, tokenizer_path: str) -> "PromptTokenCounter":
+        """Loads the tokenizer from a local model directory without contacting the Hub
+
+        Args:
+            tokenizer_path (str): Local path of the model or tokenizer files
+
+        Returns:
+            PromptTokenCounter: Counter for prompts sent to that model
+        """
+        # transformers is only needed, and only imported, when prompts are counted
+        from transformers import AutoTokenizer
+        return cls(AutoTokenizer.from_pretrained(tokenizer_path, local_files_only=True))
+
+    def content_length(self, content: str) -> int:
+        """Returns the number of tokens in a message's content, tokenizing it only the first time it is seen"""
+        length = self.content_lengths.get(content)
+        if length is None:
+            length = len(self.tokenizer(content, add_special_tokens=False)["input_ids"])
+            self.content_lengths[content] = length
+        return length
+
+    def _template_length(self, messages: List[Dict[str, str]]) -> int:
+        return len(self.tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True))
+
+    def _measure_template_overhead(self) -> Tuple[Dict[str, int], int]:
+        if getattr(self.tokenizer, "chat_template", None) is None:
+            return {}, 0
+        messages = [
+            {"role": "system", "content": "a"},
+            {"role": "user", "content": "b"},
+            {"role": "assistant", "content": "c"},
+            {"role": "user", "content": "d"},
+        ]
+        lengths = [self._template_length(messages[:n]) for n in (2, 3, 4)]
+        # role names are part of each message header, so user and assistant messages can cost different amounts
+        message_overheads = {
+            "assistant": lengths[1] - lengths[0] - self.content_length("c"),
+            "user": lengths[2] - lengths[1] - self.content_length("d"),
+        }
+        # the system message's header is counted with the rest of the prompt, which always starts with one
+        prompt_overhead = lengths[0] - self.content_length("a") - self.content_length("b") - message_overheads["user"]
+        return message_overheads, prompt_overhead
+
+    def message_length(self, message: Dict[str, str]) -> int:
+        """Returns the number of tokens a message takes up in a templated prompt"""
+        return self.content_length(message["content"]) + self.message_overheads.get(message["role"], 0)
+
+    def count(self, messages: List[Dict[str, str]]) -> int:
+        """Counts the tokens of a chat prompt, including the chat template and the generation prompt
+
+        Args:
+            messages (List[Dict[str, str]]): Messages sent to the model
+
+        Returns:
+            int: Number of prompt tokens
+        """
+        return self.prompt_overhead + sum(self.message_length(message) for message in messages)
+
+
+class BudgetedPromptBuilder:
+    """Wraps the `build_messages` of a few-shot example bank and drops examples until the prompt fits a token
+    budget. Examples are dropped from the end of a static example set, so prompts keep a shared prefix, and from
+    the start of a retrieved set, where the least similar examples are.
+    """
+
+    def __init__(
+        self,
+        build_messages: Callable[[str], List[Dict[str, str]]],
+        counter: PromptTokenCounter,
+        budget: Optional[int] = PROMPT_TOKEN_BUDGET,
+        drop_examples_from: str = "end",
+    ):
+        """
+        Args:
+            build_messages (Callable[[str], List[Dict[str, str]]]): Builds the full few-shot prompt of a sentence
+                as a system message, user/assistant example pairs and the final user message
+            counter (PromptTokenCounter): Token counter of the target model
+            budget (int, optional): Maximum number of prompt tokens, or None to only count. Defaults to
+                PROMPT_TOKEN_BUDGET.
+            drop_examples_from (str, optional): 'end' or 'start' of the examples. Defaults to "end".
+        """
+        if drop_examples_from not in ("start", "end"):
+            raise ValueError(f"drop_examples_from must be 'start' or 'end', got '{drop_examples_from}'")
+        self.build_full_messages = build_messages
+        self.counter = counter
+        self.budget = budget
+        self.drop_examples_from = drop_examples_from
+        self.prompt_stats: Dict[str, Dict[str, int]] = {}
+
+    def build_messages(self, source_text: str) -> List[Dict[str, str]]:
+        """Builds the prompt of a sentence with as many of its examples as fit in the budget
+
+        Args:
+            source_text (str): Sentence to translate
+
+        Returns:
+            List[Dict[str, str]]: Messages to send to the model
+        """
+        messages = self.build_full_messages(source_text)
+        system, examples, query = messages[:1], messages[1:-1], messages[-1:]
+        pairs = [examples[i:i + 2] for i in range(0, len(examples), 2)]
+        if self.drop_examples_from == "start":
+            pairs.reverse()
+
+        n_tokens = self.counter.count(system + query)
+        kept = []
+        for pair in pairs:
+            pair_tokens = sum(self.counter.message_length(message) for message in pair)
+            if self.budget is not None and n_tokens + pair_tokens > self.budget:
+                break
+            kept.append(pair)
+            n_tokens += pair_tokens
+
+        if self.drop_examples_from == "start":
+            kept.reverse()
+
+        self.prompt_stats[source_text] = {
+            "prompt_tokens": n_tokens,
+            "n_examples": len(kept),
+            "n_dropped": len(pairs) - len(kept),
+        }
+        return system + [message for pair in kept for message in pair] + query
+
+    def report(self):
+        """Prints how many of the prompts built so far had examples dropped to fit the budget"""
+        if self.budget is None or not self.prompt_stats:
+            return
+        dropped = [stats["n_dropped"] for stats in self.prompt_stats.values() if stats["n_dropped"]]
+        print(
+            f"Prompt budget of {self.budget} tokens: examples dropped from {len(dropped)} of "
+            f"{len(self.prompt_stats)} prompts" + (f", up to {max(dropped)} per prompt" if dropped else "")
+        )
+
+    def _stats(self, source_text: str) -> Dict[str, int]:
+        if source_text not in self.prompt_stats:
+            # rows restored from a checkpoint were never built in this run
+            self.build_messages(source_text)
+        return self.prompt_stats[source_text]
+
+    def prompt_tokens(self, source_text: str) -> int:
+        """Returns the token count of the prompt built for a sentence"""
+        return self._stats(source_text)["prompt_tokens"]
+
+    def n_examples(self, source_text: str) -> int:
+        """Returns the number of examples in the prompt built for a sentence"""
+        return self._stats(source_text)["n_examples"]
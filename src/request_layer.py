@@ -0,0 +1,273 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+
+from typing import Awaitable, Callable, Optional
+
+import openai
+
+from openai.types.chat import ChatCompletion
+
+from instrumentation import RequestMetrics
+
+REQUESTS_PER_MINUTE = float(os.environ["REQUESTS_PER_MINUTE"]) if os.environ.get("REQUESTS_PER_MINUTE") else None
+TOKENS_PER_MINUTE = float(os.environ["TOKENS_PER_MINUTE"]) if os.environ.get("TOKENS_PER_MINUTE") else None
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", 6))
+BASE_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+# status codes worth retrying: timeouts, lock conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`. Reservations may overdraw the bucket; the caller
+    then waits until the deficit has refilled, so concurrent callers are spaced out instead of released together.
+    Thread-safe, so it serves the async engine and synchronous calls alike.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute (float): Sustained number of units per minute
+            capacity (float, optional): Largest burst allowed after an idle period. Defaults to one second's worth,
+                and at least 1.
+        """
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` units from the bucket
+
+        Args:
+            amount (float): Number of units needed
+
+        Returns:
+            float: Seconds to wait before using them
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """Returns units to the bucket, or takes more with a negative amount, once the actual cost is known"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def estimate_request_tokens(json_data: dict) -> int:
+    """Estimates the tokens a chat completion request will use before it is sent: about four characters per
+    prompt token plus the full completion allowance of every choice
+
+    Args:
+        json_data (dict): Keyword arguments for `client.chat.completions.create`
+
+    Returns:
+        int: Estimated prompt and completion tokens
+    """
+    prompt_characters = sum(len(message["content"]) for message in json_data["messages"])
+    completion_tokens = (json_data.get("max_tokens") or 256) * (json_data.get("n") or 1)
+    return prompt_characters // 4 + completion_tokens
+
+
+def is_retryable(error: Exception) -> bool:
+    """Connection failures, timeouts, rate limits and server errors are transient; bad requests are not"""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Reads how long the server asked us to wait from the Retry-After headers of an error response
+
+    Args:
+        error (Exception): Error raised by the request
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if the server did not say
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        # Retry-After can also be an HTTP date
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestLayer:
+    """Shared path for every chat completion request: waits for request and token budget in token buckets, then
+    retries transient errors with full-jitter exponential backoff, up to `max_retries` times. A Retry-After from
+    the server pauses all requests going through the layer, not just the one that was told to wait.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = REQUESTS_PER_MINUTE,
+        tokens_per_minute: Optional[float] = TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = BASE_RETRY_DELAY,
+        max_delay: float = MAX_RETRY_DELAY,
+    ):
+        """
+        Args:
+            requests_per_minute (float, optional): Request rate limit, or None for no limit. Defaults to
+                REQUESTS_PER_MINUTE.
+            tokens_per_minute (float, optional): Prompt plus completion token rate limit, or None for no limit.
+                Defaults to TOKENS_PER_MINUTE.
+            max_retries (int, optional): Retries after the first attempt before giving up. Defaults to MAX_RETRIES.
+            base_delay (float, optional): Backoff ceiling of the first retry in seconds. Defaults to BASE_RETRY_DELAY.
+            max_delay (float, optional): Largest backoff in seconds. Defaults to MAX_RETRY_DELAY.
+        """
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.retries = 0
+        self.failures = 0
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        delay = max(0.0, self.paused_until - time.monotonic())
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(estimated_tokens))
+        return delay
+
+    def _settle(self, estimated_tokens: int, output: ChatCompletion):
+        if self.token_bucket is not None and output.usage is not None:
+            self.token_bucket.adjust(estimated_tokens - output.usage.total_tokens)
+
+    def _backoff(self, attempt: int, error: Exception) -> Optional[float]:
+        """Returns the delay before the next attempt, or None if the error should be raised"""
+        if not is_retryable(error) or attempt >= self.max_retries:
+            self.failures += 1
+            return None
+        self.retries += 1
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            self.paused_until = max(self.paused_until, time.monotonic() + server_delay)
+            return server_delay
+        # full jitter keeps retries of requests that failed together from arriving together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def send(
+        self,
+        complete: Callable[[dict], Awaitable[ChatCompletion]],
+        json_data: dict,
+        metrics: Optional[RequestMetrics] = None,
+    ) -> ChatCompletion:
+        """Sends a request from a coroutine
+
+        Args:
+            complete (Callable[[dict], Awaitable[ChatCompletion]]): Sends the request, e.g. `backend.complete`
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+            metrics (RequestMetrics, optional): Receives the rate limit wait, latency and retries. Defaults to None.
+
+        Raises:
+            openai.OpenAIError: If the error is not transient or the retries are used up
+
+        Returns:
+            ChatCompletion: The completion
+        """
+        metrics = metrics if metrics is not None else RequestMetrics()
+        estimated_tokens = estimate_request_tokens(json_data)
+        for attempt in range(self.max_retries + 1):
+            delay = self._reserve(estimated_tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if attempt == 0:
+                metrics.queue_seconds += delay
+                start_time = time.perf_counter()
+            metrics.retries = attempt
+            try:
+                output = await complete(json_data)
+            except openai.OpenAIError as e:
+                delay = self._backoff(attempt, e)
+                if delay is None:
+                    raise
+                print(f"{e.__class__.__name__}: {e}. Retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+                continue
+            metrics.latency_seconds = time.perf_counter() - start_time
+            metrics.record_usage(output)
+            self._settle(estimated_tokens, output)
+            return output
+
+    def send_sync(
+        self,
+        complete: Callable[[dict], ChatCompletion],
+        json_data: dict,
+        metrics: Optional[RequestMetrics] = None,
+    ) -> ChatCompletion:
+        """Sends a request from synchronous code
+
+        Args:
+            complete (Callable[[dict], ChatCompletion]): Sends the request, e.g. `client.chat.completions.create`
+                wrapped to take the request dict
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+            metrics (RequestMetrics, optional): Receives the rate limit wait, latency and retries. Defaults to None.
+
+        Raises:
+            openai.OpenAIError: If the error is not transient or the retries are used up
+
+        Returns:
+            ChatCompletion: The completion
+        """
+        metrics = metrics if metrics is not None else RequestMetrics()
+        estimated_tokens = estimate_request_tokens(json_data)
+        for attempt in range(self.max_retries + 1):
+            delay = self._reserve(estimated_tokens)
+            if delay > 0:
+                time.sleep(delay)
+            if attempt == 0:
+                metrics.queue_seconds += delay
+                start_time = time.perf_counter()
+            metrics.retries = attempt
+            try:
+                output = complete(json_data)
+            except openai.OpenAIError as e:
+                delay = self._backoff(attempt, e)
+                if delay is None:
+                    raise
+                print(f"{e.__class__.__name__}: {e}. Retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                continue
+            metrics.latency_seconds = time.perf_counter() - start_time
+            metrics.record_usage(output)
+            self._settle(estimated_tokens, output)
+            return output
+
+    def report(self):
+        """Prints the number of retries and failed requests so far"""
+        print(f"Request layer: {self.retries} retries, {self.failures} failed requests")
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from typing import Optional
+
+from openai.types.chat import ChatCompletion
+
+from utils import get_project_root
+
+project_dir = get_project_root(os.path.abspath(os.path.dirname(__file__)))
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "RESPONSE_CACHE_PATH",
+    os.path.join(project_dir, "data", "cache", "responses.sqlite"),
+)
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 1024**3))
+
+# request fields that determine the completion; anything else is ignored when hashing
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "stop", "n")
+# not a request field: set on the key of streamed requests cut off by a stop pattern, whose responses are truncated
+EARLY_STOP_FIELD = "early_stop_pattern"
+# endpoint of the OpenAI client when neither a base_url nor OPENAI_BASE_URL is given
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+
+def openai_endpoint(base_url: Optional[str] = None) -> str:
+    """Returns the endpoint an OpenAI client created with `base_url` sends its requests to
+
+    Args:
+        base_url (str, optional): The client's base_url. Defaults to OPENAI_BASE_URL, then the OpenAI API.
+
+    Returns:
+        str: Endpoint URL without a trailing slash
+    """
+    return str(base_url or os.environ.get("OPENAI_BASE_URL") or DEFAULT_OPENAI_BASE_URL).rstrip("/")
+
+
+def make_cache_key(json_data: dict, namespace: Optional[str] = None) -> str:
+    """Hashes the fields of a chat completion request that determine its output
+
+    Args:
+        json_data (dict): Keyword arguments for `client.chat.completions.create`, plus the `early_stop_pattern`
+            the response was cut off at, if any
+        namespace (str, optional): Keeps responses of different backends apart. Defaults to None.
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    key_data = {field: json_data.get(field) for field in KEY_FIELDS}
+    # only added when set, so the keys of requests without early stopping are unchanged
+    if json_data.get(EARLY_STOP_FIELD) is not None:
+        key_data[EARLY_STOP_FIELD] = json_data[EARLY_STOP_FIELD]
+    if namespace is not None:
+        key_data["namespace"] = namespace
+    serialized = json.dumps(key_data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent, content-addressed cache of chat completions stored in a local SQLite file.
+    Least recently used entries are evicted once the stored responses exceed `max_bytes`. The total size is kept
+    up to date by triggers in a one-row `cache_size` table, so checking it does not scan the responses.
+    Without a namespace, responses are keyed on the OpenAI endpoint, so two servers with the same model name are
+    kept apart.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        namespace: Optional[str] = None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace if namespace is not None else openai_endpoint()
+        self.hits = 0
+        self.misses = 0
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # the engine may use the store from its worker thread when called inside a running event loop
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        # caches created before the size table start from the size of their current entries
+        self.connection.executescript(
+            "BEGIN IMMEDIATE;"
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);"
+            "CREATE TABLE IF NOT EXISTS cache_size (total INTEGER NOT NULL);"
+            "INSERT INTO cache_size SELECT COALESCE(SUM(size), 0) FROM responses "
+            "WHERE NOT EXISTS (SELECT 1 FROM cache_size);"
+            "CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses "
+            "BEGIN UPDATE cache_size SET total = total + NEW.size; END;"
+            "CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses "
+            "BEGIN UPDATE cache_size SET total = total + NEW.size - OLD.size; END;"
+            "CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses "
+            "BEGIN UPDATE cache_size SET total = total - OLD.size; END;"
+            "COMMIT;"
+        )
+
+    def get(self, json_data: dict) -> Optional[ChatCompletion]:
+        """Looks up the completion for a request
+
+        Args:
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+
+        Returns:
+            Optional[ChatCompletion]: The cached completion, or None on a miss
+        """
+        key = make_cache_key(json_data, self.namespace)
+        row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.connection.commit()
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, json_data: dict, output: ChatCompletion):
+        """Stores the completion for a request, evicting old entries if the cache is over its size limit
+
+        Args:
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+            output (ChatCompletion): Completion returned for the request
+        """
+        response = output.model_dump_json()
+        # an upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+        self.connection.execute(
+            "INSERT INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "response = excluded.response, size = excluded.size, last_access = excluded.last_access",
+            (make_cache_key(json_data, self.namespace), response, len(response.encode("utf-8")), time.time()),
+        )
+        self._evict()
+        self.connection.commit()
+
+    def _total_size(self) -> int:
+        return self.connection.execute("SELECT total FROM cache_size").fetchone()[0]
+
+    def _evict(self):
+        total_size = self._total_size()
+        if total_size <= self.max_bytes:
+            return
+        # walks the last access index from the oldest entry and stops as soon as the cache fits again
+        rows = self.connection.execute("SELECT key, size FROM responses ORDER BY last_access ASC")
+        evicted = []
+        for key, size in rows:
+            if total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+        rows.close()
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> dict:
+        """Returns hit/miss counts for this session along with the current cache size"""
+        entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        size = self._total_size()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def report(self):
+        """Prints the cache statistics for this session"""
+        stats = self.stats()
+        print(
+            f"Response cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"(hit rate {stats['hit_rate']:.1%}), {stats['entries']} entries, {stats['size_bytes']} bytes"
+        )
+
+    def close(self):
+        self.connection.close()
@@ -9,6 +9,6 @@ source $SLURM_TMPDIR/ENV/bin/activate
 
 pip install --upgrade pip --no-index
 
-pip install --no-index torch scikit_learn tqdm nltk torchtext transformers>=4.43.1 spacy triton accelerate datasets scipy matplotlib numpy huggingface_hub ipython
+pip install --no-index torch scikit_learn tqdm nltk torchtext transformers>=4.43.1 spacy triton accelerate datasets scipy matplotlib numpy huggingface_hub ipython "sacrebleu>=2.0,<3"
 
 echo "Done installing virtualenv!"
\ No newline at end of file
@@ -19,7 +19,7 @@ source $SLURM_TMPDIR/env/bin/activate
 
 pip install --upgrade pip --no-index
 
-pip install --no-index torch scikit_learn tqdm nltk torchtext transformers>=4.43.1 spacy triton accelerate datasets scipy matplotlib numpy huggingface_hub ipython
+pip install --no-index torch scikit_learn tqdm nltk torchtext transformers>=4.43.1 spacy triton accelerate datasets scipy matplotlib numpy huggingface_hub ipython "sacrebleu>=2.0,<3"
 
 # Environment variables
 export MASTER_ADDR=$(hostname)
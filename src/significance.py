@@ -0,0 +1,250 @@
+import argparse
+
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from postprocess import TranslationScorer, get_hypotheses
+
+DEFAULT_SEED = 12345
+# number of resamples scored at once, bounds memory to batch_size x n_sentences weights
+DEFAULT_BATCH_SIZE = 500
+
+
+def corpus_bleu_from_stats(stats: np.ndarray) -> np.ndarray:
+    """Vectorized corpus BLEU for many sets of summed sufficient statistics at once. Matches sacrebleu's
+    `BLEU().corpus_score` (exp smoothing, no effective order).
+
+    Args:
+        stats (np.ndarray): summed BLEU statistics, one row per corpus: [sys_len, ref_len, correct_1..N, total_1..N]
+
+    Returns:
+        np.ndarray: BLEU score of every row
+    """
+    stats = np.atleast_2d(stats).astype(np.float64)
+    max_ngram_order = (stats.shape[1] - 2) // 2
+    sys_len, ref_len = stats[:, 0], stats[:, 1]
+    correct = stats[:, 2:2 + max_ngram_order]
+    total = stats[:, 2 + max_ngram_order:]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        brevity_penalty = np.where(
+            sys_len < ref_len,
+            np.where(sys_len > 0, np.exp(1 - ref_len / sys_len), 0.0),
+            1.0,
+        )
+
+        precisions = np.zeros_like(correct)
+        smooth_mteval = np.ones(len(stats))
+        # an order with no hypothesis n-grams ends the precision computation for that row, like sacrebleu's break
+        active = np.ones(len(stats), dtype=bool)
+        for n in range(max_ngram_order):
+            active &= total[:, n] > 0
+            no_match = active & (correct[:, n] == 0)
+            smooth_mteval = np.where(no_match, smooth_mteval * 2, smooth_mteval)
+            precisions[:, n] = np.where(
+                no_match,
+                100.0 / (smooth_mteval * total[:, n]),
+                np.where(active, 100.0 * correct[:, n] / total[:, n], 0.0),
+            )
+
+        # sacrebleu's my_log maps a zero precision to a huge negative number instead of -inf
+        log_precisions = np.where(precisions > 0, np.log(np.where(precisions > 0, precisions, 1.0)), -9999999999.0)
+
+    scores = brevity_penalty * np.exp(log_precisions.sum(axis=1) / max_ngram_order)
+    return np.where(correct.any(axis=1), scores, 0.0)
+
+
+def corpus_chrf_from_stats(stats: np.ndarray, beta: int = 2) -> np.ndarray:
+    """Vectorized corpus chrF for many sets of summed sufficient statistics at once. Matches sacrebleu's
+    `CHRF().corpus_score` (effective order averaging, no eps smoothing).
+
+    Args:
+        stats (np.ndarray): summed CHRF statistics, one row per corpus: [hyp, ref, match] counts for each order
+        beta (int, optional): recall weight of the F-score. Defaults to 2.
+
+    Returns:
+        np.ndarray: chrF score of every row
+    """
+    stats = np.atleast_2d(stats).astype(np.float64)
+    n_hyp, n_ref, n_match = stats[:, 0::3], stats[:, 1::3], stats[:, 2::3]
+    factor = beta ** 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        valid = (n_hyp > 0) & (n_ref > 0)
+        effective_order = valid.sum(axis=1)
+        avg_prec = np.where(valid, n_match / n_hyp, 0.0).sum(axis=1)
+        avg_rec = np.where(valid, n_match / n_ref, 0.0).sum(axis=1)
+        avg_prec = np.where(effective_order > 0, avg_prec / effective_order, 0.0)
+        avg_rec = np.where(effective_order > 0, avg_rec / effective_order, 0.0)
+
+        scores = 100 * (1 + factor) * avg_prec * avg_rec / (factor * avg_prec + avg_rec)
+    return np.where(avg_prec + avg_rec > 0, scores, 0.0)
+
+
+METRIC_FUNCTIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "bleu": corpus_bleu_from_stats,
+    "chrf": corpus_chrf_from_stats,
+}
+
+
+def _resample_weights(rng: np.random.Generator, n_sentences: int, n_samples: int) -> np.ndarray:
+    """Draws bootstrap resamples as per-sentence counts, so summed statistics become one matrix product"""
+    return rng.multinomial(n_sentences, np.full(n_sentences, 1.0 / n_sentences), size=n_samples).astype(np.float64)
+
+
+def paired_bootstrap_test(
+    baseline_stats: np.ndarray,
+    system_stats: np.ndarray,
+    score_fn: Callable[[np.ndarray], np.ndarray],
+    n_samples: int = 1000,
+    alpha: float = 0.05,
+    seed: int = DEFAULT_SEED,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """Paired bootstrap resampling (Koehn, 2004) over per-sentence sufficient statistics. Both systems are scored
+    on the same resampled sentences, and every resample is scored in one vectorized pass.
+
+    Args:
+        baseline_stats (np.ndarray): per-sentence statistics of the baseline system
+        system_stats (np.ndarray): per-sentence statistics of the compared system, for the same sentences
+        score_fn (Callable[[np.ndarray], np.ndarray]): vectorized corpus metric, e.g. corpus_bleu_from_stats
+        n_samples (int, optional): number of bootstrap resamples. Defaults to 1000.
+        alpha (float, optional): significance level of the confidence intervals. Defaults to 0.05.
+        seed (int, optional): random seed. Defaults to DEFAULT_SEED.
+        batch_size (int, optional): number of resamples scored at once. Defaults to DEFAULT_BATCH_SIZE.
+
+    Returns:
+        dict: observed scores and delta, their (1 - alpha) confidence intervals and the one-sided p-value that the
+        system is not better than the baseline
+    """
+    n_sentences = len(baseline_stats)
+    rng = np.random.default_rng(seed)
+    baseline_stats = baseline_stats.astype(np.float64)
+    system_stats = system_stats.astype(np.float64)
+
+    baseline_scores, system_scores = [], []
+    for start in range(0, n_samples, batch_size):
+        weights = _resample_weights(rng, n_sentences, min(batch_size, n_samples - start))
+        baseline_scores.append(score_fn(weights @ baseline_stats))
+        system_scores.append(score_fn(weights @ system_stats))
+    baseline_scores = np.concatenate(baseline_scores)
+    system_scores = np.concatenate(system_scores)
+    deltas = system_scores - baseline_scores
+
+    bounds = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    baseline_score = score_fn(baseline_stats.sum(axis=0))[0]
+    system_score = score_fn(system_stats.sum(axis=0))[0]
+    return {
+        "baseline_score": baseline_score,
+        "system_score": system_score,
+        "delta": system_score - baseline_score,
+        "baseline_ci": tuple(np.percentile(baseline_scores, bounds)),
+        "system_ci": tuple(np.percentile(system_scores, bounds)),
+        "delta_ci": tuple(np.percentile(deltas, bounds)),
+        "p_value": (np.count_nonzero(deltas <= 0) + 1) / (n_samples + 1),
+    }
+
+
+def approximate_randomization_test(
+    baseline_stats: np.ndarray,
+    system_stats: np.ndarray,
+    score_fn: Callable[[np.ndarray], np.ndarray],
+    n_trials: int = 10000,
+    seed: int = DEFAULT_SEED,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """Paired approximate randomization test (Riezler and Maxwell, 2005). Each trial swaps the outputs of the two
+    systems on a random half of the sentences; all trials are scored in vectorized batches.
+
+    Args:
+        baseline_stats (np.ndarray): per-sentence statistics of the baseline system
+        system_stats (np.ndarray): per-sentence statistics of the compared system, for the same sentences
+        score_fn (Callable[[np.ndarray], np.ndarray]): vectorized corpus metric, e.g. corpus_bleu_from_stats
+        n_trials (int, optional): number of random permutations. Defaults to 10000.
+        seed (int, optional): random seed. Defaults to DEFAULT_SEED.
+        batch_size (int, optional): number of trials scored at once. Defaults to DEFAULT_BATCH_SIZE.
+
+    Returns:
+        dict: observed delta and the two-sided p-value of a difference at least that large arising by chance
+    """
+    n_sentences = len(baseline_stats)
+    rng = np.random.default_rng(seed)
+    baseline_stats = baseline_stats.astype(np.float64)
+    system_stats = system_stats.astype(np.float64)
+    baseline_total = baseline_stats.sum(axis=0)
+    system_total = system_stats.sum(axis=0)
+    difference = system_stats - baseline_stats
+
+    observed_delta = score_fn(system_total)[0] - score_fn(baseline_total)[0]
+
+    extreme = 0
+    for start in range(0, n_trials, batch_size):
+        swaps = rng.integers(0, 2, size=(min(batch_size, n_trials - start), n_sentences)).astype(np.float64)
+        # swapping sentence i moves its statistics difference from one system's total to the other's
+        shift = swaps @ difference
+        deltas = score_fn(system_total - shift) - score_fn(baseline_total + shift)
+        extreme += np.count_nonzero(np.abs(deltas) >= abs(observed_delta))
+
+    return {
+        "delta": observed_delta,
+        "p_value": (extreme + 1) / (n_trials + 1),
+    }
+
+
+def compare_results_files(
+    baseline_path: str,
+    system_path: str,
+    n_samples: int = 1000,
+    n_trials: int = 10000,
+    seed: int = DEFAULT_SEED,
+) -> pd.DataFrame:
+    """Runs the paired bootstrap and approximate randomization tests for BLEU and chrF between two results files
+    translated from the same test set
+
+    Args:
+        baseline_path (path-like object): results parquet file of the baseline system
+        system_path (path-like object): results parquet file of the compared system
+        n_samples (int, optional): number of bootstrap resamples. Defaults to 1000.
+        n_trials (int, optional): number of approximate randomization trials. Defaults to 10000.
+        seed (int, optional): random seed. Defaults to DEFAULT_SEED.
+
+    Returns:
+        pd.DataFrame: one row of test results per metric
+    """
+    baseline_df = pd.read_parquet(baseline_path)
+    system_df = pd.read_parquet(system_path)
+    # missing references are scored as empty strings, and compared as such since NaN never equals itself
+    references = baseline_df["target_text"].fillna("").to_list()
+    if len(baseline_df.index) != len(system_df.index) or references != system_df["target_text"].fillna("").to_list():
+        raise ValueError("results files must contain the same references in the same order to be compared")
+
+    scorer = TranslationScorer()
+    baseline_bleu, baseline_chrf = scorer.sentence_statistics(get_hypotheses(baseline_df).to_list(), references)
+    system_bleu, system_chrf = scorer.sentence_statistics(get_hypotheses(system_df).to_list(), references)
+
+    rows = []
+    for metric, baseline_stats, system_stats in (
+        ("bleu", baseline_bleu, system_bleu),
+        ("chrf", baseline_chrf, system_chrf),
+    ):
+        score_fn = METRIC_FUNCTIONS[metric]
+        bootstrap = paired_bootstrap_test(baseline_stats, system_stats, score_fn, n_samples=n_samples, seed=seed)
+        randomization = approximate_randomization_test(baseline_stats, system_stats, score_fn, n_trials=n_trials, seed=seed)
+        bootstrap["bootstrap_p_value"] = bootstrap.pop("p_value")
+        rows.append({"metric": metric, **bootstrap, "randomization_p_value": randomization["p_value"]})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test whether the difference between two results files is significant")
+    parser.add_argument("baseline", type=str, help="results parquet file of the baseline system")
+    parser.add_argument("system", type=str, help="results parquet file of the compared system")
+    parser.add_argument("--samples", type=int, default=1000, help="number of paired bootstrap resamples")
+    parser.add_argument("--trials", type=int, default=10000, help="number of approximate randomization trials")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="random seed")
+    args = parser.parse_args()
+
+    comparison_df = compare_results_files(args.baseline, args.system, n_samples=args.samples, n_trials=args.trials, seed=args.seed)
+    print(comparison_df.to_string(index=False))
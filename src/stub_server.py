@@ -0,0 +1,88 @@
+import argparse
+import json
+import re
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import stub_completion
+
+
+def stream_chunks(json_data: dict):
+    """Splits the stub completion of a request into the chunks of a streamed response, one word per chunk,
+    followed by a usage chunk when the request asks for one
+
+    Args:
+        json_data (dict): Keyword arguments for `client.chat.completions.create`
+
+    Yields:
+        dict: ChatCompletionChunk objects
+    """
+    output = stub_completion(json_data)
+    base = {"id": output.id, "object": "chat.completion.chunk", "created": output.created, "model": output.model}
+    for choice in output.choices:
+        words = re.findall(r"\S+\s*", choice.message.content)
+        for i, word in enumerate(words):
+            delta = {"role": "assistant", "content": word} if i == 0 else {"content": word}
+            yield {**base, "choices": [{"index": choice.index, "delta": delta, "finish_reason": None}]}
+        yield {**base, "choices": [{"index": choice.index, "delta": {}, "finish_reason": choice.finish_reason}]}
+    if (json_data.get("stream_options") or {}).get("include_usage"):
+        yield {**base, "choices": [], "usage": output.usage.model_dump()}
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    """Answers OpenAI-style chat completion requests with `stub_completion` after a fixed latency, streamed as
+    server-sent events when the request asks for it
+    """
+
+    latency = 0.0
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_error(404, f"Unknown endpoint {self.path}")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        json_data = json.loads(self.rfile.read(length))
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if json_data.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for chunk in stream_chunks(json_data):
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # the client cancelled the stream
+                pass
+            self.close_connection = True
+            return
+
+        body = stub_completion(json_data).model_dump_json().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request would drown the throughput numbers of a load test
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve deterministic chat completions for load-testing the experiments")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    StubCompletionHandler.latency = args.latency
+    server = ThreadingHTTPServer((args.host, args.port), StubCompletionHandler)
+    print(f"Stub server listening on http://{args.host}:{args.port}/v1, set OPENAI_BASE_URL to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,337 @@
+import asyncio
+import re
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import openai
+import pandas as pd
+
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+from backends import OpenAIBackend, TranslationBackend, normalize_errors
+from checkpoint import CheckpointStore
+from consensus import mbr_select
+from instrumentation import RequestMetrics
+from request_layer import RequestLayer
+from response_cache import EARLY_STOP_FIELD, ResponseCache
+from translation_memory import TranslationMemory, deduplicate_source_texts, report_duplicates
+
+DEFAULT_CONCURRENCY = 16
+
+_request_layer: Optional[RequestLayer] = None
+
+
+def _default_request_layer() -> RequestLayer:
+    """Returns the request layer shared by every call that is not given one, so they share one rate limit"""
+    global _request_layer
+    if _request_layer is None:
+        _request_layer = RequestLayer()
+    return _request_layer
+
+
+def build_completion_request(
+    messages: List[Dict[str, str]],
+    model: str,
+    temperature=0,
+    max_tokens=None,
+    stop=None,
+    n=None,
+) -> dict:
+    """Builds the keyword arguments for a chat completion request, leaving out any unset sampling parameters
+
+    Args:
+        messages (List[Dict[str, str]]): Messages to send to the model
+        model (str): Name of the model served by the endpoint
+        temperature (float, optional): Sampling temperature. Defaults to 0.
+        max_tokens (int, optional): Maximum number of tokens to generate. Defaults to None.
+        stop (str, optional): Stopping condition for generation. Defaults to None.
+        n (int, optional): Number of completions to generate. Defaults to None.
+
+    Returns:
+        dict: Keyword arguments for `client.chat.completions.create`
+    """
+    json_data = {"model": model, "messages": messages}
+
+    if temperature is not None:
+        json_data["temperature"] = temperature
+    if max_tokens is not None:
+        json_data["max_tokens"] = max_tokens
+    if stop is not None:
+        json_data["stop"] = stop
+    if n is not None:
+        json_data["n"] = n
+
+    return json_data
+
+
+def create_chat_completion(
+    client: OpenAI,
+    json_data: dict,
+    cache: Optional[ResponseCache] = None,
+    request_layer: Optional[RequestLayer] = None,
+) -> ChatCompletion:
+    """Sends a chat completion request through the rate-limited request layer, retrying transient API errors.
+    Responses are served from and stored in `cache` when one is given.
+
+    Args:
+        client (OpenAI): Client for the OpenAI-compatible endpoint
+        json_data (dict): Keyword arguments for `client.chat.completions.create`
+        cache (ResponseCache, optional): Persistent response cache. Defaults to None.
+        request_layer (RequestLayer, optional): Rate limits and retry policy. Defaults to the shared layer
+            configured from the environment.
+
+    Raises:
+        openai.OpenAIError: If the error is not transient or the retries are used up
+
+    Returns:
+        ChatCompletion: The completion returned by the endpoint or the cache
+    """
+    if cache is not None:
+        output = cache.get(json_data)
+        if output is not None:
+            return output
+
+    request_layer = request_layer if request_layer is not None else _default_request_layer()
+    # retries are handled by the request layer, so the client must not retry on its own as well
+    client = client.with_options(max_retries=0)
+    output = request_layer.send_sync(lambda request: client.chat.completions.create(**request), json_data)
+
+    if cache is not None:
+        cache.put(json_data, output)
+    return output
+
+
+async def _translate_row(
+    backend: TranslationBackend,
+    semaphore: asyncio.Semaphore,
+    row_index,
+    source_text: str,
+    json_data: dict,
+    checkpoint: Optional[CheckpointStore] = None,
+    cache: Optional[ResponseCache] = None,
+    request_layer: Optional[RequestLayer] = None,
+    stream: bool = False,
+    stop_pattern: Optional[re.Pattern] = None,
+    translation_memory: Optional[TranslationMemory] = None,
+) -> Tuple[Optional[str], dict]:
+    """Sends a single translation request once a concurrency slot is free and measures it. A row whose request
+    fails for good is left out of the checkpoint and returned as None, so rerunning the experiment retries only
+    that row. When several candidates are sampled, their consensus becomes the response and all of them are
+    returned with the metrics.
+    """
+    metrics = RequestMetrics()
+    candidate_columns = {}
+    scheduled_time = time.perf_counter()
+    complete = backend.complete
+    cache_key = json_data
+    if stream:
+        complete = lambda request: backend.complete_streaming(request, stop_pattern, metrics)
+        if stop_pattern is not None:
+            # truncated responses must not be served to requests that want the whole response, or vice versa
+            cache_key = {**json_data, EARLY_STOP_FIELD: stop_pattern.pattern}
+
+    response = translation_memory.get(cache_key) if translation_memory is not None else None
+    if response is not None:
+        metrics.memory = True
+    else:
+        output = cache.get(cache_key) if cache is not None else None
+        if output is None:
+            async with semaphore:
+                metrics.queue_seconds = time.perf_counter() - scheduled_time
+                try:
+                    output = await request_layer.send(normalize_errors(complete), json_data, metrics)
+                except openai.OpenAIError as e:
+                    print(f"Row {row_index} failed: {e}")
+                    return None, metrics.as_dict()
+            if cache is not None:
+                cache.put(cache_key, output)
+        else:
+            metrics.cached = True
+            metrics.record_usage(output)
+        candidates = [choice.message.content for choice in output.choices]
+        response = candidates[0]
+        if len(candidates) > 1:
+            consensus_index, expected_chrf = mbr_select(candidates)
+            response = candidates[consensus_index]
+            candidate_columns = {"candidates": candidates, "candidate_chrf": expected_chrf.tolist()}
+        if translation_memory is not None:
+            translation_memory.put(cache_key, source_text, response)
+
+    columns = {**metrics.as_dict(), **candidate_columns}
+    if checkpoint is not None:
+        checkpoint.record(row_index, response, columns)
+    return response, columns
+
+
+async def _translate_all(
+    source_texts: pd.Series,
+    build_messages: Callable[[str], List[Dict[str, str]]],
+    model: str,
+    concurrency: int,
+    checkpoint: Optional[CheckpointStore] = None,
+    cache: Optional[ResponseCache] = None,
+    backend: Optional[TranslationBackend] = None,
+    request_layer: Optional[RequestLayer] = None,
+    stream: bool = False,
+    stop_pattern: Optional[re.Pattern] = None,
+    translation_memory: Optional[TranslationMemory] = None,
+    **sampling_kwargs,
+) -> List[Tuple[Optional[str], dict]]:
+    backend = backend if backend is not None else OpenAIBackend()
+    request_layer = request_layer if request_layer is not None else _default_request_layer()
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        tasks = [
+            _translate_row(
+                backend,
+                semaphore,
+                row_index,
+                source_text,
+                build_completion_request(build_messages(source_text), model, **sampling_kwargs),
+                checkpoint,
+                cache,
+                request_layer,
+                stream,
+                stop_pattern,
+                translation_memory,
+            )
+            for row_index, source_text in source_texts.items()
+        ]
+        # gather returns results in the order the tasks were given, regardless of completion order
+        return await asyncio.gather(*tasks)
+    finally:
+        await backend.close()
+
+
+def run_coroutine(coroutine):
+    """Runs a coroutine to completion from synchronous code and returns its result. `asyncio.run` refuses to start
+    inside a running event loop, such as a Jupyter notebook's, so there the coroutine runs on its own loop in a
+    worker thread while the caller waits.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def translate_with_metrics(
+    source_texts: pd.Series,
+    build_messages: Callable[[str], List[Dict[str, str]]],
+    model: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    temperature=0,
+    max_tokens=None,
+    stop=None,
+    n=None,
+    checkpoint_path: Optional[str] = None,
+    cache: Optional[ResponseCache] = None,
+    backend: Optional[TranslationBackend] = None,
+    request_layer: Optional[RequestLayer] = None,
+    stream: bool = False,
+    early_stop_pattern: Optional[str] = None,
+    deduplicate: bool = False,
+    translation_memory: Optional[TranslationMemory] = None,
+) -> pd.DataFrame:
+    """Translates a column of source texts with up to `concurrency` requests in flight at once, measuring every
+    request. Can be called from inside a running event loop, e.g. a notebook cell.
+
+    Args:
+        source_texts (pd.Series): Column of texts to translate
+        build_messages (Callable[[str], List[Dict[str, str]]]): Function building the chat messages for a source text
+        model (str): Name of the model served by the endpoint
+        concurrency (int, optional): Maximum number of requests in flight. Defaults to DEFAULT_CONCURRENCY.
+        temperature (float, optional): Sampling temperature. Defaults to 0.
+        max_tokens (int, optional): Maximum number of tokens to generate. Defaults to None.
+        stop (str, optional): Stopping condition for generation. Defaults to None.
+        n (int, optional): Number of completions to generate. With more than one, the response is their consensus
+            picked by `consensus.mbr_select`, which needs a temperature above 0. Defaults to None.
+        checkpoint_path (str, optional): SQLite file recording each response as soon as it arrives. Rows already
+            recorded there by an interrupted run are not requested again. Defaults to None.
+        cache (ResponseCache, optional): Persistent response cache consulted before each request. Defaults to None.
+        backend (TranslationBackend, optional): Backend answering the requests. Defaults to an `OpenAIBackend`.
+        request_layer (RequestLayer, optional): Rate limits and retry policy. Defaults to the shared layer
+            configured from the environment.
+        stream (bool, optional): Stream responses, which measures the time to first token. Defaults to False.
+        early_stop_pattern (str, optional): Regular expression that matches once the translation is complete,
+            e.g. `backends.EARLY_STOP_PATTERN`. Streamed responses are cancelled there and saved truncated.
+            Implies `stream`. Defaults to None.
+        deduplicate (bool, optional): Translate each sentence once, comparing sentences after cleaning them like
+            `preprocess.clean_and_process_inuktitut_text`, and copy the response to its repeats. Defaults to False.
+        translation_memory (TranslationMemory, optional): Persistent record of translated segments consulted
+            before the response cache, so a segment is never translated twice across runs. Defaults to None.
+
+    Returns:
+        pd.DataFrame: A `response` column and the `request_` metric columns of `RequestMetrics`, in the same order
+        and with the same index as `source_texts`. With `n` above 1, also the sampled `candidates` of each row and
+        their `candidate_chrf` against each other. Rows whose request failed after all retries have no response.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+    if n is not None and n > 1 and not temperature:
+        raise ValueError(f"sampling {n} candidates needs a temperature above 0, got {temperature}")
+    stop_pattern = re.compile(early_stop_pattern) if early_stop_pattern is not None else None
+
+    unique_texts, representatives = source_texts, None
+    if deduplicate:
+        # only the first occurrence of each sentence is requested and checkpointed; its repeats share the response
+        unique_texts, representatives = deduplicate_source_texts(source_texts)
+        report_duplicates(source_texts, representatives)
+
+    checkpoint = CheckpointStore(checkpoint_path) if checkpoint_path is not None else None
+    # the checkpoint may also hold rows of other calls sharing it, e.g. packs of another size
+    completed = checkpoint.completed() if checkpoint is not None else {}
+    completed = {row_index: response for row_index, response in completed.items() if row_index in unique_texts.index}
+    completed_metrics = checkpoint.metrics() if checkpoint is not None else {}
+    if completed:
+        print(f"Resuming from checkpoint: {len(completed)} of {len(unique_texts)} rows already translated")
+    pending = unique_texts[~unique_texts.index.isin(list(completed))]
+
+    try:
+        results = run_coroutine(
+            _translate_all(
+                pending,
+                build_messages,
+                model,
+                concurrency,
+                checkpoint,
+                cache,
+                backend,
+                request_layer,
+                stream or stop_pattern is not None,
+                stop_pattern,
+                translation_memory,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stop=stop,
+                n=n,
+            )
+        )
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    n_failed = sum(response is None for response, _ in results)
+    if n_failed:
+        print(f"{n_failed} rows failed and were left empty; run again to retry them from the checkpoint")
+
+    rows = {}
+    for row_index, response in completed.items():
+        rows[row_index] = {"response": response, **completed_metrics.get(row_index, {}), "request_resumed": True}
+    for row_index, (response, metrics) in zip(pending.index, results):
+        rows[row_index] = {"response": response, **metrics}
+    if representatives is not None:
+        duplicate_metrics = RequestMetrics()
+        duplicate_metrics.duplicate = True
+        for row_index, representative in representatives.items():
+            if row_index not in rows:
+                rows[row_index] = {**rows[representative], **duplicate_metrics.as_dict()}
+    columns = ["response", *RequestMetrics().as_dict()]
+    if n is not None and n > 1:
+        columns += ["candidates", "candidate_chrf"]
+    return pd.DataFrame([rows[row_index] for row_index in source_texts.index], index=source_texts.index, columns=columns)
+
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import time
+
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from preprocess import clean_and_process_inuktitut_series
+from response_cache import make_cache_key
+from utils import get_project_root
+
+project_dir = get_project_root(os.path.abspath(os.path.dirname(__file__)))
+
+DEFAULT_MEMORY_PATH = os.environ.get(
+    "TRANSLATION_MEMORY_PATH",
+    os.path.join(project_dir, "data", "cache", "translation_memory.sqlite"),
+)
+
+
+def deduplicate_source_texts(source_texts: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """Finds the rows of a test set that repeat an earlier sentence once both are cleaned with
+    `clean_and_process_inuktitut_text`, so each sentence only has to be translated once. The cleaned text is only
+    used to group the rows: each group is translated from the original text of its first row, so the prompts are
+    the same as without deduplication.
+
+    Args:
+        source_texts (pd.Series): Column of texts to translate
+
+    Returns:
+        Tuple[pd.Series, pd.Series]: The original text of the first occurrence of each sentence, indexed by its row,
+        and for every row the index of the row whose translation it shares
+    """
+    normalized = clean_and_process_inuktitut_series(source_texts.astype(str))
+    representatives = pd.Series(source_texts.index, index=source_texts.index).groupby(
+        normalized.to_numpy(), sort=False
+    ).transform("first")
+    return source_texts[~normalized.duplicated().to_numpy()], representatives
+
+
+def report_duplicates(source_texts: pd.Series, representatives: pd.Series, top: int = 5) -> dict:
+    """Prints how many rows repeat an earlier sentence, and the most repeated sentences
+
+    Args:
+        source_texts (pd.Series): Column of texts to translate
+        representatives (pd.Series): Row whose translation each row shares, from `deduplicate_source_texts`
+        top (int, optional): Number of most repeated sentences to list. Defaults to 5.
+
+    Returns:
+        dict: Number of rows, unique sentences and duplicate rows
+    """
+    counts = representatives.value_counts()
+    n_rows = len(source_texts.index)
+    n_unique = len(counts.index)
+    print(
+        f"Deduplication: {n_rows} rows, {n_unique} unique sentences, "
+        f"{n_rows - n_unique} duplicates ({(n_rows - n_unique) / n_rows if n_rows else 0.0:.1%})"
+    )
+    for row_index, count in counts[counts > 1].head(top).items():
+        print(f"  {count}x {source_texts[row_index][:80]}")
+    return {"rows": n_rows, "unique_sentences": n_unique, "duplicates": n_rows - n_unique}
+
+
+class TranslationMemory:
+    """Persistent record of every translated segment, stored in a local SQLite file and keyed by the request that
+    produced it, so a segment that comes up again in a later run, in another test set or as a duplicate is never
+    translated twice. Unlike `ResponseCache`, entries are never evicted and only the response text is kept.
+    """
+
+    def __init__(self, path: str = DEFAULT_MEMORY_PATH, namespace: Optional[str] = None):
+        """
+        Args:
+            path (str, optional): SQLite file of the memory. Defaults to DEFAULT_MEMORY_PATH.
+            namespace (str, optional): Keeps translations of different backends apart. Defaults to None.
+        """
+        self.path = path
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+        memory_dir = os.path.dirname(path)
+        if memory_dir and not os.path.exists(memory_dir):
+            os.makedirs(memory_dir)
+        # shared with the engine's worker thread, see `translation_engine.run_coroutine`
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, source_text TEXT NOT NULL, response TEXT NOT NULL, "
+            "created REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get(self, json_data: dict) -> Optional[str]:
+        """Looks up the translation produced by a request
+
+        Args:
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+
+        Returns:
+            Optional[str]: The stored response, or None if the segment has not been translated this way yet
+        """
+        key = make_cache_key(json_data, self.namespace)
+        row = self.connection.execute("SELECT response FROM segments WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, json_data: dict, source_text: str, response: str):
+        """Records the translation produced by a request
+
+        Args:
+            json_data (dict): Keyword arguments for `client.chat.completions.create`
+            source_text (str): Segment that was translated
+            response (str): Model response
+        """
+        self.connection.execute(
+            "INSERT OR IGNORE INTO segments (key, model, source_text, response, created) VALUES (?, ?, ?, ?, ?)",
+            (make_cache_key(json_data, self.namespace), json_data["model"], source_text, response, time.time()),
+        )
+        self.connection.commit()
+
+    def report(self):
+        """Prints the hits and misses of this session along with the number of stored segments"""
+        entries = self.connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        print(f"Translation memory: {self.hits} hits, {self.misses} misses, {entries} segments")
+
+    def close(self):
+        self.connection.close()
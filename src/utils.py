@@ -1,13 +1,17 @@
 import os
 import re
-from typing import Dict, List, Set, Literal, get_args, get_origin
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Literal, get_args, get_origin
 from sys import _getframe
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from defusedxml import ElementTree as ET
 from dotenv import load_dotenv
-from nltk.translate.bleu_score import sentence_bleu
+
+from postprocess import TranslationScorer
 
 project_dir = os.path.join(os.path.dirname(__file__), os.pardir)
 dotenv_path = os.path.join(project_dir, ".env")
@@ -19,6 +23,10 @@ SPLITS = Literal['test', 'train', 'dev', 'dev-dedup', 'devtest-dedup', 'devtest'
 
 GOLD_STANDARD_MODES = Literal['consensus', 'individual']
 
+DEFAULT_CHUNK_SIZE = 100_000
+
+PARALLEL_CORPUS_SCHEMA = pa.schema([("source_text", pa.string()), ("target_text", pa.string())])
+
 
 def enforce_literals(function):
     """A helper function to enforce literals in function arguments
@@ -48,23 +56,19 @@ def get_project_root(current_path, marker='.git'):
 def eval_results(res_df: pd.DataFrame):
     """
     Calculates the BLEU scores for each translation in the given DataFrame and adds the scores as a new column.
+    Scores come from TranslationScorer, the same sacrebleu engine used for the results metrics, on a 0-100 scale.
     Args:
-        res_df (pd.DataFrame): The DataFrame containing the translation results. It should have 'tgt_txt' and 'trans_txt' columns.
+        res_df (pd.DataFrame): The DataFrame containing the translation results. It should have 'target_text' and 'translated_text' columns.
     Returns:
         pd.DataFrame: The input DataFrame with an additional 'bleu_scores' column containing the BLEU scores for each translation.
     """
-    bleu_scores = []
-    for _, row in res_df.iterrows():
-        reference = row["target_text"].split()
-        prediction = row["translated_text"].split()
-
-        bleu = sentence_bleu([reference], prediction)
-        bleu_scores.append(bleu)
+    scores = TranslationScorer().score(res_df["translated_text"].tolist(), res_df["target_text"].tolist())
+    bleu_scores = scores["sentence_bleu"]
 
     res_df["bleu_scores"] = bleu_scores
-    avg_bleu = sum(bleu_scores) / len(bleu_scores)
+    avg_bleu = bleu_scores.mean()
     print(f"Average BLEU score: {avg_bleu}")
-    max_bleu = max(bleu_scores)
+    max_bleu = bleu_scores.max()
     print(f"Max BLEU score: {max_bleu}")
 
     return res_df
@@ -93,6 +97,64 @@ def get_file_prefixes(gs_1_path: str, gs_2_path: str) -> Set[str]:
     return gs_1_prefixes.union(gs_2_prefixes)
 
 
+def iter_parallel_lines(source_path: str, target_path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Lazily reads aligned line pairs from the source and target paths, skipping pairs where either side is empty.
+
+    Args:
+        source_path (str): The path to the source text file.
+        target_path (str): The path to the target text file.
+
+    Yields:
+        Tuple[str, str]: Stripped source and target lines.
+    """
+    with open(source_path, "r", encoding="utf-8") as source_file, open(
+        target_path, "r", encoding="utf-8"
+    ) as target_file:
+        for source_line, target_line in zip(source_file, target_file):
+            source_line = source_line.strip()
+            target_line = target_line.strip()
+            if source_line and target_line:
+                yield source_line, target_line
+
+
+def iter_parallel_text_chunks(
+    file_pairs: List[Tuple[str, str]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """
+    Streams parallel text data from one or more pairs of source and target files as fixed-size DataFrame chunks,
+    so the full corpus never has to be held in memory.
+
+    Args:
+        file_pairs (List[Tuple[str, str]]): Source and target file paths to read, in order.
+        chunk_size (int, optional): Number of line pairs per chunk. Defaults to DEFAULT_CHUNK_SIZE.
+
+    Yields:
+        pd.DataFrame: Chunks with 'source_text' and 'target_text' columns; the last chunk may be shorter. Rows are
+        indexed by their position in the whole stream, so the chunks concatenate into the unchunked DataFrame.
+    """
+    source_chunk: List[str] = []
+    target_chunk: List[str] = []
+    start = 0
+    for source_path, target_path in file_pairs:
+        for source_line, target_line in iter_parallel_lines(source_path, target_path):
+            source_chunk.append(source_line)
+            target_chunk.append(target_line)
+            if len(source_chunk) == chunk_size:
+                yield pd.DataFrame(
+                    {"source_text": source_chunk, "target_text": target_chunk},
+                    index=pd.RangeIndex(start, start + chunk_size),
+                )
+                start += chunk_size
+                source_chunk, target_chunk = [], []
+    if source_chunk:
+        yield pd.DataFrame(
+            {"source_text": source_chunk, "target_text": target_chunk},
+            index=pd.RangeIndex(start, start + len(source_chunk)),
+        )
+
+
 def load_parallel_text_data(
     source_directory: str,
     target_directory: str,
@@ -108,18 +170,26 @@ def load_parallel_text_data(
         pd.DataFrame: The loaded parallel text data.
     """
     temp_data: Dict[str, List[str]] = {"source_text": [], "target_text": []}
-    with open(source_directory, "r", encoding="utf-8") as source_file, open(
-        target_directory, "r", encoding="utf-8"
-    ) as target_file:
-        for source_line, target_line in zip(source_file, target_file):
-            source_line = source_line.strip()
-            target_line = target_line.strip()
-            if source_line and target_line:
-                temp_data["source_text"].append(source_line)
-                temp_data["target_text"].append(target_line)
+    for source_line, target_line in iter_parallel_lines(source_directory, target_directory):
+        temp_data["source_text"].append(source_line)
+        temp_data["target_text"].append(target_line)
     return temp_data
 
 
+def inuktitut_parallel_corpus_files(path: str, split: SPLITS = 'test') -> List[Tuple[str, str]]:
+    """Returns the source and target file paths of an Inuktitut parallel corpus split
+
+    Args:
+        path (str): Directory containing the split files
+        split (SPLITS): Split to load. Defaults to 'test'.
+
+    Returns:
+        List[Tuple[str, str]]: The (source, target) file pair for the split
+    """
+    enforce_literals(inuktitut_parallel_corpus_files)
+    return [(f"{path}/{split}.iu", f"{path}/{split}.en")]
+
+
 def load_inuktitut_parallel_corpus(path: str, split: SPLITS = 'test'):
     """Loads data from parallel corpus files specified by
 
@@ -131,29 +201,21 @@ def load_inuktitut_parallel_corpus(path: str, split: SPLITS = 'test'):
     """
     enforce_literals(load_inuktitut_parallel_corpus)
 
-    data: dict = {"source_text": [], "target_text": []}
-    source_filename = f"{path}/{split}.iu"
-    target_filename = f"{path}/{split}.en"
+    [(source_filename, target_filename)] = inuktitut_parallel_corpus_files(path, split=split)
 
     # load data from source and target files using load_parallel_text_data
-    temp_data = load_parallel_text_data(source_filename, target_filename)
-    data["source_text"].extend(temp_data["source_text"])
-    data["target_text"].extend(temp_data["target_text"])
-    return pd.DataFrame(data)
+    return pd.DataFrame(load_parallel_text_data(source_filename, target_filename))
 
 
-def load_cree_parallel_data(input_directory: str) -> pd.DataFrame:
-    """load Cree data from specified directory into a Dataframe
+def cree_parallel_corpus_files(input_directory: str) -> List[Tuple[str, str]]:
+    """Finds the pairs of Cree and English files in the specified directory
 
     Args:
         input_directory (str): string containing input path
 
     Returns:
-        pd.DataFrame: Dataframe with contents from parallel data
+        List[Tuple[str, str]]: (Cree, English) file path pairs
     """
-    cree_text = []
-    english_text = []
-
     # Gather all file paths
     filepaths = []
     for root, _, files in os.walk(input_directory):
@@ -170,20 +232,53 @@ def load_cree_parallel_data(input_directory: str) -> pd.DataFrame:
             suffix = filepath[-6:-4]  # Extract `_cr` or `_en`
             grouped_files[base_name][suffix] = filepath
 
-    # Process valid pairs
-    for _, files in grouped_files.items():
-        if "cr" in files and "en" in files:
-            source_path = files["cr"]
-            target_path = files["en"]
+    # Keep valid pairs
+    return [
+        (files["cr"], files["en"])
+        for files in grouped_files.values()
+        if "cr" in files and "en" in files
+    ]
+
+
+def load_cree_parallel_data(input_directory: str) -> pd.DataFrame:
+    """load Cree data from specified directory into a Dataframe
+
+    Args:
+        input_directory (str): string containing input path
 
-            temp_data = load_parallel_text_data(source_path, target_path)
-            if temp_data:
-                cree_text.extend(temp_data["source_text"])
-                english_text.extend(temp_data["target_text"])
+    Returns:
+        pd.DataFrame: Dataframe with contents from parallel data
+    """
+    cree_text = []
+    english_text = []
+
+    # Process valid pairs
+    for source_path, target_path in cree_parallel_corpus_files(input_directory):
+        temp_data = load_parallel_text_data(source_path, target_path)
+        if temp_data:
+            cree_text.extend(temp_data["source_text"])
+            english_text.extend(temp_data["target_text"])
 
     return pd.DataFrame({"source_text": cree_text, "target_text": english_text})
 
 
+def index_sentences(root) -> Dict[str, str]:
+    """
+    Maps the id of every sentence in a gold standard document to its text in a single pass. A repeated id keeps
+    the text of its first sentence, as a lookup with `root.find` would.
+
+    Parameters:
+    - root (ElementTree.Element): The root element of the Inuktitut or English XML file.
+
+    Returns:
+    - Dict[str, str]: A dictionary from sentence id to sentence text.
+    """
+    sentences = {}
+    for sentence in root.iterfind("./p/s"):
+        sentences.setdefault(sentence.get("id"), sentence.text)
+    return sentences
+
+
 def link_gold_standard(links, inuktitut_root, english_root):
     """
     Extracts data from the given links and returns a pandas DataFrame.
@@ -202,6 +297,10 @@ def link_gold_standard(links, inuktitut_root, english_root):
         "target_text": [],
     }
 
+    # Index the sentences of each document once so every lookup is constant time
+    inuktitut_sentences = index_sentences(inuktitut_root)
+    english_sentences = index_sentences(english_root)
+
     # Iterate through the links in the alignment file
     for link in links:
         # Get the xtargets and link type
@@ -213,10 +312,8 @@ def link_gold_standard(links, inuktitut_root, english_root):
         # Split IDs into parts based on the link type
         src_ids = src_ids.split(" ")
         tgt_ids = tgt_ids.split(" ")
-        src_phrases = [
-            inuktitut_root.find(f"./p/s[@id='{sid}']").text for sid in src_ids
-        ]
-        tgt_phrases = [english_root.find(f"./p/s[@id='{tid}']").text for tid in tgt_ids]
+        src_phrases = [inuktitut_sentences[sid] for sid in src_ids]
+        tgt_phrases = [english_sentences[tid] for tid in tgt_ids]
 
         # Convert src_phrases list into one string
         src_text = " ".join(src_phrases)
@@ -265,12 +362,71 @@ def extract_and_align_gold_standard(file_prefix: str):
     return link_gold_standard(links, inuktitut_root, english_root)
 
 
-def load_consensus_gold_standards(gs_dir: str):
+def _try_extract_and_align_gold_standard(file_prefix: str):
+    """Runs extract_and_align_gold_standard, returning the error message instead of raising so one bad file does not abort a batch"""
+    try:
+        return file_prefix, extract_and_align_gold_standard(file_prefix), None
+    except Exception as e:
+        return file_prefix, None, f"{type(e).__name__}: {e}"
+
+
+def load_gold_standard_files(file_prefixes: Set[str], n_workers: int = 1, skip_failures: bool = True):
+    """
+    Extracts and aligns the gold standard files for every file prefix, optionally across a pool of processes.
+    Files that fail to parse are reported and, if `skip_failures` is set, left out.
+
+    Args:
+        file_prefixes (Set[str]): File prefixes of the gold standards to load.
+        n_workers (int, optional): Number of processes used to parse the files. Defaults to 1.
+        skip_failures (bool, optional): Return the files that loaded when others fail, rather than raising.
+            Defaults to True.
+
+    Raises:
+        ValueError: Is raised if no file could be loaded, or if any file failed and `skip_failures` is not set.
+
+    Returns:
+        pd.DataFrame: The aligned gold standards, concatenated in sorted file prefix order.
+    """
+    file_prefixes = sorted(file_prefixes)
+    if not file_prefixes:
+        raise ValueError("No gold standard files to load")
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_try_extract_and_align_gold_standard, file_prefixes))
+    else:
+        results = [_try_extract_and_align_gold_standard(file_prefix) for file_prefix in file_prefixes]
+
+    gs_dfs = []
+    failed_prefixes = []
+    for file_prefix, df, error in results:
+        if error is not None:
+            print(f"Failed to load gold standard {file_prefix}: {error}")
+            failed_prefixes.append(file_prefix)
+            continue
+        gs_dfs.append(df)
+
+    if not gs_dfs:
+        raise ValueError(f"None of the {len(file_prefixes)} gold standard files could be loaded")
+    if failed_prefixes:
+        if not skip_failures:
+            raise ValueError(
+                f"{len(failed_prefixes)} of {len(file_prefixes)} gold standard files failed to load, "
+                f"e.g. {failed_prefixes[0]}"
+            )
+        print(f"Skipped {len(failed_prefixes)} of {len(file_prefixes)} gold standard files")
+
+    return pd.concat(gs_dfs, ignore_index=True)
+
+
+def load_consensus_gold_standards(gs_dir: str, n_workers: int = 1, skip_failures: bool = True):
     """
     Load consensus gold standards from the given directory.
 
     Args:
         gs_dir (str): The directory path where the gold standards are located.
+        n_workers (int, optional): Number of processes used to parse the gold standard files. Defaults to 1.
+        skip_failures (bool, optional): Leave out files that fail to load rather than raising. Defaults to True.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing the concatenated gold standards.
@@ -281,21 +437,16 @@ def load_consensus_gold_standards(gs_dir: str):
 
     file_prefixes = get_file_prefixes(gs_1_path, gs_2_path)
 
-    gs_dfs = []
+    return load_gold_standard_files(file_prefixes, n_workers=n_workers, skip_failures=skip_failures)
 
-    for file_prefix in file_prefixes:
-        df = extract_and_align_gold_standard(file_prefix)
-        gs_dfs.append(df)
 
-    return pd.concat(gs_dfs, ignore_index=True)
-
-
-def load_individual_gold_standards(gs_dir: str):
+def load_individual_gold_standards(gs_dir: str, n_workers: int = 1):
     """
     Load individually annotated gold standards from the given directory.
 
     Args:
         gs_dir (str): The directory path where the gold standards are located.
+        n_workers (int, optional): Number of processes used to parse the gold standard files. Defaults to 1.
 
     Returns:
         pd.DataFrame: A concatenated DataFrame of the gold standards.
@@ -306,19 +457,14 @@ def load_individual_gold_standards(gs_dir: str):
 
     file_prefixes = get_file_prefixes(gs_1_path, gs_2_path)
 
-    gs_dfs = []
-
-    for file_prefix in file_prefixes:
-        df = extract_and_align_gold_standard(file_prefix)
-        gs_dfs.append(df)
-
-    return pd.concat(gs_dfs, ignore_index=True)
+    return load_gold_standard_files(file_prefixes, n_workers=n_workers)
 
 
 def serialize_gold_standards(
     input_path: str,
     output_path: str,
     mode: GOLD_STANDARD_MODES = 'consensus',
+    n_workers: int = 1,
 ):
     """
     Loads the gold standard data for a specified mode and file prefix and saves it as a parquet file for fast access.
@@ -327,6 +473,7 @@ def serialize_gold_standards(
         input_path (str): The directory containing the gold standard files.
         output_path (str): The path and file name for resultant parquet file.
         mode (GOLD_STANDARD_MODES): Specifies which gold standard files to load, valid types are 'consensus' and 'individual.
+        n_workers (int, optional): Number of processes used to parse the gold standard files. Defaults to 1.
     """
     enforce_literals(serialize_gold_standards)
 
@@ -335,20 +482,55 @@ def serialize_gold_standards(
         print("Serialized gold standard already exists... skipping")
         return
     if mode == 'consensus':
-        gold_standard_df = load_consensus_gold_standards(input_path)
+        gold_standard_df = load_consensus_gold_standards(input_path, n_workers=n_workers)
         gold_standard_df.to_parquet(output_path)
         return
     if mode == 'individual':
-        gold_standard_df = load_individual_gold_standards(input_path)
+        gold_standard_df = load_individual_gold_standards(input_path, n_workers=n_workers)
         gold_standard_df.to_parquet(output_path)
         return
 
 
+def write_parquet_chunks(chunks: Iterator[pd.DataFrame], output_path: str, preserve_index: bool = False) -> int:
+    """
+    Writes DataFrame chunks to a parquet file one row group at a time, so only one chunk is held in memory.
+
+    Args:
+        chunks (Iterator[pd.DataFrame]): Chunks with 'source_text' and 'target_text' columns.
+        output_path (str): Filepath of the parquet file to write.
+        preserve_index (bool, optional): Also stores the integer index of the chunks, like `DataFrame.to_parquet`
+            does for a filtered DataFrame. Defaults to False.
+
+    Returns:
+        int: Number of rows written.
+    """
+    schema = PARALLEL_CORPUS_SCHEMA
+    if preserve_index:
+        schema = schema.append(pa.field("__index_level_0__", pa.int64()))
+    n_rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=preserve_index)
+            if writer is None:
+                # the first table carries the pandas metadata that restores the index when reading the file
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            n_rows += len(chunk.index)
+        if writer is None:
+            writer = pq.ParquetWriter(output_path, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
 def serialize_parallel_corpus(
     input_path: str,
     output_path: str,
     split: SPLITS = 'test',
     language_mode: SOURCE_LANGUAGES = 'inuktitut',
+    chunk_size: Optional[int] = None,
 ):
     """
     Serializes the parallel corpus to a parquet file. Does not run if the file already exists.
@@ -358,8 +540,19 @@ def serialize_parallel_corpus(
         output_path (str): Filepath to save the serialized parallel corpus.
         split (SPLITS): Split for Inuktitut data only. Defaults to 'test'.
         mode (SOURCE_LANGUAGES): Mode for selecting language to serialize. Defaults to 'inuktitut'.
+        chunk_size (int, optional): If set, streams the corpus to parquet in row groups of this many line pairs
+            instead of loading it into memory first. Defaults to None.
     """
     enforce_literals(serialize_parallel_corpus)
+    if chunk_size is not None:
+        if language_mode == 'inuktitut':
+            file_pairs = inuktitut_parallel_corpus_files(input_path, split=split)
+        else:
+            file_pairs = cree_parallel_corpus_files(input_path)
+        print(f"Streaming {language_mode} parallel corpus to {output_path} in chunks of {chunk_size}")
+        n_rows = write_parquet_chunks(iter_parallel_text_chunks(file_pairs, chunk_size=chunk_size), output_path)
+        print(f"Wrote {n_rows} line pairs")
+        return
     if language_mode == 'inuktitut':
         print(f"Serializing Inuktitut parallel corpus to {output_path}")
         parallel_corpus_df = load_inuktitut_parallel_corpus(input_path, split=split)
@@ -372,28 +565,51 @@ def serialize_parallel_corpus(
         return
 
 
-def generate_n_shot_examples(gold_standard: pd.DataFrame, n_shots: int):
+def format_n_shot_examples(examples: pd.DataFrame) -> str:
+    """
+    Formats gold standard examples into a string to pass to language model.
+
+    Args:
+        examples (pandas.DataFrame): Gold standard rows with `source_text` and `target_text` columns.
+
+    Returns:
+        str: A string containing the examples for few-shot learning.
+    """
+    return "".join(
+        f"Text: {source_example} | Translation: {target_example} ###\n"
+        for source_example, target_example in zip(examples["source_text"], examples["target_text"])
+    )
+
+
+def generate_n_shot_examples(
+    gold_standard: pd.DataFrame,
+    n_shots: int,
+    random_state=None,
+    source_text: Optional[str] = None,
+    retriever=None,
+):
     """
     Selects a random subset of examples from the gold standard and formats into a string to pass to language model.
 
     Args:
         gold_std (pandas.DataFrame): The gold standard dataframe.
         n_shots (int): The number of examples to include from the gold standard.
+        random_state (int or numpy.random.Generator, optional): Seed for a reproducible selection. Defaults to None.
+        source_text (str, optional): Sentence to translate, required when selecting with a retriever. Defaults to None.
+        retriever (few_shot_retrieval.ExampleRetriever, optional): Index over `gold_standard` used to select the
+            examples most similar to `source_text` instead of a random subset. Defaults to None.
 
     Returns:
         str: A string containing the examples for few-shot learning.
     """
-    # Select a random subset of examples from the gold standard
-    gold_standard_subset = gold_standard.sample(n=n_shots, replace=False)
+    if retriever is not None:
+        if source_text is None:
+            raise ValueError("source_text is required to retrieve examples")
+        # most similar example last, right before the sentence to translate
+        positions = retriever.query([source_text], n_shots)[0][::-1]
+        return format_n_shot_examples(gold_standard.iloc[positions])
 
-    # Empty string to store examples for few-shot learning
-    examples = ""
-
-    # Parse gold standard dataframe to get examples
-    for _, row in gold_standard_subset.iterrows():
-        source_example = row["source_text"]
-        target_example = row["target_text"]
-
-        examples += f"Text: {source_example} | Translation: {target_example} ###\n"
+    # Select a random subset of examples from the gold standard
+    gold_standard_subset = gold_standard.sample(n=n_shots, replace=False, random_state=random_state)
 
-    return examples
\ No newline at end of file
+    return format_n_shot_examples(gold_standard_subset)
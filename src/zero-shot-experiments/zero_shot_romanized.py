@@ -1,142 +1,27 @@
 #%%
 import os
-import time
+import sys
 
-import openai
-from openai import OpenAI
-import pandas as pd
+# the shared modules live in src/, one level up from this script
+module_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
 
-from dotenv import load_dotenv
-# from IPython.display import display
+if module_path not in sys.path:
+    sys.path.insert(0, module_path)
 
-from utils import get_project_root
-
-project_dir = get_project_root(os.path.abspath(os.path.dirname(__file__)))
-dotenv_path = os.path.join(project_dir, ".env")
-load_dotenv(dotenv_path)
-
-#--------------------------------------------------
-TEST_DEDUP_INUKTITUT_ROMAN_PATH = os.path.join(
-    project_dir,
-    "data",
-    "serialized",
-    "test-dedup_roman_parallel_corpus.parquet"
-)
-DEV_DEDUP_INUKTITUT_ROMAN_PATH = os.path.join(
-    project_dir,
-    "data",
-    "serialized",
-    "dev-dedup_roman_parallel_corpus.parquet"
-)
-DEVTEST_DEDUP_INUKTITUT_ROMAN_PATH = os.path.join(
-    project_dir,
-    "data",
-    "serialized",
-    "devtest-dedup_roman_parallel_corpus.parquet"
-)
-#--------------------------------------------------
-SERIALIZED_CREE_PATH = os.path.join(
-    project_dir, "data", "serialized", "cree_corpus.parquet"
-)
-#--------------------------------------------------
-SOURCE_LANGUAGE = "Inuktitut (Romanized)"
-TARGET_LANGUAGE = "English"
+# experiment_runner loads .env before importing the modules that read it, so it comes first
+from experiment_runner import ExperimentCell, ExperimentRunner, check_api_key
+from backends import BACKEND
 
+# kept as an entry point for this single experiment; experiment_runner.py runs whole sweeps
 MODEL = os.environ.get("MODEL", "Mistral-7B-Instruct-v0.3")
-print("Working with:", MODEL)
-
-def zero_shot_machine_translation(
-    source_text:str,
-    temperature=0,
-    max_completion_tokens=350,
-    stop=None,
-    n=None,
-    model=None,
-):
-    messages = [
-        {
-            "role": "user",
-            "content": f"You are a machine translation system. \n[{SOURCE_LANGUAGE}]: {source_text}\n[{TARGET_LANGUAGE}]:",
-        },
-    ] # prompt template for mistral
-    # messages = [
-    #     {
-    #         "role": "system",
-    #         "content": "You are a machine translation system.",
-    #     },
-    #     {
-    #         "role": "user",
-    #         "content": f"[{SOURCE_LANGUAGE}]: {source_text}\n[{TARGET_LANGUAGE}]:",
-    #     },
-    # ] # prompt template for Llama-3.1
-
-    json_data = {"model": MODEL,  "messages": messages}
-
-    if temperature is not None:
-        json_data["temperature"] = temperature
-    if max_completion_tokens is not None:
-        json_data["max_tokens"] = max_completion_tokens
-    if stop is not None:
-        json_data["stop"] = stop
-    if n is not None:
-        json_data["n"] = n
-
-    print("Source text to be translated:\n", source_text)
-    output = None
-    while output is None:
-        try:
-            output = client.chat.completions.create(**json_data)
-        except openai.OpenAIError as e:
-            print(e)
-            time.sleep(10)
-
-    print("Generated Output:\n", output.choices[0].message.content)
-    print("--------------------------------------------------")
-    return output.choices[0].message.content
+CONCURRENCY = int(os.environ.get("CONCURRENCY", 16))
 
 #%%
 if __name__ == '__main__':
-    try:
-        openai.api_key = os.environ.get('OPENAI_API_KEY')
-        if openai.api_key is None:
-            raise Exception
-        else:
-            print("API Key Obtained Successfully!")
-    except Exception:
-        print("Error reading OpenAI API key from environment variable")
-        exit(1)
-
-    client = OpenAI()
-
-    inuktitut_romanized_df = pd.read_parquet(TEST_DEDUP_INUKTITUT_ROMAN_PATH)
-
-    print("Loaded data")
-
-    print("Generating Translation Results")
-    start_time = time.perf_counter()
-    inuktitut_romanized_df["response"] = inuktitut_romanized_df["source_text"].apply(zero_shot_machine_translation)
-    end_time = time.perf_counter()
+    if BACKEND == "openai":
+        check_api_key()
+    print("Working with:", MODEL)
 
-    elapsed_time = end_time - start_time
-    print("Total time elapsed:", elapsed_time)
-    average_time = elapsed_time / len(inuktitut_romanized_df.index)
-    print("Average processing time:", average_time)
-    
-    out_dir = os.path.join(
-        project_dir,
-        "src",
-        "results",
-        MODEL
-    )
-    
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    
-    out_path = os.path.join(
-        out_dir,
-        "romanized-zero-shot.parquet"
-    )
-    
-    inuktitut_romanized_df.to_parquet(out_path)
-    print("Saved results to disk")
-# %%
\ No newline at end of file
+    runner = ExperimentRunner(concurrency=CONCURRENCY, force=True)
+    runner.run([ExperimentCell(MODEL, "romanized", "zero-shot")])
+# %%
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# the modules in src/ import each other by name, as when the scripts are run from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# keep the persistent stores out of the repository's data/ directory; read when the modules are imported
+_store_dir = tempfile.mkdtemp(prefix="llm-mt-tests-")
+os.environ["RESPONSE_CACHE_PATH"] = os.path.join(_store_dir, "responses.sqlite")
+os.environ["TRANSLATION_MEMORY_PATH"] = os.path.join(_store_dir, "translation_memory.sqlite")
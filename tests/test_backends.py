@@ -0,0 +1,58 @@
+import re
+
+import pytest
+
+from backends import EARLY_STOP_PATTERN, LABELED_LINE_STOP_PATTERN, early_stop_index, make_chat_completion, truncate_completion
+
+
+def test_default_pattern_stops_after_bare_translation_line():
+    stop_pattern = re.compile(EARLY_STOP_PATTERN)
+    text = "Bill No. 4427\nNote: the original refers to a bill."
+    assert text[:early_stop_index(text, stop_pattern)] == "Bill No. 4427"
+
+
+def test_default_pattern_skips_leading_blank_lines():
+    stop_pattern = re.compile(EARLY_STOP_PATTERN)
+    text = "\n\nThank you, Mr. Speaker.\n(Literally: ...)"
+    assert text[:early_stop_index(text, stop_pattern)].strip() == "Thank you, Mr. Speaker."
+
+
+# response shapes found in the results of earlier runs, with the text early stop has to keep
+PREAMBLE_RESPONSES = [
+    ('Here is the translation:\n\n"In the past, we used to hunt caribou."\n\nNote: ...',
+     'Here is the translation:\n\n"In the past, we used to hunt caribou."'),
+    (' The given Inuktitut (Syllabic) text translates to:\n\n"Nunavut Tunngavik Incorporated"\n\nIn English...',
+     ' The given Inuktitut (Syllabic) text translates to:\n\n"Nunavut Tunngavik Incorporated"'),
+    ('The Inuktitut syllabic text you provided translates to:\n\n**"The Inuit in Canada."** \n\n\nLet me know!',
+     'The Inuktitut syllabic text you provided translates to:\n\n**"The Inuit in Canada."**'),
+    ('Here are the translations:\n\nRomanization: Ivalu tukiliujarniaqtaq.\n\nTranslation: The bear swims.\n\nNote: ...',
+     'Here are the translations:\n\nRomanization: Ivalu tukiliujarniaqtaq.\n\nTranslation: The bear swims.'),
+    ("**Translation:**\nThe meeting is adjourned.\n", "**Translation:**\nThe meeting is adjourned."),
+]
+
+
+@pytest.mark.parametrize("response, kept", PREAMBLE_RESPONSES)
+def test_default_pattern_keeps_the_translation_after_a_preamble(response, kept):
+    stop_pattern = re.compile(EARLY_STOP_PATTERN)
+    assert response[:early_stop_index(response, stop_pattern)] == kept
+    # while streaming, the response is never cut off before the translation line is complete
+    for end in range(len(kept)):
+        assert early_stop_index(response[:end], stop_pattern) is None
+
+
+def test_default_pattern_waits_for_the_end_of_the_line():
+    assert early_stop_index("Thank you, Mr.", re.compile(EARLY_STOP_PATTERN)) is None
+
+
+def test_labeled_pattern_waits_for_the_label():
+    stop_pattern = re.compile(LABELED_LINE_STOP_PATTERN)
+    assert early_stop_index("Sure, here it is.\n", stop_pattern) is None
+    text = "Sure, here it is.\n[English]: Thank you.\nmore"
+    assert text[:early_stop_index(text, stop_pattern)] == "Sure, here it is.\n[English]: Thank you."
+
+
+def test_truncate_completion_cuts_every_choice():
+    output = make_chat_completion("stub-model", ["first\nnote", "second\nnote"], 5, 6)
+    truncated = truncate_completion(output, re.compile(EARLY_STOP_PATTERN))
+    assert [choice.message.content for choice in truncated.choices] == ["first", "second"]
+    assert truncated.usage == output.usage
@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+import pytest
+
+from sacrebleu.metrics import CHRF
+
+from consensus import mbr_select, pairwise_chrf
+
+TEXTS = [
+    "Thank you, Mr. Speaker.",
+    "Thank you, Speaker.",
+    "Mr. Speaker, thank you very much.",
+    "ᐅᖃᖅᑏ, ᖁᔭᓐᓇᒦᒃ.",
+    "a",
+    "",
+    "   ",
+    "Motion carried.",
+]
+
+
+def random_texts(n, seed=0):
+    rng = random.Random(seed)
+    alphabet = list("abcde ᐃᓄᒃ.,")
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 15))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("texts", [TEXTS, random_texts(30)])
+def test_pairwise_chrf_matches_sacrebleu(texts):
+    chrf = CHRF()
+    expected = np.array([[chrf.sentence_score(hypothesis, [reference]).score for reference in texts] for hypothesis in texts])
+    np.testing.assert_allclose(pairwise_chrf(texts), expected, atol=1e-9)
+
+
+def test_pairwise_chrf_of_only_empty_texts_is_zero():
+    np.testing.assert_array_equal(pairwise_chrf(["", " "]), np.zeros((2, 2)))
+
+
+def test_mbr_selects_the_candidate_closest_to_the_others():
+    candidates = [
+        "Thank you, Speaker.",
+        "Thank you, Mr. Speaker.",
+        "Thanks, Mr. Speaker.",
+        "Thank you, Mr. Speaker.",
+        "The motion is carried.",
+    ]
+    index, expected_chrf = mbr_select(candidates)
+    # the first of the two identical candidates agreeing most with the rest
+    assert index == 1
+    assert expected_chrf.shape == (5,)
+    assert expected_chrf[1] == expected_chrf[3] == expected_chrf.max()
+    assert expected_chrf[4] == expected_chrf.min()
+
+
+def test_mbr_compares_candidates_without_their_echoed_prefix():
+    candidates = ["[English]: Thank you, Mr. Speaker.", "Thank you, Mr. Speaker.", "Motion carried."]
+    _, expected_chrf = mbr_select(candidates)
+    assert expected_chrf[0] == pytest.approx(expected_chrf[1])
+
+
+def test_mbr_handles_a_single_or_missing_candidate():
+    assert mbr_select(["Thank you."])[0] == 0
+    index, expected_chrf = mbr_select([None, "Thank you.", "Thank you!"])
+    assert index in (1, 2)
+    assert expected_chrf[0] == 0.0
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import openai
+import pandas as pd
+import pytest
+
+import experiment_runner
+from backends import StubBackend
+from checkpoint import checkpoint_path_for
+from response_cache import ResponseCache
+
+
+class FlakyBackend(StubBackend):
+    """Stub backend whose requests for sentences containing "fail" fail while `broken` is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.broken = True
+        self.requests = 0
+
+    async def complete(self, json_data):
+        self.requests += 1
+        if self.broken and "fail" in json_data["messages"][-1]["content"]:
+            raise openai.OpenAIError("injected failure")
+        return await super().complete(json_data)
+
+
+@pytest.fixture
+def tiny_dataset(tmp_path, monkeypatch):
+    path = tmp_path / "tiny.parquet"
+    pd.DataFrame({
+        "source_text": ["tânisi", "fail here", "ekosi", "fail again"],
+        "target_text": ["hello", "failed", "that's it", "failed again"],
+    }).to_parquet(path)
+    monkeypatch.setitem(experiment_runner.DATASETS, "tiny", experiment_runner.Dataset(str(path), "Plains Cree"))
+    return path
+
+
+# with packing, the two failed packs are sent again, and the stub's answers to them fall back to single-sentence
+# requests for the two rows that failed; rows that succeeded come from the checkpoint either way
+@pytest.mark.parametrize("pack_size, retried_requests", [(1, 2), (2, 4)])
+def test_failed_rows_keep_the_checkpoint_and_no_results(tmp_path, tiny_dataset, pack_size, retried_requests):
+    backend = FlakyBackend()
+    runner = experiment_runner.ExperimentRunner(backend=backend, results_dir=str(tmp_path / "results"))
+    runner.response_cache = ResponseCache(path=str(tmp_path / "responses.sqlite"), namespace="stub")
+    cell = experiment_runner.ExperimentCell("stub-model", "tiny", "zero-shot", pack_size=pack_size)
+    out_path = runner.output_path(cell)
+
+    summary = runner.run_cell(cell)
+    assert summary["status"] == "incomplete"
+    assert summary["failed"] == 2
+    assert not os.path.exists(out_path)
+    assert os.path.exists(checkpoint_path_for(out_path))
+
+    # the next run is not skipped and only sends the failed rows again
+    backend.broken = False
+    backend.requests = 0
+    summary = runner.run_cell(cell)
+    assert summary["status"] == "done"
+    assert backend.requests == retried_requests
+    results_df = pd.read_parquet(out_path)
+    assert results_df["response"].notna().all()
+    # without TOKENIZER_PATH, prompt tokens come from the usage the backend reported
+    assert results_df["prompt_tokens"].notna().all()
+    assert not os.path.exists(checkpoint_path_for(out_path))
+
+
+def test_dotenv_is_loaded_before_the_configuration_is_read():
+    # stands in for a .env file setting MAX_RETRIES and BACKEND, read by request_layer and backends on import
+    script = (
+        "import dotenv, os\n"
+        "dotenv.load_dotenv = lambda *args, **kwargs: os.environ.update(MAX_RETRIES='2', BACKEND='stub')\n"
+        "import experiment_runner, request_layer, backends\n"
+        "assert request_layer.MAX_RETRIES == 2, request_layer.MAX_RETRIES\n"
+        "assert backends.BACKEND == 'stub', backends.BACKEND\n"
+    )
+    environment = {key: value for key, value in os.environ.items() if key not in ("MAX_RETRIES", "BACKEND")}
+    environment["PYTHONPATH"] = os.pathsep.join(sys.path)
+    subprocess.run([sys.executable, "-c", script], env=environment, check=True)
@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from few_shot_bank import FewShotExampleBank
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "src")
+
+GOLD_STANDARD = pd.DataFrame(
+    {
+        "source_text": [f"ᐅᖃᖅᑏ {i} ᖁᔭᓐᓇᒦᒃ" for i in range(50)],
+        "target_text": [f"Speaker {i}: thank you." for i in range(50)],
+    },
+    index=range(100, 150),
+)
+SOURCE_TEXTS = [f"ᖁᔭᓐᓇᒦᒃ {i}" for i in range(20)]
+
+
+def prompts(bank):
+    return [(bank.build_messages(text), bank.example_indices(text), bank.examples_text(text)) for text in SOURCE_TEXTS]
+
+
+@pytest.mark.parametrize("n_sets", [1, 4])
+def test_same_seed_gives_the_same_prompts(n_sets):
+    bank = FewShotExampleBank(GOLD_STANDARD, n_shots=5, n_sets=n_sets, seed=7)
+
+    assert prompts(bank) == prompts(FewShotExampleBank(GOLD_STANDARD, n_shots=5, n_sets=n_sets, seed=7))
+    assert prompts(bank) != prompts(FewShotExampleBank(GOLD_STANDARD, n_shots=5, n_sets=n_sets, seed=8))
+
+
+def test_example_sets_are_drawn_without_replacement():
+    bank = FewShotExampleBank(GOLD_STANDARD, n_shots=10, n_sets=3)
+
+    for example_set in bank.example_sets:
+        assert example_set.index.is_unique
+        assert example_set.index.isin(GOLD_STANDARD.index).all()
+    assert len({tuple(example_set.index) for example_set in bank.example_sets}) == 3
+
+
+def test_rows_with_the_same_set_share_its_prefix():
+    bank = FewShotExampleBank(GOLD_STANDARD, n_shots=5, n_sets=4)
+
+    for text in SOURCE_TEXTS:
+        messages = bank.build_messages(text)
+        prefix = bank.prefixes[bank.select(text)]
+        assert messages[:-1] == list(prefix)
+        assert messages[-1] == {"role": "user", "content": f"[Inuktitut (Syllabic)]: {text} \n [English]:"}
+    assert len({bank.select(text) for text in SOURCE_TEXTS}) > 1
+
+
+def test_prompts_do_not_depend_on_the_process(tmp_path):
+    GOLD_STANDARD.to_parquet(tmp_path / "gold.parquet")
+    bank = FewShotExampleBank(GOLD_STANDARD, n_shots=5, n_sets=4)
+    # str hashes are salted per process, so a bank relying on them would pick other sets in a fresh interpreter
+    script = (
+        "import json, sys; import pandas as pd; from few_shot_bank import FewShotExampleBank; "
+        "bank = FewShotExampleBank(pd.read_parquet(sys.argv[1]), n_shots=5, n_sets=4); "
+        "print(json.dumps([bank.build_messages(text) for text in sys.argv[2:]]))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script, str(tmp_path / "gold.parquet"), *SOURCE_TEXTS],
+        cwd=SRC_DIR, env={**os.environ, "PYTHONHASHSEED": "1"}, capture_output=True, text=True, check=True,
+    ).stdout
+
+    assert json.loads(output) == [bank.build_messages(text) for text in SOURCE_TEXTS]
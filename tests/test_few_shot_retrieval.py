@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+from few_shot_retrieval import ExampleRetriever, RetrievalExampleBank
+
+GOLD_STANDARD = pd.DataFrame({
+    "source_text": ["ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ", "ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ .", "ᐅᓪᓛᒃᑯᑦ ᐅᖃᖅᑏ", "ᑕᒪᓐᓇ ᐱᒋᐊᕈᑎ", "ᖁᔭᓐᓇᒦᒃ  ᐅᖃᖅᑏ"],
+    "target_text": ["Thank you, Mr. Speaker", "Thank you, Mr. Speaker.", "Good morning, Mr. Speaker", "This bill", "Thanks, Speaker"],
+})
+
+
+@pytest.mark.parametrize("method", ["tfidf", "bm25"])
+def test_query_leaves_out_examples_of_the_query_sentence(method):
+    retriever = ExampleRetriever(GOLD_STANDARD, method=method)
+    neighbours = retriever.query(["ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ"], k=3)[0]
+    # rows 0 and 4 are the query up to whitespace; the near match in row 1 is still allowed
+    assert 0 not in neighbours and 4 not in neighbours
+    assert neighbours[0] == 1
+
+
+def test_query_raises_when_too_few_other_examples():
+    retriever = ExampleRetriever(GOLD_STANDARD)
+    with pytest.raises(ValueError, match="differ from the sentence"):
+        retriever.query(["ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ"], k=4)
+
+
+def test_bank_does_not_show_the_reference_translation():
+    bank = RetrievalExampleBank(GOLD_STANDARD, n_shots=2, source_texts=["ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ"])
+    examples = bank.examples("ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ")
+    assert "Thank you, Mr. Speaker" not in examples["target_text"].to_list()
+    assert "Thanks, Speaker" not in examples["target_text"].to_list()
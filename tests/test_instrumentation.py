@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from backends import StubBackend
+from instrumentation import RequestMetrics, report_request_metrics, summarize_request_metrics
+from translation_engine import translate_with_metrics
+
+
+def metrics_row(latency, completion_tokens=10, **fields):
+    metrics = RequestMetrics()
+    metrics.queue_seconds = latency / 10
+    metrics.latency_seconds = latency
+    metrics.prompt_tokens = 20
+    metrics.completion_tokens = completion_tokens
+    for field, value in fields.items():
+        setattr(metrics, field, value)
+    return metrics.as_dict()
+
+
+@pytest.fixture
+def metrics_df():
+    rows = [metrics_row(latency) for latency in (1.0, 2.0, 3.0, 4.0)]
+    rows += [
+        metrics_row(0.5, retries=2, ttft_seconds=0.2, tokens_saved=30),
+        metrics_row(100.0, resumed=True, completion_tokens=500),
+        metrics_row(0.0, cached=True),
+        metrics_row(0.0, memory=True),
+        metrics_row(0.0, duplicate=True),
+        metrics_row(0.0, duplicate=True),
+    ]
+    # a row restored from a checkpoint written before the metrics were recorded
+    rows.append({column: None for column in RequestMetrics().as_dict()})
+    return pd.DataFrame(rows)
+
+
+def test_only_requests_sent_count_towards_latency(metrics_df):
+    summary = summarize_request_metrics(metrics_df, elapsed_seconds=10.0)
+
+    assert {name: summary[name] for name in ("requests", "cached", "memory", "duplicates", "retries")} == {
+        "requests": 6, "cached": 1, "memory": 1, "duplicates": 2, "retries": 2,
+    }
+    latencies = pd.Series([1.0, 2.0, 3.0, 4.0, 0.5, 100.0])
+    for percentile in (50, 95, 99):
+        assert summary[f"latency_p{percentile}"] == pytest.approx(latencies.quantile(percentile / 100))
+        assert summary[f"queue_p{percentile}"] == pytest.approx(latencies.quantile(percentile / 100) / 10)
+        # only streamed responses have a time to first token
+        assert summary[f"ttft_p{percentile}"] == pytest.approx(0.2)
+
+
+def test_throughput_leaves_out_resumed_requests(metrics_df):
+    summary = summarize_request_metrics(metrics_df, elapsed_seconds=10.0)
+
+    assert summary["prompt_tokens"] == 5 * 20
+    assert summary["completion_tokens"] == 5 * 10
+    assert summary["completion_tokens_per_second"] == pytest.approx(5.0)
+    assert summary["total_tokens_per_second"] == pytest.approx(15.0)
+    assert (summary["early_stops"], summary["tokens_saved"]) == (1, 30)
+
+
+def test_run_without_requests(metrics_df, capsys):
+    summary = summarize_request_metrics(metrics_df[metrics_df["request_cached"].eq(True)], elapsed_seconds=0.0)
+
+    assert summary["requests"] == 0
+    assert summary["latency_p50"] is None
+    assert summary["completion_tokens_per_second"] is None
+    report_request_metrics(summary)
+    assert "latency: p50 n/a, p95 n/a, p99 n/a" in capsys.readouterr().out
+
+
+def test_summary_of_an_engine_run(tmp_path):
+    source_texts = pd.Series(["ᐅᖃᖅᑏ", "ᖁᔭᓐᓇᒦᒃ", "ᐅᖃᖅᑏ"])
+
+    translations_df = translate_with_metrics(
+        source_texts, lambda text: [{"role": "user", "content": text}], "stub-model", backend=StubBackend(latency=0),
+        checkpoint_path=str(tmp_path / "run.checkpoint.sqlite"), deduplicate=True,
+    )
+    summary = summarize_request_metrics(translations_df, elapsed_seconds=1.0)
+
+    assert (summary["requests"], summary["duplicates"], summary["cached"]) == (2, 1, 0)
+    assert summary["completion_tokens"] == translations_df["request_completion_tokens"][:2].sum()
+    assert summary["latency_p50"] is not None
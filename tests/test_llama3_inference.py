@@ -0,0 +1,105 @@
+import re
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("accelerate")  # device_map="auto"
+tokenizers = pytest.importorskip("tokenizers")
+
+from llama3_inference import PatternStoppingCriteria, TransformersWrapper
+
+SPECIAL_TOKENS = ["<pad>", "<s>", "</s>", "<unk>"]
+CHARACTERS = list("abcdefghij .,\n")
+
+
+def make_tokenizer():
+    """One token per character, so decoded text can be cut exactly where a pattern matches"""
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS + CHARACTERS)}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.BPE(vocab=vocab, merges=[], unk_token="<unk>"))
+    tokenizer.decoder = tokenizers.decoders.Fuse()
+    # prompts start with BOS, like Llama's tokenizer
+    tokenizer.post_processor = tokenizers.processors.TemplateProcessing(
+        single="<s> $A", special_tokens=[("<s>", vocab["<s>"])]
+    )
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+
+
+@pytest.fixture(scope="module")
+def tiny_model_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("tiny-llama")
+    tokenizer = make_tokenizer()
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=128,
+        # large weights give peaked logits, so greedy choices are not near ties that padding could flip
+        initializer_range=1.0,
+        pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    transformers.LlamaForCausalLM(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def wrapper(tiny_model_path):
+    return TransformersWrapper(model_path=tiny_model_path, torch_dtype=torch.float32)
+
+
+# prompts of different lengths, so batches are left-padded
+PROMPTS = ["abc", "a bad face, hid a bead", "j", "fig. jab\nbe", "cab bag hag"]
+
+
+def test_batched_greedy_matches_unbatched(wrapper):
+    unbatched = [wrapper.generate_batch([prompt], 0, 12, batch_size=1)[0] for prompt in PROMPTS]
+    assert wrapper.generate_batch(PROMPTS, 0, 12, batch_size=len(PROMPTS)) == unbatched
+
+
+def test_batched_stop_pattern_cuts_each_row_at_its_own_match(wrapper):
+    unbatched = [wrapper.generate_batch([prompt], 0, 12, batch_size=1)[0] for prompt in PROMPTS]
+    # stop on the first character generated, so at least one row stops early
+    stop_pattern = re.compile(re.escape(next(character for response in unbatched for character in response)))
+    expected = []
+    for response in unbatched:
+        match = stop_pattern.search(response)
+        expected.append(response[:match.end()] if match is not None else response)
+    assert wrapper.generate_batch(PROMPTS, 0, 12, batch_size=len(PROMPTS), stop_pattern=stop_pattern) == expected
+
+
+def test_stopping_criteria_only_reads_generated_tokens():
+    tokenizer = make_tokenizer()
+    criteria = PatternStoppingCriteria(tokenizer, re.compile(r"\n"))
+    # left-padded prompts of different lengths, the second one ending with a newline, then one generated token
+    prompts = [["<pad>", "<pad>", "a", "b"], ["c", "d", "e", "\n"]]
+    generated = [["\n"], ["f"]]
+    input_ids = torch.tensor([tokenizer.convert_tokens_to_ids(p + g) for p, g in zip(prompts, generated)])
+    assert criteria(input_ids, None).tolist() == [True, False]
+    # later calls keep the prompt length found on the first call
+    input_ids = torch.cat([input_ids, torch.tensor([[tokenizer.convert_tokens_to_ids("a")]] * 2)], dim=1)
+    assert criteria(input_ids, None).tolist() == [True, False]
+
+
+def test_completion_length_does_not_count_bos(wrapper):
+    assert wrapper.prompt_length("abc") == 4
+    assert wrapper.completion_length("abc") == 3
+
+
+def test_single_prompt_at_temperature_zero_is_greedy(wrapper):
+    assert wrapper.generate(PROMPTS[1], 0, 12, 1) == wrapper.generate_batch([PROMPTS[1]], 0, 12, batch_size=1)[0]
+
+
+def test_samples_are_not_restricted_to_the_top_token(wrapper):
+    torch.manual_seed(0)
+    samples = wrapper.generate(PROMPTS[1], 5.0, 12, 8)
+    # with top_k=1, every sample was the greedy response
+    assert len(samples) == 8 and len(set(samples)) > 1
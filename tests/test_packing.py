@@ -0,0 +1,50 @@
+import re
+
+import pandas as pd
+
+from backends import StubBackend, make_chat_completion
+from packing import build_packed_messages, demultiplex_numbered_lines, translate_packed
+
+
+class NumberedLinesBackend(StubBackend):
+    """Answers a packed prompt with one numbered line per sentence, followed by a note the early stop should cut off"""
+
+    def __init__(self):
+        super().__init__()
+        self.packed_responses = []
+
+    async def complete(self, json_data):
+        content = json_data["messages"][-1]["content"]
+        lines = re.findall(r"^(\d+)\. (.*)$", content, re.M)
+        response = "\n".join(f"{number}. {text.upper()}" for number, text in lines) + "\nNote: translated literally."
+        self.packed_responses.append(response)
+        return make_chat_completion(json_data["model"], [response], 10, 10)
+
+
+def build_messages(numbered_sentences):
+    return build_packed_messages(numbered_sentences, "Plains Cree", "English", "You are a machine translation system.")
+
+
+def test_demultiplex_numbered_lines():
+    assert demultiplex_numbered_lines("1. one\n2. two", 2) == ["one", "two"]
+    assert demultiplex_numbered_lines("2. two\n1. one", 2) == [None, None]
+    assert demultiplex_numbered_lines("1. one\n2.", 2) == ["one", None]
+
+
+def test_short_final_pack_stops_at_its_own_last_line(tmp_path):
+    source_texts = pd.Series(["a", "b", "c", "d", "e"], index=[10, 11, 12, 13, 14])
+    results_df, requests_df = translate_packed(
+        source_texts,
+        build_messages,
+        build_messages=lambda text: [{"role": "user", "content": text}],
+        model="stub-model",
+        pack_size=2,
+        max_tokens=16,
+        checkpoint_path=str(tmp_path / "checkpoint.sqlite"),
+        early_stop_pattern=r"^\s*\S[^\n]*\n",
+        backend=NumberedLinesBackend(),
+    )
+    assert results_df["response"].to_list() == ["A", "B", "C", "D", "E"]
+    # the final pack holds one sentence, and is cut off after its first line like the others after their second
+    assert results_df["packed_response"].to_list() == ["1. A\n2. B"] * 2 + ["1. C\n2. D"] * 2 + ["1. E"]
+    assert len(requests_df.index) == 3
@@ -0,0 +1,137 @@
+import glob
+import os
+import re
+
+import pandas as pd
+import pytest
+
+from sacrebleu.metrics import BLEU, CHRF
+
+from postprocess import (
+    clean_results,
+    evaluate_results_tree,
+    extract_translation,
+    extract_translation_series,
+    get_hypotheses,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "results")
+
+
+def baseline_extract_translation(text):
+    """extract_translation as first written, one re.findall per format"""
+    patterns = [
+        r"\[English\]:\s*(.*?)(?:\n|$)",
+        r"Translation:\s*\"(.*?)\"",
+        r"translates to:\s*(.*?)(?:\n|$)",
+        r"translation:\s*(.*?)(?:\n|$)",
+    ]
+    translations = []
+    for pattern in patterns:
+        translations.extend(re.findall(pattern, text, re.DOTALL))
+    translations = [t.strip(' "').removeprefix("[English]: ") for t in translations]
+    return [t for t in set(translations)]
+
+
+RESPONSES = [
+    "[English]: The translation: hello",
+    '[English]: "Thank you, Mr. Speaker."\nNote: the translation: is literal',
+    'Here is the translation:\n\nTranslation: "The meeting is adjourned."',
+    ' The given Inuktitut (Syllabic) text translates to: "I am learning Inuktitut." In English, it translates to: "x"',
+    "[English]: [English]: echoed twice",
+    "no known format",
+    "",
+]
+
+
+def real_responses(n_per_file=300):
+    responses = []
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*", "*.parquet"))):
+        df = pd.read_parquet(path)
+        if "response" in df.columns:
+            responses.extend(df["response"].dropna().sample(min(n_per_file, len(df.index)), random_state=0))
+    return responses
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_extract_translation_finds_the_same_translations_as_the_baseline(response):
+    translations = extract_translation(response)
+    assert sorted(translations) == sorted(baseline_extract_translation(response))
+    assert len(translations) == len(set(translations))
+
+
+def test_overlapping_formats_yield_both_translations():
+    assert extract_translation("[English]: The translation: hello") == ["The translation: hello", "hello"]
+
+
+def test_extract_translation_matches_the_baseline_on_real_responses():
+    responses = real_responses()
+    if not responses:
+        pytest.skip("no results files")
+    for response in responses:
+        assert sorted(extract_translation(response)) == sorted(baseline_extract_translation(response))
+
+
+def test_series_matches_per_response_extraction():
+    responses = pd.Series(RESPONSES + [None] + real_responses(50))
+    expected = [extract_translation(response if pd.notna(response) else "") for response in responses]
+    assert extract_translation_series(responses).to_list() == expected
+
+
+def test_get_hypotheses():
+    df = pd.DataFrame({"response": ["[English]: Thank you.\nNote: literal", "Good morning.", None]})
+    assert get_hypotheses(df).to_list() == [clean_results(r if pd.notna(r) else "") for r in df["response"]]
+    # extraction takes the first translation found, and keeps the cleaned response where there is none
+    assert get_hypotheses(df, extract=True).to_list() == ["Thank you.", "Good morning.", ""]
+
+
+TARGETS = ["Thank you, Mr. Speaker.", "Question period is over.", "Motion carried."]
+
+
+@pytest.fixture
+def results_tree(tmp_path):
+    results_dir = tmp_path / "results"
+    few_shot_dir = results_dir / "Meta-Llama-3.1-8B-Instruct" / "few-shot-results"
+    zero_shot_dir = results_dir / "gemma-2-9b-it"
+    few_shot_dir.mkdir(parents=True)
+    zero_shot_dir.mkdir(parents=True)
+    pd.DataFrame({"target_text": TARGETS, "response": ["[English]: Thank you, Speaker.", "Question period is over.", None]}) \
+        .to_parquet(few_shot_dir / "10-few-shot.parquet")
+    pd.DataFrame({"target_text": TARGETS, "translated_text": ["Thank you.", "Question period.", "Motion carried."]}) \
+        .to_parquet(zero_shot_dir / "zero-shot.parquet")
+    # neither a response nor a translated_text column
+    pd.DataFrame({"target_text": TARGETS}).to_parquet(zero_shot_dir / "broken.parquet")
+    # a metrics table from an earlier run
+    pd.DataFrame({"bleu": [1.0]}).to_parquet(results_dir / "metrics.parquet")
+    return results_dir
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_results_tree_is_scored_file_by_file(results_tree, n_workers, capsys):
+    metrics_df = evaluate_results_tree(
+        str(results_tree), n_workers=n_workers, exclude=[str(results_tree / "metrics.parquet")]
+    )
+
+    assert metrics_df[["model", "experiment", "n_shots", "n_sentences"]].to_dict("records") == [
+        {"model": "Meta-Llama-3.1-8B-Instruct", "experiment": "10-few-shot", "n_shots": 10, "n_sentences": 3},
+        {"model": "gemma-2-9b-it", "experiment": "zero-shot", "n_shots": 0, "n_sentences": 3},
+    ]
+    hypotheses = [
+        [clean_results(response) for response in ("[English]: Thank you, Speaker.", "Question period is over.", "")],
+        ["Thank you.", "Question period.", "Motion carried."],
+    ]
+    for row, row_hypotheses in zip(metrics_df.itertuples(), hypotheses):
+        assert row.bleu == pytest.approx(BLEU().corpus_score(row_hypotheses, [TARGETS]).score)
+        assert row.chrf == pytest.approx(CHRF().corpus_score(row_hypotheses, [TARGETS]).score)
+    assert "Could not evaluate" in capsys.readouterr().out
+
+
+def test_extracted_translations_are_scored(results_tree):
+    metrics_df = evaluate_results_tree(str(results_tree), exclude=[str(results_tree / "metrics.parquet")], extract=True)
+
+    hypotheses = ["Thank you, Speaker.", "Question period is over.", ""]
+    assert metrics_df["bleu"][0] == pytest.approx(BLEU().corpus_score(hypotheses, [TARGETS]).score)
+
+
+def test_empty_results_tree(tmp_path):
+    assert evaluate_results_tree(str(tmp_path)).empty
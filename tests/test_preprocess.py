@@ -0,0 +1,148 @@
+import os
+import random
+
+import pandas as pd
+import pytest
+
+from manifest import BuildManifest
+from preprocess import (
+    PreprocessingJob,
+    clean_and_process_inuktitut_series,
+    clean_and_process_inuktitut_text,
+    fix_cree_punctuation,
+    fix_cree_punctuation_series,
+    preprocess_cree,
+    preprocess_inuktitut_split,
+    run_preprocessing_jobs,
+    word_count_excluding_punctuation,
+    word_count_excluding_punctuation_series,
+)
+
+# no-break spaces, syllabics, accented letters, entities and punctuation, where Python's `re` and the regex engine
+# of the pyarrow string dtype disagree
+ALPHABET = list("aé ᐃᓄᒃᑎᑐᑦ_.,!?;:@&'-") + ["\xa0", " ", "\t", "@-@", "&amp;", "'s"]
+
+EXAMPLES = [
+    "- :  \xa0!:!:@&;",
+    "é,&\xa0ᐃa@ᐃ_:\xa0?",
+    "ᐅᖃᖅᑏ , ᖁᔭᓐᓇᒦᒃ .",
+    "Mr.\xa0Speaker ,  the member 's question",
+    "Bill No. 4427 @-@ An Act &amp; more",
+    "",
+]
+
+
+def random_texts(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 20)))
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("dtype", [object, "str"])
+@pytest.mark.parametrize("per_string, vectorized", [
+    (word_count_excluding_punctuation, word_count_excluding_punctuation_series),
+    (clean_and_process_inuktitut_text, clean_and_process_inuktitut_series),
+    (fix_cree_punctuation, fix_cree_punctuation_series),
+])
+def test_series_helpers_match_per_string_helpers(per_string, vectorized, dtype):
+    texts = pd.Series(EXAMPLES + random_texts(500), dtype=dtype)
+    expected = [per_string(text) for text in texts]
+    assert vectorized(texts).tolist() == expected
+
+
+def write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+@pytest.fixture
+def inuktitut_split_dir(tmp_path):
+    corpus_dir = tmp_path / "tc"
+    corpus_dir.mkdir()
+    texts = EXAMPLES + random_texts(200, seed=1)
+    # blank lines are dropped while reading and short targets by the word count filter, so rows keep gaps in their index
+    write_lines(corpus_dir / "test.iu", [f"ᐅᖃᖅᑏ , {text}" for text in texts] + [""])
+    write_lines(corpus_dir / "test.en", [f"The member 's question , {text}" if i % 3 else text for i, text in enumerate(texts)] + ["x"])
+    return corpus_dir
+
+
+@pytest.fixture
+def cree_dir(tmp_path):
+    corpus_dir = tmp_path / "plains-cree"
+    corpus_dir.mkdir()
+    for name, seed in (("a", 2), ("b", 3)):
+        texts = random_texts(60, seed=seed)
+        write_lines(corpus_dir / f"{name}_cr.txt", [f"{text} ." for text in texts])
+        write_lines(corpus_dir / f"{name}_en.txt", [f"{text} ?" for text in texts])
+    return corpus_dir
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_chunked_inuktitut_split_matches_unchunked(inuktitut_split_dir, tmp_path, chunk_size):
+    preprocess_inuktitut_split(str(inuktitut_split_dir), str(tmp_path / "full.parquet"), split="test", chunk_size=None)
+    preprocess_inuktitut_split(str(inuktitut_split_dir), str(tmp_path / "chunked.parquet"), split="test", chunk_size=chunk_size)
+
+    expected = pd.read_parquet(tmp_path / "full.parquet")
+    assert 0 < len(expected.index) < len(EXAMPLES) + 200
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "chunked.parquet"), expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_chunked_cree_matches_unchunked(cree_dir, tmp_path, chunk_size):
+    preprocess_cree(str(cree_dir), str(tmp_path / "full.parquet"), chunk_size=None)
+    preprocess_cree(str(cree_dir), str(tmp_path / "chunked.parquet"), chunk_size=chunk_size)
+
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "chunked.parquet"), pd.read_parquet(tmp_path / "full.parquet"))
+
+
+def write_output(output_path, n_workers=None):
+    with open(output_path, "w") as f:
+        f.write(f"{os.getpid()} {n_workers}")
+
+
+def make_jobs(tmp_path, n_pooled):
+    jobs = [
+        PreprocessingJob(f"split-{i}", write_output, {}, [], str(tmp_path / f"split-{i}.txt"), "v1")
+        for i in range(n_pooled)
+    ]
+    jobs.append(PreprocessingJob("gold-standard", write_output, {}, [], str(tmp_path / "gold.txt"), "v1", multiprocess=True))
+    return jobs
+
+
+@pytest.mark.parametrize("n_workers, n_pooled, expected_workers", [(8, 3, 5), (4, 3, 1), (4, 6, 1), (4, 0, 4)])
+def test_multiprocess_jobs_get_the_workers_the_pool_leaves_free(tmp_path, n_workers, n_pooled, expected_workers):
+    jobs = make_jobs(tmp_path, n_pooled)
+
+    failed = run_preprocessing_jobs(jobs, n_workers=n_workers, manifest_path=str(tmp_path / "manifest.json"))
+
+    assert failed == []
+    # the multiprocess job is not nested in a pool worker, it runs its own pool from the main process
+    assert (tmp_path / "gold.txt").read_text() == f"{os.getpid()} {expected_workers}"
+    for job in jobs[:-1]:
+        pid, job_workers = open(job.output).read().split()
+        assert int(pid) != os.getpid() and job_workers == "None"
+    assert BuildManifest(str(tmp_path / "manifest.json")).is_up_to_date(jobs[-1].output, [], "v1")
+
+
+def edit_input_then_write_output(output_path, input_path):
+    with open(input_path, "a") as f:
+        f.write("edited while building\n")
+    write_output(output_path)
+
+
+@pytest.mark.parametrize("multiprocess", [False, True])
+def test_inputs_edited_during_a_build_are_rebuilt_next_run(tmp_path, multiprocess):
+    input_path = tmp_path / "test.iu"
+    input_path.write_text("original\n")
+    manifest_path = str(tmp_path / "manifest.json")
+    job = PreprocessingJob(
+        "split", edit_input_then_write_output, {"input_path": str(input_path)}, [str(input_path)],
+        str(tmp_path / "split.txt"), "v1", multiprocess=multiprocess,
+    )
+    if multiprocess:
+        job = job._replace(function=lambda output_path, input_path, n_workers: edit_input_then_write_output(output_path, input_path))
+
+    assert run_preprocessing_jobs([job], manifest_path=manifest_path) == []
+
+    assert not BuildManifest(manifest_path).is_up_to_date(job.output, job.inputs, job.version)
@@ -0,0 +1,95 @@
+import string
+
+import pytest
+
+from prompt_budget import BudgetedPromptBuilder, PromptTokenCounter
+
+SYLLABICS = "ᐃᐅᐊᐱᐳᐸᑎᑐᑕᑭᑯᑲᒥᒧᒪᓂᓄᓇᓯᓱᓴᓕᓗᓚᔨᔪᔭᕆᕈᕋᖃᖅᑦᒃᓐᖏᔾᓪᕐᑏᒦ"
+# chat template of Meta-Llama-3-8B-Instruct
+LLAMA3_CHAT_TEMPLATE = (
+    "{% set loop_messages = messages %}{% for message in loop_messages %}"
+    "{% set content = '<|start_header_id|>' + message['role'] + '<|end_header_id|>\n\n'+ message['content'] | trim "
+    "+ '<|eot_id|>' %}{% if loop.index0 == 0 %}{% set content = bos_token + content %}{% endif %}{{ content }}"
+    "{% endfor %}{% if add_generation_prompt %}{{ '<|start_header_id|>assistant<|end_header_id|>\n\n' }}{% endif %}"
+)
+
+
+class WordTokenizer:
+    """One token per word and no chat template"""
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": text.split()}
+
+
+class Llama3CharacterTokenizer:
+    """One token per character and special token, applying the Llama 3 chat template without transformers"""
+
+    chat_template = LLAMA3_CHAT_TEMPLATE
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": list(text)}
+
+    def apply_chat_template(self, messages, tokenize=True, add_generation_prompt=True):
+        tokens = ["<|begin_of_text|>"]
+        for message in messages:
+            tokens += ["<|start_header_id|>", *message["role"], "<|end_header_id|>", "\n", "\n"]
+            tokens += [*message["content"].strip(), "<|eot_id|>"]
+        if add_generation_prompt:
+            tokens += ["<|start_header_id|>", *"assistant", "<|end_header_id|>", "\n", "\n"]
+        return tokens
+
+
+def few_shot_messages(source_text, n_examples=10):
+    messages = [{"role": "system", "content": "You translate Inuktitut (Syllabic) to English."}]
+    for i in range(n_examples):
+        messages += [
+            {"role": "user", "content": f"ᐅᖃᖅᑏ {i} ᖁᔭᓐᓇᒦᒃ"},
+            {"role": "assistant", "content": f"Speaker {i}: thank you, Mr. Premier."},
+        ]
+    return messages + [{"role": "user", "content": source_text}]
+
+
+def test_truncation_is_reported_once(capsys):
+    builder = BudgetedPromptBuilder(few_shot_messages, PromptTokenCounter(WordTokenizer()), budget=30)
+    for source_text in ("ᐅᖃᖅᑏ", "ᐅᖃᖅᑏ ᖁᔭᓐᓇᒦᒃ", "ᐅᖃᖅᑏ ᖁᔭᓐᓇᒦᒃ ᐅᖃᖅᑏ"):
+        builder.build_messages(source_text)
+    assert capsys.readouterr().out == ""
+
+    builder.report()
+
+    assert capsys.readouterr().out == "Prompt budget of 30 tokens: examples dropped from 3 of 3 prompts, up to 8 per prompt\n"
+
+
+@pytest.fixture(scope="module", params=["python", "transformers"])
+def llama3_tokenizer(request):
+    if request.param == "python":
+        return Llama3CharacterTokenizer()
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    special_tokens = ["<unk>", "<|begin_of_text|>", "<|start_header_id|>", "<|end_header_id|>", "<|eot_id|>"]
+    characters = sorted(set(string.printable + SYLLABICS))
+    vocab = {token: i for i, token in enumerate(special_tokens + characters)}
+    # one token per character, so every message is tokenized the same alone and inside the template
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizers.Tokenizer(tokenizers.models.BPE(vocab=vocab, merges=[], unk_token="<unk>")),
+        bos_token="<|begin_of_text|>",
+        eos_token="<|eot_id|>",
+        unk_token="<unk>",
+        additional_special_tokens=["<|start_header_id|>", "<|end_header_id|>"],
+    )
+    tokenizer.chat_template = LLAMA3_CHAT_TEMPLATE
+    return tokenizer
+
+
+@pytest.mark.parametrize("drop_examples_from", ["start", "end"])
+@pytest.mark.parametrize("budget", [100, 250, 400, 10_000])
+def test_budget_is_never_exceeded_with_the_chat_template(llama3_tokenizer, budget, drop_examples_from):
+    builder = BudgetedPromptBuilder(
+        few_shot_messages, PromptTokenCounter(llama3_tokenizer), budget=budget, drop_examples_from=drop_examples_from
+    )
+    for source_text in ("ᐅᖃᖅᑏ", "ᐅᖃᖅᑏ ᖁᔭᓐᓇᒦᒃ " * 5, "ᖁᔭᓐᓇᒦᒃ " * 40):
+        messages = builder.build_messages(source_text)
+        templated = llama3_tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+
+        assert len(templated) <= builder.prompt_tokens(source_text)
+        assert len(templated) <= budget or builder.n_examples(source_text) == 0
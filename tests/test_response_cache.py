@@ -0,0 +1,93 @@
+import sqlite3
+
+from backends import OpenAIBackend, stub_completion
+from response_cache import EARLY_STOP_FIELD, ResponseCache, make_cache_key
+
+REQUEST = {
+    "model": "stub-model",
+    "messages": [{"role": "user", "content": "Translate: ᐅᖃᖅᑏ"}],
+    "temperature": 0,
+    "max_tokens": 128,
+}
+
+
+def test_early_stop_pattern_changes_key():
+    truncated = {**REQUEST, EARLY_STOP_FIELD: r"^\s*\S[^\n]*\n"}
+    assert make_cache_key(REQUEST) != make_cache_key(truncated)
+    assert make_cache_key(REQUEST, "stub") != make_cache_key(truncated, "stub")
+
+
+def test_different_stop_patterns_have_different_keys():
+    first = {**REQUEST, EARLY_STOP_FIELD: r"^\s*\S[^\n]*\n"}
+    second = {**REQUEST, EARLY_STOP_FIELD: r"\[English\]:[^\n]*\n"}
+    assert make_cache_key(first) != make_cache_key(second)
+
+
+def test_key_ignores_fields_that_do_not_change_the_output():
+    assert make_cache_key(REQUEST) == make_cache_key({**REQUEST, "stream": True, "timeout": 30})
+
+
+def request(i):
+    return {**REQUEST, "messages": [{"role": "user", "content": f"Translate: {i} ᐅᖃᖅᑏ"}]}
+
+
+def stored_size(cache):
+    return cache.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def test_running_size_matches_the_stored_responses(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite"), max_bytes=10**9, namespace="stub")
+    for i in range(5):
+        cache.put(request(i), stub_completion(request(i)))
+    # overwriting an entry replaces its size instead of adding to it
+    cache.put(request(0), stub_completion({**request(0), "messages": [{"role": "user", "content": "longer " * 20}]}))
+
+    assert cache.stats()["size_bytes"] == stored_size(cache)
+    assert cache.stats()["entries"] == 5
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry_size = len(stub_completion(request(0)).model_dump_json().encode("utf-8"))
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite"), max_bytes=3 * entry_size + 10, namespace="stub")
+    for i in range(3):
+        cache.put(request(i), stub_completion(request(i)))
+    assert cache.get(request(0)) is not None
+
+    cache.put(request(3), stub_completion(request(3)))
+
+    assert cache.get(request(1)) is None
+    assert all(cache.get(request(i)) is not None for i in (0, 2, 3))
+    assert cache.stats()["size_bytes"] == stored_size(cache) <= cache.max_bytes
+
+
+def test_existing_cache_gets_its_size_table(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE responses ("
+        "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+    )
+    connection.executemany("INSERT INTO responses VALUES (?, ?, ?, ?)", [("a", "{}", 100, 1.0), ("b", "{}", 50, 2.0)])
+    connection.commit()
+    connection.close()
+
+    cache = ResponseCache(path=path, namespace="stub")
+    assert cache.stats()["size_bytes"] == 150
+    # reopening does not count the entries twice
+    assert ResponseCache(path=path, namespace="stub").stats()["size_bytes"] == 150
+
+
+def test_caches_without_a_namespace_are_kept_apart_by_endpoint(tmp_path, monkeypatch):
+    path = str(tmp_path / "responses.sqlite")
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://node-1:8000/v1")
+    ResponseCache(path=path).put(REQUEST, stub_completion(REQUEST))
+
+    assert ResponseCache(path=path).get(REQUEST) is not None
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://node-2:8000/v1/")
+    assert ResponseCache(path=path).get(REQUEST) is None
+
+
+def test_openai_backend_namespace_is_its_endpoint(monkeypatch):
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    assert OpenAIBackend().cache_namespace == "https://api.openai.com/v1"
+    assert OpenAIBackend(base_url="http://node-1:8000/v1/").cache_namespace == "http://node-1:8000/v1"
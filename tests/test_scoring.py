@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from sacrebleu.metrics import BLEU, CHRF
+
+import utils
+from postprocess import TranslationScorer
+
+HYPOTHESES = [
+    "The Speaker: Thank you, Mr. Premier.",
+    "I would like to thank the members of the committee.",
+    "ᐅᖃᖅᑏ: ᖁᔭᓐᓇᒦᒃ.",
+    "",
+    "Question period is over",
+    "Motion carried, the bill is referred to committee of the whole.",
+]
+REFERENCES = [
+    "Speaker: Thank you, Premier.",
+    "I would like to thank the committee members.",
+    "Speaker: Thank you.",
+    "Item 5. Oral Questions",
+    "Question period is over.",
+    "Motion carried and the bill is referred to the Committee of the Whole.",
+]
+
+
+@pytest.fixture(scope="module")
+def scores():
+    return TranslationScorer().score(HYPOTHESES, REFERENCES)
+
+
+def test_sentence_scores_match_sacrebleu(scores):
+    sentence_bleu, chrf = BLEU(effective_order=True), CHRF()
+    for hypothesis, reference, bleu_score, chrf_score in zip(
+        HYPOTHESES, REFERENCES, scores["sentence_bleu"], scores["sentence_chrf"]
+    ):
+        assert bleu_score == pytest.approx(sentence_bleu.sentence_score(hypothesis, [reference]).score)
+        assert chrf_score == pytest.approx(chrf.sentence_score(hypothesis, [reference]).score)
+
+
+def test_corpus_scores_match_sacrebleu(scores):
+    assert scores["corpus_bleu"].score == pytest.approx(BLEU().corpus_score(HYPOTHESES, [REFERENCES]).score)
+    assert scores["corpus_chrf"].score == pytest.approx(CHRF().corpus_score(HYPOTHESES, [REFERENCES]).score)
+
+
+def test_eval_results_uses_translation_scorer(scores):
+    res_df = pd.DataFrame({"target_text": REFERENCES, "translated_text": HYPOTHESES})
+
+    res_df = utils.eval_results(res_df)
+
+    assert res_df["bleu_scores"].tolist() == pytest.approx(scores["sentence_bleu"].tolist())
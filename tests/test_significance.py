@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sacrebleu.metrics import BLEU, CHRF
+
+from postprocess import TranslationScorer
+from significance import (
+    compare_results_files,
+    corpus_bleu_from_stats,
+    corpus_chrf_from_stats,
+    paired_bootstrap_test,
+)
+
+WORDS = ["thank", "you", "mr.", "speaker", "the", "motion", "is", "carried", "ᐅᖃᖅᑏ", "ᖁᔭᓐᓇᒦᒃ", ",", "."]
+
+
+def random_sentences(n, seed):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 8))) for _ in range(n)]
+
+
+HYPOTHESES = random_sentences(40, seed=0) + ["", "thank you", "Thank you, Mr. Speaker."]
+REFERENCES = random_sentences(40, seed=1) + ["Thank you, Mr. Speaker.", "", "Thank you, Mr. Speaker."]
+
+
+def resampled_subsets(n_samples=50, seed=0):
+    """Bootstrap resamples as per-sentence counts, plus small subsets where an n-gram order or a match is missing"""
+    rng = np.random.default_rng(seed)
+    n_sentences = len(HYPOTHESES)
+    weights = list(rng.multinomial(n_sentences, np.full(n_sentences, 1.0 / n_sentences), size=n_samples))
+    for indices in ([40], [41], [42], [40, 41], rng.choice(n_sentences, size=3, replace=False)):
+        subset = np.zeros(n_sentences, dtype=np.int64)
+        subset[indices] = 1
+        weights.append(subset)
+    return np.array(weights)
+
+
+@pytest.fixture(scope="module")
+def sentence_stats():
+    return TranslationScorer().sentence_statistics(HYPOTHESES, REFERENCES)
+
+
+@pytest.mark.parametrize("metric, score_fn, stats_index", [
+    (BLEU(), corpus_bleu_from_stats, 0),
+    (CHRF(), corpus_chrf_from_stats, 1),
+])
+def test_vectorized_scores_match_sacrebleu_on_resampled_subsets(sentence_stats, metric, score_fn, stats_index):
+    weights = resampled_subsets()
+
+    scores = score_fn(weights @ sentence_stats[stats_index])
+
+    for subset_weights, score in zip(weights, scores):
+        hypotheses = [h for h, count in zip(HYPOTHESES, subset_weights) for _ in range(count)]
+        references = [r for r, count in zip(REFERENCES, subset_weights) for _ in range(count)]
+        assert score == pytest.approx(metric.corpus_score(hypotheses, [references]).score)
+
+
+def test_bootstrap_is_reproducible_and_brackets_the_observed_scores(sentence_stats):
+    bleu_stats = sentence_stats[0]
+    system_stats = TranslationScorer().sentence_statistics(REFERENCES, REFERENCES)[0]
+
+    result = paired_bootstrap_test(bleu_stats, system_stats, corpus_bleu_from_stats, n_samples=200, batch_size=64)
+
+    assert result == paired_bootstrap_test(bleu_stats, system_stats, corpus_bleu_from_stats, n_samples=200, batch_size=64)
+    assert result["baseline_ci"][0] <= result["baseline_score"] <= result["baseline_ci"][1]
+    assert result["system_score"] == pytest.approx(100.0)
+    assert result["p_value"] < 0.05
+
+
+def test_missing_references_are_compared_as_equal(tmp_path):
+    targets = pd.Series(["Thank you, Mr. Speaker.", None, "Motion carried."], dtype="str")
+    pd.DataFrame({"target_text": targets, "translated_text": ["Thank you.", "", "Motion carried."]}) \
+        .to_parquet(tmp_path / "baseline.parquet")
+    pd.DataFrame({"target_text": targets, "translated_text": ["Thank you, Speaker.", "", "Motion carried."]}) \
+        .to_parquet(tmp_path / "system.parquet")
+
+    comparison_df = compare_results_files(
+        str(tmp_path / "baseline.parquet"), str(tmp_path / "system.parquet"), n_samples=20, n_trials=20
+    )
+
+    assert comparison_df["metric"].tolist() == ["bleu", "chrf"]
+
+
+def test_different_references_are_rejected(tmp_path):
+    pd.DataFrame({"target_text": ["Thank you.", None], "translated_text": ["Thank you.", ""]}) \
+        .to_parquet(tmp_path / "baseline.parquet")
+    pd.DataFrame({"target_text": ["Thank you.", "Motion carried."], "translated_text": ["Thank you.", ""]}) \
+        .to_parquet(tmp_path / "system.parquet")
+
+    with pytest.raises(ValueError, match="same references"):
+        compare_results_files(str(tmp_path / "baseline.parquet"), str(tmp_path / "system.parquet"))
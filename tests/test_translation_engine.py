@@ -0,0 +1,118 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from backends import BackendError, StubBackend, TransformersBackend, make_chat_completion, normalize_errors
+from request_layer import RequestLayer
+from response_cache import ResponseCache
+from translation_engine import translate_with_metrics
+from translation_memory import TranslationMemory
+
+SOURCE_TEXTS = pd.Series(["ᐅᖃᖅᑏ", "ᖁᔭᓐᓇᒦᒃ", "ᐅᖃᖅᑏ"], index=[3, 5, 8])
+
+
+def build_messages(source_text):
+    return [{"role": "user", "content": f"Translate: {source_text}"}]
+
+
+def translate(tmp_path, **kwargs):
+    return translate_with_metrics(
+        SOURCE_TEXTS,
+        build_messages,
+        "stub-model",
+        backend=StubBackend(latency=0),
+        checkpoint_path=str(tmp_path / "run.checkpoint.sqlite"),
+        cache=ResponseCache(path=str(tmp_path / "responses.sqlite"), namespace="stub"),
+        translation_memory=TranslationMemory(path=str(tmp_path / "memory.sqlite"), namespace="stub"),
+        **kwargs,
+    )
+
+
+def test_translates_inside_a_running_event_loop(tmp_path):
+    (tmp_path / "outside").mkdir()
+    (tmp_path / "inside").mkdir()
+    expected = translate(tmp_path / "outside")
+
+    async def notebook_cell():
+        return translate(tmp_path / "inside")
+
+    translations_df = asyncio.run(notebook_cell())
+
+    assert translations_df["response"].tolist() == expected["response"].tolist()
+    assert translations_df.index.tolist() == [3, 5, 8]
+
+
+def test_rows_are_not_printed(tmp_path, capsys):
+    translate(tmp_path)
+    output = capsys.readouterr().out
+    assert all(source_text not in output for source_text in SOURCE_TEXTS)
+
+
+class BrokenStubBackend(StubBackend):
+    """Stub backend that fails with a non-API error, like a local model would, for prompts containing "bad" """
+
+    async def complete(self, json_data):
+        if "bad" in json_data["messages"][-1]["content"]:
+            raise RuntimeError("CUDA out of memory")
+        return await super().complete(json_data)
+
+
+class FakeWrapper:
+    """Stands in for `llama3_inference.TransformersWrapper`, failing generation for batches containing "bad" """
+
+    def generate_batch(self, prompts, temperature, max_tokens, n, batch_size, stop_pattern=None):
+        if any("bad" in prompt[-1]["content"] for prompt in prompts):
+            raise RuntimeError("CUDA out of memory")
+        return [f"translated {prompt[-1]['content']}" for prompt in prompts]
+
+    def prompt_length(self, messages):
+        return 1
+
+    def completion_length(self, content):
+        return 1
+
+
+@pytest.mark.parametrize("make_backend", [
+    lambda: BrokenStubBackend(latency=0),
+    lambda: TransformersBackend(FakeWrapper(), batch_size=1),
+])
+def test_backend_errors_only_fail_their_row(tmp_path, make_backend):
+    source_texts = pd.Series(["ᐅᖃᖅᑏ", "bad ᖁᔭᓐᓇᒦᒃ", "ᖁᔭᓐᓇᒦᒃ"])
+
+    translations_df = translate_with_metrics(
+        source_texts, build_messages, "stub-model", backend=make_backend(), request_layer=RequestLayer(max_retries=2),
+    )
+
+    assert translations_df["response"].isna().tolist() == [False, True, False]
+    # a backend error is not transient, so it is not retried
+    assert translations_df["request_retries"].tolist()[1] == 0
+
+
+def test_normalized_errors_keep_their_cause():
+    async def complete(json_data):
+        raise ValueError("prompt too long")
+
+    with pytest.raises(BackendError, match="ValueError: prompt too long") as error:
+        asyncio.run(normalize_errors(complete)({}))
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+class SamplingStubBackend(StubBackend):
+    """Answers every request with the same fixed candidates, one per sample"""
+
+    candidates = ["Thank you, Speaker.", "Motion carried.", "Thank you, Mr. Speaker.", "Thank you, Mr. Speaker!"]
+
+    async def complete(self, json_data):
+        return make_chat_completion(json_data["model"], self.candidates[:json_data["n"]], completion_tokens=4)
+
+
+def test_sampled_rows_keep_the_consensus_and_their_candidates(tmp_path):
+    translations_df = translate_with_metrics(
+        SOURCE_TEXTS, build_messages, "stub-model", backend=SamplingStubBackend(latency=0), n=4, temperature=0.7,
+        checkpoint_path=str(tmp_path / "run.checkpoint.sqlite"),
+    )
+
+    assert translations_df["response"].tolist() == ["Thank you, Mr. Speaker."] * 3
+    assert translations_df["candidates"].tolist() == [SamplingStubBackend.candidates] * 3
+    assert all(len(scores) == 4 for scores in translations_df["candidate_chrf"])
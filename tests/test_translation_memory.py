@@ -0,0 +1,14 @@
+import pandas as pd
+
+from translation_memory import deduplicate_source_texts
+
+
+def test_repeats_share_the_first_row_and_keep_its_original_text():
+    source_texts = pd.Series(
+        ["ᖁᔭᓐᓇᒦᒃ , ᐅᖃᖅᑏ .", "tânisi", "ᖁᔭᓐᓇᒦᒃ, ᐅᖃᖅᑏ.", "Bill &amp; Act"],
+        index=[10, 11, 12, 13],
+    )
+    unique_texts, representatives = deduplicate_source_texts(source_texts)
+    # the cleaned text groups rows 10 and 12, but the prompt is built from row 10 as written
+    assert unique_texts.to_dict() == {10: "ᖁᔭᓐᓇᒦᒃ , ᐅᖃᖅᑏ .", 11: "tânisi", 13: "Bill &amp; Act"}
+    assert representatives.to_dict() == {10: 10, 11: 11, 12: 10, 13: 13}
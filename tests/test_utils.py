@@ -0,0 +1,65 @@
+import os
+
+from xml.etree import ElementTree
+
+import pandas as pd
+import pytest
+
+import preprocess
+import utils
+
+
+def fake_extract_and_align(file_prefix):
+    if "broken" in file_prefix:
+        raise ValueError("unaligned sentences")
+    return pd.DataFrame({"source_text": [f"{file_prefix} iu"], "target_text": [f"{file_prefix} en"]})
+
+
+@pytest.fixture
+def gold_standard_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "extract_and_align_gold_standard", fake_extract_and_align)
+    for annotator in ("annotator1-consensus", "annotator2-consensus"):
+        os.makedirs(tmp_path / annotator)
+    return tmp_path
+
+
+def add_files(directory, *names):
+    for name in names:
+        (directory / "annotator1-consensus" / f"{name}.xml").write_text("")
+
+
+def test_failed_files_are_skipped_by_default(gold_standard_dir):
+    add_files(gold_standard_dir, "a", "broken")
+    gold_standard_df = utils.load_consensus_gold_standards(str(gold_standard_dir))
+    assert len(gold_standard_df.index) == 1
+
+
+def test_failed_files_raise_unless_skipped(gold_standard_dir):
+    add_files(gold_standard_dir, "a", "broken")
+    with pytest.raises(ValueError, match="1 of 2 gold standard files failed"):
+        utils.load_consensus_gold_standards(str(gold_standard_dir), skip_failures=False)
+
+
+def test_no_loaded_files_raises_a_clear_error(gold_standard_dir):
+    with pytest.raises(ValueError, match="No gold standard files"):
+        utils.load_consensus_gold_standards(str(gold_standard_dir))
+    add_files(gold_standard_dir, "broken")
+    with pytest.raises(ValueError, match="None of the 1 gold standard files"):
+        utils.load_consensus_gold_standards(str(gold_standard_dir))
+
+
+def test_partial_gold_standard_is_not_written(gold_standard_dir, tmp_path):
+    add_files(gold_standard_dir, "a", "broken")
+    output_path = tmp_path / "gold_standard.parquet"
+    with pytest.raises(ValueError):
+        preprocess.preprocess_gold_standard(str(gold_standard_dir), str(output_path))
+    assert not output_path.exists()
+
+
+def test_index_sentences_keeps_the_first_of_a_repeated_id():
+    root = ElementTree.fromstring(
+        '<doc><p><s id="1">ᐅᖃᖅᑏ</s><s id="2">ᖁᔭᓐᓇᒦᒃ</s></p><p><s id="1">duplicate</s></p></doc>'
+    )
+    index = utils.index_sentences(root)
+    assert index == {"1": "ᐅᖃᖅᑏ", "2": "ᖁᔭᓐᓇᒦᒃ"}
+    assert all(index[sid] == root.find(f"./p/s[@id='{sid}']").text for sid in index)